@@ -26,7 +26,207 @@ from torch.distributions import Normal, Binomial
 from torch.nn import functional as f
 
 
-class Agent(abc.ABC):
+class LedgerAccount:
+    """
+    Gives an agent a trade history which can be backed by the fill ledger of a market environment
+    """
+    ledger = None
+    ledger_slot = None
+
+    @property
+    def all_trades(self) -> ndarray:
+        """
+        Trade history as rows of (price, -volume) for buys and (price, volume) for sells
+        """
+        if self.ledger is None:
+            return self._all_trades
+        return self.ledger.agent_trades(self.ledger_slot, self._all_trades)
+
+    @all_trades.setter
+    def all_trades(self, all_trades: ndarray) -> NoReturn:
+        self._all_trades = all_trades
+        self.ledger = None
+        self.ledger_slot = None
+
+    def attach_ledger(self, ledger, slot: int) -> NoReturn:
+        """
+        Lets the fill ledger of a market environment record the agent's trades from now on
+
+        :param ledger: fill ledger of the environment
+        :param slot: slot of the agent in the ledger
+        :return: NoReturn
+        """
+        self._all_trades = self.all_trades
+        self.ledger = ledger
+        self.ledger_slot = slot
+
+    def calculate_realized_value(self) -> float:
+        """
+        Calculates the cash flow of all trades without materializing the trade history
+
+        :return: sum of price times signed volume
+        """
+        if self.ledger is None:
+            return np.sum(self._all_trades[:, 0] * self._all_trades[:, 1])
+        return self.ledger.realized_value(self.ledger_slot)
+
+
+class LatencyModel:
+    """
+    Gives an agent a latency drawn every update from its base latency delta and a uniform draw.
+
+    Classes set latency_bounds to the range of the uniform draw, or None for a fixed latency, and override
+    latency_from_draw. A market environment drawing latencies for the whole population sets latency_scheduled,
+    after which the agent stops drawing its own. In an event driven simulation the latency is the time an order takes
+    to reach the book.
+    """
+    latency_bounds = None
+    latency_scheduled = False
+
+    @staticmethod
+    def latency_from_draw(delta, draw):
+        """
+        Latency as a function of the base latency and the uniform draw, vectorized over agents
+
+        :param delta: base latency
+        :param draw: uniform draw within latency_bounds
+        :return: latency
+        """
+        return delta + draw
+
+    def update_latency(self) -> NoReturn:
+        """
+        Draws a new latency unless it is drawn by the market environment
+        """
+        if self.latency_bounds is not None and not self.latency_scheduled:
+            self.latency = self.latency_from_draw(self.delta, self.random.uniform(*self.latency_bounds))
+
+
+class Scheduling:
+    """
+    Tells simulation drivers when an agent updates.
+
+    In an event driven simulation the agent wakes up every wake_up_interval, or never if it is None, unless the
+    class overrides next_wake_up, and is updated through wake_up. With wake_up_on_fill it also wakes up whenever one
+    of its orders is filled, e.g. a market maker requoting for its new position. In a stepped simulation driven by an
+    UpdateScheduler, the agent updates with its update_cadence, every step if it is None. Agents with an expensive
+    decision, like a neural network forward pass, set concurrent_decision and implement prepare_update(state), which
+    the scheduler may run in a thread before the agent's update.
+    """
+    wake_up_interval = 1.0
+    update_cadence = None
+    wake_up_on_fill = False
+    next_arrival = None  # pre-sampled step, or time in an event driven simulation, at which an idle agent acts next
+    concurrent_decision = False
+
+    def next_wake_up(self, time: float) -> float:
+        """
+        Time at which the agent next updates its quotes in an event driven simulation
+
+        :param time: current simulated time
+        :return: time of the next wake-up, None to never wake up again
+        """
+        return None if self.wake_up_interval is None else time + self.wake_up_interval
+
+    def wake_up(self, state: dict) -> NoReturn:
+        """
+        Updates the agent when it wakes up in an event driven simulation
+
+        :param state: last published market state
+        :return: NoReturn
+        """
+        self.update(state)
+
+
+class RandomDraws:
+    """
+    Gives an agent the source of its random draws, the np.random module unless a stream of
+    market_simulation_study.random_streams is attached
+    """
+    random = np.random
+
+
+class Order:
+    """
+    Order of an agent as submitted to the market environment
+    """
+    __slots__ = ("price", "volume", "latency", "agent_id")
+
+    def __init__(self, price: float, volume: float, latency: float, agent_id: int):
+        """
+        Constructor
+        :param price: order price, None or nan for no order
+        :param volume: order volume
+        :param latency: latency of the agent when the order was placed
+        :param agent_id: id of the agent
+        """
+        self.price = price
+        self.volume = volume
+        self.latency = latency
+        self.agent_id = agent_id
+
+    def values(self) -> tuple:
+        return self.price, self.volume, self.latency, self.agent_id
+
+
+class OrderSubmission:
+    """
+    Keeps the buy and sell orders of an agent as Order records, read directly by the market environment.
+
+    The one-row DataFrames buy_order and sell_order are only built when they are accessed, and are then kept until
+    the agent submits new orders.
+    """
+    buy_record = None
+    sell_record = None
+    _buy_order = None
+    _sell_order = None
+
+    def submit_orders(self) -> NoReturn:
+        """
+        Records the current buy and sell prices, volumes and latency as the agent's orders
+        """
+        self.buy_record = Order(self.buy_price, self.buy_volume, self.latency, self.agent_id)
+        self.sell_record = Order(self.sell_price, self.sell_volume, self.latency, self.agent_id)
+        self._buy_order = None
+        self._sell_order = None
+
+    def __getstate__(self) -> dict:
+        """
+        State for copying and pickling, without the DataFrames of the orders, which are rebuilt when accessed
+        """
+        state = self.__dict__.copy()
+        state.pop("_buy_order", None)
+        state.pop("_sell_order", None)
+        return state
+
+    @property
+    def buy_order(self) -> pd.DataFrame:
+        if self._buy_order is None:
+            self._buy_order = pd.DataFrame(np.array([self.buy_record.values()]),
+                                           columns=["buy_price", "buy_volume", "latency", "agent_id"],
+                                           index=[self.agent_id])
+        return self._buy_order
+
+    @buy_order.setter
+    def buy_order(self, buy_order: pd.DataFrame) -> NoReturn:
+        self._buy_order = buy_order
+        self.buy_record = Order(*buy_order.values[0])
+
+    @property
+    def sell_order(self) -> pd.DataFrame:
+        if self._sell_order is None:
+            self._sell_order = pd.DataFrame(np.array([self.sell_record.values()]),
+                                            columns=["sell_price", "sell_volume", "latency", "agent_id"],
+                                            index=[self.agent_id])
+        return self._sell_order
+
+    @sell_order.setter
+    def sell_order(self, sell_order: pd.DataFrame) -> NoReturn:
+        self._sell_order = sell_order
+        self.sell_record = Order(*sell_order.values[0])
+
+
+class Agent(LedgerAccount, LatencyModel, Scheduling, RandomDraws, OrderSubmission, abc.ABC):
     """
     Abstract class for agents
     """
@@ -136,6 +336,7 @@ class RandomAgent(Agent):
     """
     Agent which makes noisy buy and sell prices around market_prices
     """
+    latency_bounds = (1 + 1e-6, 2)
 
     def __init__(self,
                  agent_id: int = None,
@@ -173,10 +374,7 @@ class RandomAgent(Agent):
         self.coin_bias_buy = coin_bias_buy
         self.coin_bias_sell = coin_bias_sell
         self.random_agent_price = None
-        self.buy_order = pd.DataFrame(np.array([[self.buy_price, self.buy_volume, self.latency, self.agent_id]]),
-                                      columns=["buy_price", "buy_volume", "latency", "agent_id"])
-        self.sell_order = pd.DataFrame(np.array([[self.sell_price, self.sell_volume, self.latency, self.agent_id]]),
-                                       columns=["sell_price", "sell_volume", "latency", "agent_id"])
+        self.submit_orders()
 
     def reset(self):
         """
@@ -194,7 +392,7 @@ class RandomAgent(Agent):
         :return: buy price
         """
         buy_price = self.random_agent_price * (
-                1 - np.random.uniform(low=self.noise_range[0], high=self.noise_range[1]))
+                1 - self.random.uniform(low=self.noise_range[0], high=self.noise_range[1]))
         buy_price = np.maximum(buy_price, 0)
         return buy_price
 
@@ -206,7 +404,7 @@ class RandomAgent(Agent):
         :return: sell price
         """
         sell_price = self.random_agent_price * (
-                1 + np.random.uniform(low=self.noise_range[0], high=self.noise_range[1]))
+                1 + self.random.uniform(low=self.noise_range[0], high=self.noise_range[1]))
         sell_price = np.maximum(sell_price, 0)
         return sell_price
 
@@ -217,7 +415,7 @@ class RandomAgent(Agent):
         :param state:
         :return:
         """
-        volume = np.random.binomial(self.n_coin_flips, self.coin_bias_buy)
+        volume = self.random.binomial(self.n_coin_flips, self.coin_bias_buy)
 
         return volume
 
@@ -228,7 +426,7 @@ class RandomAgent(Agent):
         :param state:
         :return:
         """
-        volume = np.random.binomial(self.n_coin_flips, self.coin_bias_sell)
+        volume = self.random.binomial(self.n_coin_flips, self.coin_bias_sell)
 
         return volume
 
@@ -239,7 +437,7 @@ class RandomAgent(Agent):
         :param state: market state information
         :return: total profit and loss
         """
-        realized_value = np.sum(self.all_trades[:, 0] * self.all_trades[:, 1])
+        realized_value = self.calculate_realized_value()
         if self.position < 0:
             unrealized_value = self.position * state["market_prices"][-1] * (1 + state["slippage"])
         else:
@@ -255,11 +453,11 @@ class RandomAgent(Agent):
         :return: NoReturn
         """
         # Update latency
-
-        self.latency = self.delta + np.random.uniform(1 + 1e-6, 2)
+        self.update_latency()
 
         # Update prices and volume
-        self.random_agent_price = state["market_prices"][-1] * (1 + np.random.normal(loc=0, scale=self.mid_price_noise))
+        self.random_agent_price = state["market_prices"][-1] * (
+                1 + self.random.normal(loc=0, scale=self.mid_price_noise))
 
         self.buy_price = self.calculate_buy_price(state)
         self.sell_price = self.calculate_sell_price(state)
@@ -268,18 +466,14 @@ class RandomAgent(Agent):
 
         # Update orders
 
-        self.buy_order = pd.DataFrame(np.array([[self.buy_price, self.buy_volume, self.latency, self.agent_id]]),
-                                      columns=["buy_price", "buy_volume", "latency", "agent_id"],
-                                      index=[self.agent_id])
-        self.sell_order = pd.DataFrame(np.array([[self.sell_price, self.sell_volume, self.latency, self.agent_id]]),
-                                       columns=["sell_price", "sell_volume", "latency", "agent_id"],
-                                       index=[self.agent_id])
+        self.submit_orders()
 
 
 class InvestorAgent(Agent):
     """
     Agent which buys or sells large orders in chunks over small periods. Similiar to Institutional Investors.
     """
+    latency_bounds = (0 + 1e-6, 1)
 
     def __init__(self,
                  agent_id: int = None,
@@ -320,12 +514,7 @@ class InvestorAgent(Agent):
         self.sell_price_margin = sell_price_margin
         self.is_buying = is_buying
         self.can_short = can_short
-        self.buy_order = pd.DataFrame(np.array([[self.buy_price, self.buy_volume, self.latency, self.agent_id]]),
-                                      columns=["buy_price", "buy_volume", "latency", "agent_id"],
-                                      index=[self.agent_id])
-        self.sell_order = pd.DataFrame(np.array([[self.sell_price, self.sell_volume, self.latency, self.agent_id]]),
-                                       columns=["sell_price", "sell_volume", "latency", "agent_id"],
-                                       index=[self.agent_id])
+        self.submit_orders()
 
     def reset(self):
         """
@@ -386,34 +575,94 @@ class InvestorAgent(Agent):
         :param state: market state information
         :return: total profit and loss
         """
-        realized_value = np.sum(self.all_trades[:, 0] * self.all_trades[:, 1])
+        realized_value = self.calculate_realized_value()
         if self.position < 0:
             unrealized_value = self.position * state["market_prices"][-1] * (1 + state["slippage"])
         else:
             unrealized_value = self.position * state["market_prices"][-1] * (1 - state["slippage"])
         self.pnl = realized_value + unrealized_value
 
-    def update(self, state: dict) -> NoReturn:
+    def decide(self) -> Tuple[bool, bool]:
+        """
+        Draws whether the investor wants to start buying and whether it wants to start selling
+
+        :return: will buy, will sell
+        """
+        will_buy = self.random.uniform(0, 1) < self.intensity
+        will_sell = (self.random.uniform(0, 0.95) < self.intensity) and self.sell_is_possible()
+        return will_buy, will_sell
+
+    def sell_is_possible(self) -> bool:
+        return self.can_short or self.position >= self.n_orders / 2 * self.sell_volume
+
+    def is_busy(self) -> bool:
+        """
+        Tells if the investor is working through its queue of orders
+        """
+        return self.orders_in_queue > 0
+
+    def activity_probability(self) -> float:
+        """
+        Probability that an idle investor starts buying or selling in a step
+
+        :return: probability
+        """
+        buy_probability = min(max(self.intensity, 0), 1)
+        sell_probability = min(max(self.intensity / 0.95, 0), 1) if self.sell_is_possible() else 0
+        return 1 - (1 - buy_probability) * (1 - sell_probability)
+
+    def next_wake_up(self, time: float) -> float:
+        """
+        Time at which the investor next updates its quotes in an event driven simulation. A busy investor, or one
+        whose last quotes are still out, wakes up every wake_up_interval. An idle investor without quotes would only
+        draw whether it starts to trade at each of these wake-ups, so the wake-up at which it starts is pre-sampled
+        from the geometric distribution instead, like with a BernoulliArrival cadence, and the investor sleeps until
+        then.
+
+        :param time: current simulated time
+        :return: time of the next wake-up, None to never wake up again
+        """
+        if self.wake_up_interval is None:
+            return None
+        if self.is_busy() or not (np.isnan(self.buy_price) and np.isnan(self.sell_price)):
+            return time + self.wake_up_interval
+        probability = self.activity_probability()
+        if probability <= 0:
+            return None
+        n_intervals = 1
+        if probability < 1:
+            n_intervals += int(np.floor(np.log1p(-self.random.uniform()) / np.log1p(-probability)))
+        self.next_arrival = time + n_intervals * self.wake_up_interval
+        return self.next_arrival
+
+    def wake_up(self, state: dict) -> NoReturn:
+        """
+        Updates the investor, given that it starts to trade if the wake-up is a pre-sampled arrival
+        """
+        arrival = self.next_arrival is not None
+        self.next_arrival = None
+        self.update(state, arrival=arrival)
+
+    def update(self, state: dict, arrival: bool = False) -> NoReturn:
         """
         Updates agents ask and bid prices, and corresponding volumes, when new state is provided
 
         :param state: market state information
+        :param arrival: if True the idle investor was woken by a pre-sampled arrival, see
+        market_simulation_study.cadence.BernoulliArrival, and its decision is drawn given that it starts to trade
         :return: NoReturn
         """
         # Update latency
-        self.latency = self.delta + np.random.uniform(0 + 1e-6, 1)
+        self.update_latency()
 
         # instantiate no prices
         self.buy_price = np.nan
         self.sell_price = np.nan
 
         # check if investor wants to buy or sell and calculate prices if so
-        will_buy = np.random.uniform(0, 1) < self.intensity
-        if self.can_short:
-            sell_is_possible = True
-        else:
-            sell_is_possible = (self.position >= self.n_orders / 2 * self.sell_volume)
-        will_sell = (np.random.uniform(0, 0.95) < self.intensity) and sell_is_possible
+        will_buy, will_sell = self.decide()
+        while arrival and not (will_buy or will_sell):
+            will_buy, will_sell = self.decide()
 
         if self.orders_in_queue == 0:
             self.is_buying = False
@@ -441,18 +690,14 @@ class InvestorAgent(Agent):
         self.sell_volume = self.calculate_sell_volume(state)
 
         # Update orders
-        self.buy_order = pd.DataFrame(np.array([[self.buy_price, self.buy_volume, self.latency, self.agent_id]]),
-                                      columns=["buy_price", "buy_volume", "latency", "agent_id"],
-                                      index=[self.agent_id])
-        self.sell_order = pd.DataFrame(np.array([[self.sell_price, self.sell_volume, self.latency, self.agent_id]]),
-                                       columns=["sell_price", "sell_volume", "latency", "agent_id"],
-                                       index=[self.agent_id])
+        self.submit_orders()
 
 
 class TrendAgent(Agent):
     """
     Agent which makes noisy buy and sell prices around market_prices
     """
+    latency_bounds = (1e-6, 1)
 
     def __init__(self,
                  agent_id: int = None,
@@ -487,12 +732,7 @@ class TrendAgent(Agent):
         self.const_position_size = const_position_size
         self.moving_average_one = moving_average_one
         self.moving_average_two = moving_average_two
-        self.buy_order = pd.DataFrame(np.array([[self.buy_price, self.buy_volume, self.latency, self.agent_id]]),
-                                      columns=["buy_price", "buy_volume", "latency", "agent_id"],
-                                      index=[self.agent_id])
-        self.sell_order = pd.DataFrame(np.array([[self.sell_price, self.sell_volume, self.latency, self.agent_id]]),
-                                       columns=["sell_price", "sell_volume", "latency", "agent_id"],
-                                       index=[self.agent_id])
+        self.submit_orders()
 
     def reset(self):
         """
@@ -509,7 +749,7 @@ class TrendAgent(Agent):
         :param state: market state information
         :return: buy price
         """
-        noise = np.random.normal(loc=0, scale=0.0001)
+        noise = self.random.normal(loc=0, scale=0.0001)
         buy_price = state["market_prices"][-1] * (1 + self.price_margin + noise)
         buy_price = np.maximum(buy_price, 0)
         return buy_price
@@ -521,7 +761,7 @@ class TrendAgent(Agent):
         :param state: market state information
         :return: sell price
         """
-        noise = np.random.normal(loc=0, scale=0.0001)
+        noise = self.random.normal(loc=0, scale=0.0001)
         sell_price = state["market_prices"][-1] * (1 + noise)
         sell_price = np.maximum(sell_price, 0)
         return sell_price
@@ -555,7 +795,7 @@ class TrendAgent(Agent):
         :param state: market state information
         :return: total profit and loss
         """
-        realized_value = np.sum(self.all_trades[:, 0] * self.all_trades[:, 1])
+        realized_value = self.calculate_realized_value()
         if self.position < 0:
             unrealized_value = self.position * state["market_prices"][-1] * (1 + state["slippage"])
         else:
@@ -571,12 +811,17 @@ class TrendAgent(Agent):
         :return: NoReturn
         """
         # update latency
-        self.latency = self.delta + np.random.uniform(1e-6, 1)
+        self.update_latency()
 
         # check trend direction and aim for strategic position
 
-        ma1 = np.average(state["market_prices"][- self.moving_average_one:])
-        ma2 = np.average(state["market_prices"][- self.moving_average_two:])
+        indicators = state.get("indicators")
+        if indicators is not None:
+            ma1 = indicators.mean(self.moving_average_one)
+            ma2 = indicators.mean(self.moving_average_two)
+        else:
+            ma1 = np.average(state["market_prices"][- self.moving_average_one:])
+            ma2 = np.average(state["market_prices"][- self.moving_average_two:])
 
         trend = ma1 / ma2
 
@@ -595,18 +840,19 @@ class TrendAgent(Agent):
             pass
 
         # Update orders
-        self.buy_order = pd.DataFrame(np.array([[self.buy_price, self.buy_volume, self.latency, self.agent_id]]),
-                                      columns=["buy_price", "buy_volume", "latency", "agent_id"],
-                                      index=[self.agent_id])
-        self.sell_order = pd.DataFrame(np.array([[self.sell_price, self.sell_volume, self.latency, self.agent_id]]),
-                                       columns=["sell_price", "sell_volume", "latency", "agent_id"],
-                                       index=[self.agent_id])
+        self.submit_orders()
 
 
 class MarketMakerAgent(Agent):
     """
     Market making agent class
     """
+    latency_bounds = (1e-6, 1)
+    wake_up_on_fill = True
+
+    @staticmethod
+    def latency_from_draw(delta, draw):
+        return delta / (1 + draw)
 
     def __init__(self,
                  agent_id: int = None,
@@ -619,10 +865,13 @@ class MarketMakerAgent(Agent):
                  buy_price: float = None,
                  sell_price: float = None,
                  all_trades: np.ndarray = None,
-                 n_volume: int = 3):
+                 n_volume: int = 3,
+                 requote_threshold: float = None):
         """
         Constructor
         :param latency: latency when matching agents in the market environment
+        :param requote_threshold: if given, quotes are only recalculated when the mid price moves more than this or
+        the position changes
         """
         self.agent_class = "MM"
         self.agent_id = agent_id
@@ -639,14 +888,11 @@ class MarketMakerAgent(Agent):
         self.buy_volume = None
         self.sell_volume = None
         self.n_volume = n_volume
+        self.requote_threshold = requote_threshold
         self.spread = None
         self.mid_price = None
-        self.buy_order = pd.DataFrame(np.array([[self.buy_price, self.buy_volume, self.latency, self.agent_id]]),
-                                      columns=["buy_price", "buy_volume", "latency", "agent_id"],
-                                      index=[self.agent_id])
-        self.sell_order = pd.DataFrame(np.array([[self.sell_price, self.sell_volume, self.latency, self.agent_id]]),
-                                       columns=["sell_price", "sell_volume", "latency", "agent_id"],
-                                       index=[self.agent_id])
+        self.quoted_position = None  # position the current quotes were calculated for
+        self.submit_orders()
 
     def reset(self):
         """
@@ -664,6 +910,9 @@ class MarketMakerAgent(Agent):
         :param n_observations: dats to calculate volatility for
         :return:
         """
+        indicators = state.get("indicators")
+        if indicators is not None:
+            return indicators.std(n_observations)
         vol = np.std(state["market_prices"][-n_observations:])
         return vol
 
@@ -698,7 +947,7 @@ class MarketMakerAgent(Agent):
         :param state:
         :return:
         """
-        buy_price = self.mid_price - self.spread / 2 + np.random.normal(loc=0, scale=0.0001)
+        buy_price = self.mid_price - self.spread / 2 + self.random.normal(loc=0, scale=0.0001)
         return buy_price
 
     def calculate_sell_price(self) -> float:
@@ -708,7 +957,7 @@ class MarketMakerAgent(Agent):
         :param state:
         :return:
         """
-        sell_price = self.mid_price + self.spread / 2 + np.random.normal(loc=0, scale=0.0001)
+        sell_price = self.mid_price + self.spread / 2 + self.random.normal(loc=0, scale=0.0001)
         return sell_price
 
     def calculate_buy_volume(self) -> float:
@@ -738,7 +987,7 @@ class MarketMakerAgent(Agent):
         :param state:
         :return:
         """
-        realized_value = np.sum(self.all_trades[:, 0] * self.all_trades[:, 1])
+        realized_value = self.calculate_realized_value()
         if self.position < 0:
             unrealized_value = self.position * state["market_prices"][-1] * (1 + state["slippage"])
         else:
@@ -753,11 +1002,19 @@ class MarketMakerAgent(Agent):
         :param state:
         :return:
         """
+        # Keep the current quotes, and the latency of their orders, if no fill changed the position and the mid price
+        # has not moved enough
+        mid_price = self.calculate_mid_price(state)
+        if (self.requote_threshold is not None and self.mid_price is not None and self.position == self.quoted_position
+                and abs(mid_price - self.mid_price) <= self.requote_threshold):
+            return
+
         # Update latency
-        self.latency = self.delta / (1 + np.random.uniform(1e-6, 1))
+        self.update_latency()
 
         # Update parameters to calculate prices
-        self.mid_price = self.calculate_mid_price(state)
+        self.quoted_position = self.position
+        self.mid_price = mid_price
         self.spread = self.calculate_spread(state)
 
         # Update volumes
@@ -768,12 +1025,7 @@ class MarketMakerAgent(Agent):
         self.buy_price = self.calculate_buy_price()
         self.sell_price = self.calculate_sell_price()
 
-        self.buy_order = pd.DataFrame(np.array([[self.buy_price, self.buy_volume, self.latency, self.agent_id]]),
-                                      columns=["buy_price", "buy_volume", "latency", "agent_id"],
-                                      index=[self.agent_id])
-        self.sell_order = pd.DataFrame(np.array([[self.sell_price, self.sell_volume, self.latency, self.agent_id]]),
-                                       columns=["sell_price", "sell_volume", "latency", "agent_id"],
-                                       index=[self.agent_id])
+        self.submit_orders()
 
 
 ##################################################
@@ -840,7 +1092,7 @@ class RLAgent(Agent):
         :return: buy price
         """
         buy_price = self.random_agent_price * (
-                1 - np.random.uniform(low=self.noise_range[0], high=self.noise_range[1] - 0.02))
+                1 - self.random.uniform(low=self.noise_range[0], high=self.noise_range[1] - 0.02))
         buy_price = np.maximum(buy_price, 0)
         return buy_price
 
@@ -852,7 +1104,7 @@ class RLAgent(Agent):
         :return: sell price
         """
         sell_price = self.random_agent_price * (
-                1 + np.random.uniform(low=self.noise_range[0], high=self.noise_range[1]))
+                1 + self.random.uniform(low=self.noise_range[0], high=self.noise_range[1]))
         sell_price = np.maximum(sell_price, 0)
         return sell_price
 
@@ -863,7 +1115,7 @@ class RLAgent(Agent):
         :param state:
         :return:
         """
-        volume = np.random.randint(0, 3)
+        volume = self.random.randint(0, 3)
 
         return volume
 
@@ -874,7 +1126,7 @@ class RLAgent(Agent):
         :param state:
         :return:
         """
-        volume = np.random.randint(0, 3)
+        volume = self.random.randint(0, 3)
 
         return volume
 
@@ -885,7 +1137,7 @@ class RLAgent(Agent):
         :param state: market state information
         :return: total profit and loss
         """
-        realized_value = np.sum(self.all_trades[:, 0] * self.all_trades[:, 1])
+        realized_value = self.calculate_realized_value()
         if self.position < 0:
             unrealized_value = self.position * state["market_prices"][-1] * (1 + state["slippage"])
         else:
@@ -894,8 +1146,12 @@ class RLAgent(Agent):
         self.pnl = realized_value + unrealized_value
 
     def create_features(self, state):
-        ma1 = np.average(state["market_prices"][-50:])
-        ma2 = np.average(state["market_prices"][-200:])
+        indicators = state.get("indicators")
+        if indicators is not None:
+            ma1, ma2 = indicators.mean(50), indicators.mean(200)
+        else:
+            ma1 = np.average(state["market_prices"][-50:])
+            ma2 = np.average(state["market_prices"][-200:])
         trend_feature = ma1 / ma2
         spread_feature = np.round(state["mean_buy_price"] - state["mean_sell_price"], 1)
         feature_list = [ma1, ma2, trend_feature, spread_feature]
@@ -1003,12 +1259,7 @@ class RLAgent(Agent):
         self.buy_price = random.uniform(price_range_lower, price_range_upper)
         self.sell_price = random.uniform(price_range_lower, price_range_upper)
 
-        self.buy_order = pd.DataFrame(np.array([[self.buy_price, self.buy_volume, self.latency, self.agent_id]]),
-                                      columns=["buy_price", "buy_volume", "latency", "agent_id"],
-                                      index=[self.agent_id])
-        self.sell_order = pd.DataFrame(np.array([[self.sell_price, self.sell_volume, self.latency, self.agent_id]]),
-                                       columns=["sell_price", "sell_volume", "latency", "agent_id"],
-                                       index=[self.agent_id])
+        self.submit_orders()
 
     def update(self, state: dict) -> NoReturn:
         """
@@ -1073,6 +1324,22 @@ class Memory:
         self.terminals.append(terminal)
         self.discounted_rewards.append(reward)
 
+    transition_keys = ("states", "actions", "rewards", "next_states", "terminals", "discounted_rewards")
+
+    def __getstate__(self) -> dict:
+        """ State for copying and pickling, with every list of transitions stacked into one detached tensor """
+        state = self.__dict__.copy()
+        for key in self.transition_keys:
+            if len(state[key]) > 0:
+                state[key] = torch.stack(state[key]).detach()
+        return state
+
+    def __setstate__(self, state: dict) -> NoReturn:
+        for key in self.transition_keys:
+            if isinstance(state[key], torch.Tensor):
+                state[key] = list(torch.unbind(state[key]))
+        self.__dict__.update(state)
+
     def draw_batch(self, batch_size: int = 50):
         """draws a random sample batch from memory"""
         combined = list(zip(self.states,
@@ -1166,9 +1433,9 @@ class GaussianPolicyNetwork(nn.Module):
 
         return mu, sigma
 
-    def get_action(self, state, eval_deterministic=False, save_mu=False):
+    def get_action(self, state, eval_deterministic=False, save_mu=False, forward=None):
 
-        mu, sigma = self.forward(state)
+        mu, sigma = self.forward(state) if forward is None else forward
         print("sigma: ", sigma)
         if eval_deterministic:
             action = mu.detach()
@@ -1255,9 +1522,9 @@ class GaussianBinomialPolicyNetwork(nn.Module):
 
         return mu, p  # , sigma
 
-    def get_action(self, state, eval_deterministic=False, save_mu=False):
+    def get_action(self, state, eval_deterministic=False, save_mu=False, forward=None):
 
-        mu, p = self.forward(state)
+        mu, p = self.forward(state) if forward is None else forward
 
         if eval_deterministic:
             action_mu = mu.detach()
@@ -1321,7 +1588,14 @@ class GaussianBinomialPolicyNetwork(nn.Module):
         return action, log_prob
 
 
-class ActorCriticAgent:
+class ActorCriticAgent(LedgerAccount, LatencyModel, Scheduling, RandomDraws, OrderSubmission):
+    latency_bounds = (1e-6, 1)
+    concurrent_decision = True
+
+    @staticmethod
+    def latency_from_draw(delta, draw):
+        return delta / (1 + draw)
+
     def __init__(self,
                  policy: nn.Module,
                  qf: ActionValueNetwork,
@@ -1356,12 +1630,7 @@ class ActorCriticAgent:
         self.sell_volume = None
         self.spread = None
         self.mid_price = None
-        self.buy_order = pd.DataFrame(np.array([[self.buy_price, self.buy_volume, self.latency, self.agent_id]]),
-                                      columns=["buy_price", "buy_volume", "latency", "agent_id"],
-                                      index=[self.agent_id])
-        self.sell_order = pd.DataFrame(np.array([[self.sell_price, self.sell_volume, self.latency, self.agent_id]]),
-                                       columns=["sell_price", "sell_volume", "latency", "agent_id"],
-                                       index=[self.agent_id])
+        self.submit_orders()
 
         self.policy = policy
         self.qf = qf
@@ -1380,6 +1649,7 @@ class ActorCriticAgent:
         self.training_on_policy = training_on_policy
         self.memory = Memory(max_size=max_memory_size)
         self.state_features = self.get_state_features(init_state)
+        self.prepared = None  # state and policy outputs computed by prepare_update
         self.position_penalty = position_penalty
 
         # self.pretraining_policy = Uniform(high=torch.Tensor([policy.max_action_value]), low=torch.Tensor([policy.min_action_value]))
@@ -1404,6 +1674,13 @@ class ActorCriticAgent:
         self.sell_volume = None
         self.memory.clear()
 
+    def __getstate__(self) -> dict:
+        """
+        State for copying and pickling, with tensors like the last policy means detached from the autograd graph
+        """
+        return {key: value.detach() if isinstance(value, torch.Tensor) else value
+                for key, value in super().__getstate__().items()}
+
     def score_gradient_descent(self) -> NoReturn:
         """
         Takes a gradient descent step and updates parameters in function approximators
@@ -1500,7 +1777,7 @@ class ActorCriticAgent:
         :param state: market state information
         :return: total profit and loss
         """
-        realized_value = np.sum(self.all_trades[:, 0] * self.all_trades[:, 1])
+        realized_value = self.calculate_realized_value()
         if self.position < 0:
             unrealized_value = self.position * state["market_prices"][-1] * (1 + state["slippage"])
         else:
@@ -1534,26 +1811,42 @@ class ActorCriticAgent:
 
         return torch.tensor(features)
 
+    def prepare_update(self, state: dict) -> NoReturn:
+        """
+        Computes the state features and the policy outputs used by the next update from a state, without drawing
+        random numbers or changing anything but the prepared values, so it can run in a thread while other agents
+        update
+
+        :param state: market state the agent is updated with next
+        :return: NoReturn
+        """
+        state_features = self.state_features if self.state_features is not None else self.get_state_features(state)
+        next_state_features = self.get_state_features(state)
+        self.prepared = (state, self.policy.forward(state_features), next_state_features,
+                         self.policy.forward(next_state_features))
+
     def update(self, state: dict, exploration_mode=False):
         """
         Updates RL model and its prices and volumes
         """
+        prepared = self.prepared if self.prepared is not None and self.prepared[0] is state else None
+        self.prepared = None
         state_features = self.state_features if self.state_features is not None else self.get_state_features(state)
         if exploration_mode:
-            action = torch.tensor([np.random.normal(scale=0.01),  # buy_price
-                                   np.random.normal(scale=0.01),  # sell_price
-                                   np.random.randint(0, 10),  # buy_volume
-                                   np.random.randint(0, 10)  # sell_volume
+            action = torch.tensor([self.random.normal(scale=0.01),  # buy_price
+                                   self.random.normal(scale=0.01),  # sell_price
+                                   self.random.randint(0, 10),  # buy_volume
+                                   self.random.randint(0, 10)  # sell_volume
                                    ])
         else:
-            action = self.policy.get_action(state_features)
+            action = self.policy.get_action(state_features, forward=prepared[1] if prepared else None)
 
         pnl = self.pnl
         self.calculate_profit_and_loss(state=state)
         new_pnl = self.pnl
         position = self.position
         reward = torch.tensor([new_pnl - pnl - self.position_penalty * position ** 2])
-        next_state_features = self.get_state_features(state)
+        next_state_features = prepared[2] if prepared else self.get_state_features(state)
         terminal = torch.tensor(0)
 
         self.memory.add_transition(state=state_features,
@@ -1566,13 +1859,14 @@ class ActorCriticAgent:
             raise NotImplementedError("No terminal state definition")
 
         if exploration_mode:
-            new_action = torch.tensor([np.random.normal(scale=0.01),  # buy_price
-                                       np.random.normal(scale=0.01),  # sell_price
-                                       np.random.randint(0, 10),  # buy_volume
-                                       np.random.randint(0, 10)  # sell_volume
+            new_action = torch.tensor([self.random.normal(scale=0.01),  # buy_price
+                                       self.random.normal(scale=0.01),  # sell_price
+                                       self.random.randint(0, 10),  # buy_volume
+                                       self.random.randint(0, 10)  # sell_volume
                                        ])
         else:
-            new_action, mus, ps = self.policy.get_action(self.state_features, save_mu=True)
+            new_action, mus, ps = self.policy.get_action(self.state_features, save_mu=True,
+                                                         forward=prepared[3] if prepared else None)
             self.mu1 = mus[0]
             self.mu2 = mus[1]
             self.mu3 = ps[0]
@@ -1583,11 +1877,6 @@ class ActorCriticAgent:
         self.buy_volume = int(new_action[2].numpy())
         self.sell_volume = int(new_action[3].numpy())
 
-        self.buy_order = pd.DataFrame(np.array([[self.buy_price, self.buy_volume, self.latency, self.agent_id]]),
-                                      columns=["buy_price", "buy_volume", "latency", "agent_id"],
-                                      index=[self.agent_id])
-        self.sell_order = pd.DataFrame(np.array([[self.sell_price, self.sell_volume, self.latency, self.agent_id]]),
-                                       columns=["sell_price", "sell_volume", "latency", "agent_id"],
-                                       index=[self.agent_id])
+        self.submit_orders()
 
-        self.latency = self.delta / (1 + np.random.uniform(1e-6, 1))
+        self.update_latency()
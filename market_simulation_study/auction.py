@@ -0,0 +1,101 @@
+from typing import Tuple
+import numpy as np
+from numpy import ndarray
+
+
+def clearing_price(buy_prices: ndarray, buy_volumes: ndarray, sell_prices: ndarray, sell_volumes: ndarray,
+                   reference_price: float) -> Tuple[float, float]:
+    """
+    Finds the uniform price which maximizes the executable volume of a call auction.
+
+    Every order price is a candidate. Demand at a candidate is the buy volume priced at or above it and supply is
+    the sell volume priced at or below it. Ties in executable volume are broken by the smallest demand/supply
+    imbalance and then by the distance to the reference price.
+
+    :param buy_prices: buy prices
+    :param buy_volumes: buy volumes
+    :param sell_prices: sell prices
+    :param sell_volumes: sell volumes
+    :param reference_price: price used to break remaining ties, normally the last market price
+    :return: clearing price and executable volume
+    """
+    if len(buy_prices) == 0 or len(sell_prices) == 0:
+        return reference_price, 0.0
+
+    buy_order = np.argsort(buy_prices)
+    sorted_buy_prices = buy_prices[buy_order]
+    demand_above = np.concatenate((np.cumsum(buy_volumes[buy_order][::-1])[::-1], [0]))
+    sell_order = np.argsort(sell_prices)
+    sorted_sell_prices = sell_prices[sell_order]
+    supply_below = np.concatenate(([0], np.cumsum(sell_volumes[sell_order])))
+
+    candidates = np.unique(np.concatenate((buy_prices, sell_prices)))
+    demand = demand_above[np.searchsorted(sorted_buy_prices, candidates, side="left")]
+    supply = supply_below[np.searchsorted(sorted_sell_prices, candidates, side="right")]
+    volume = np.minimum(demand, supply)
+
+    best = np.lexsort((np.abs(candidates - reference_price), np.abs(demand - supply), -volume))[0]
+    return candidates[best], volume[best]
+
+
+def allocate(priority: ndarray, volumes: ndarray, latencies: ndarray, executed_volume: float,
+             allocation: str = "pro_rata") -> Tuple[ndarray, ndarray]:
+    """
+    Allocates the executed volume of one side of the auction with price priority.
+
+    Price levels are filled from the best price until the executed volume is used up. The marginal level is
+    shared by latency priority, or pro-rata to the order volumes. Pro-rata shares of whole volumes are rounded to
+    whole units with the leftover units going to the largest remainders, while fractional volumes are shared
+    exactly.
+
+    :param priority: price priority key, lowest is best
+    :param volumes: order volumes
+    :param latencies: order latencies
+    :param executed_volume: total volume executed on this side
+    :param allocation: "pro_rata" or "latency"
+    :return: order indices in priority order and the volume allocated to each of them
+    """
+    order = np.lexsort((latencies, priority))
+    volumes = volumes[order]
+    unfilled_volumes = executed_volume - (np.cumsum(volumes) - volumes)
+    allocated = np.minimum(volumes, np.maximum(unfilled_volumes, 0))
+
+    if allocation == "pro_rata":
+        marginal_order = np.searchsorted(np.cumsum(volumes), executed_volume, side="left")
+        if marginal_order < len(volumes):
+            level = priority[order] == priority[order][marginal_order]
+            level_volume = volumes[level].sum()
+            remaining_volume = executed_volume - volumes[~level & (np.arange(len(volumes)) < marginal_order)].sum()
+            shares = remaining_volume * volumes[level] / level_volume
+            if np.all(np.mod(volumes[level], 1) == 0) and remaining_volume % 1 == 0:
+                level_allocated = np.floor(shares)
+                n_leftover = int(round(remaining_volume - level_allocated.sum()))
+                if n_leftover > 0:
+                    leftover = np.lexsort((latencies[order][level], level_allocated - shares))[:n_leftover]
+                    level_allocated[leftover] += 1
+                allocated[level] = level_allocated
+            else:
+                allocated[level] = shares
+
+    executed = allocated > 0
+    return order[executed], allocated[executed]
+
+
+def pair_fills(buy_volumes: ndarray, sell_volumes: ndarray) -> Tuple[ndarray, ndarray, ndarray]:
+    """
+    Splits the allocated volumes of both sides into buyer/seller fills by walking the two cumulative volume
+    ladders together
+
+    :param buy_volumes: allocated buy volumes in priority order
+    :param sell_volumes: allocated sell volumes in priority order
+    :return: positions in the buy and sell arrays of each fill and the fill volumes
+    """
+    cum_buy_volumes = np.cumsum(buy_volumes)
+    cum_sell_volumes = np.cumsum(sell_volumes)
+    breaks = np.union1d(cum_buy_volumes, cum_sell_volumes)
+    starts = np.concatenate(([0], breaks[:-1]))
+    volumes = breaks - starts
+    mid_points = starts + volumes / 2
+    buyers = np.minimum(np.searchsorted(cum_buy_volumes, mid_points), len(buy_volumes) - 1)
+    sellers = np.minimum(np.searchsorted(cum_sell_volumes, mid_points), len(sell_volumes) - 1)
+    return buyers, sellers, volumes
@@ -0,0 +1,175 @@
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, NoReturn
+import hashlib
+import os
+import types
+import numpy as np
+from market_simulation_study.checkpoint import dumps, write, read
+from market_simulation_study.market_state import RingBuffer
+from market_simulation_study.snapshot import SimulationSnapshot
+
+# Version of the snapshot files and keys, to be raised whenever cached snapshots of earlier versions must not be used
+CACHE_VERSION = 1
+
+
+@lru_cache(maxsize=None)
+def package_fingerprint() -> str:
+    """
+    Hash of the source files of the package, so the cache is not used across changes of the simulation code
+    """
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".py"):
+            with open(os.path.join(directory, name), "rb") as file:
+                digest.update(name.encode() + b"\0" + file.read())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def class_fingerprint(cls: type) -> str:
+    """
+    Hash of the code of the methods and the constants of a class and its base classes, so agents defined outside the
+    package, e.g. in a notebook, are not described by their name only
+
+    :param cls: class
+    :return: fingerprint
+    """
+    digest = hashlib.sha256()
+    for base in cls.__mro__:
+        if base.__module__ == "builtins":
+            continue
+        digest.update(f"{base.__module__}.{base.__qualname__}".encode())
+        for name, value in sorted(vars(base).items()):
+            value = getattr(value, "__func__", getattr(value, "fget", value))
+            if isinstance(value, types.FunctionType):
+                digest.update(f"{name}={describe(value.__code__)}".encode())
+            elif isinstance(value, (int, float, str, bytes, tuple, type(None))):
+                digest.update(f"{name}={value!r}".encode())
+    return digest.hexdigest()[:16]
+
+
+def describe(value) -> str:
+    """
+    Describes a configuration value by its content, the same in every process and session. Functions, like the
+    parameter distributions of a scenario, are described by their name, code, constants and closure, and classes by
+    their name and the fingerprint of their code.
+
+    :param value: configuration value
+    :return: description
+    """
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{describe(key)}:{describe(value[key])}" for key in sorted(value, key=describe)) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(describe(item) for item in value) + "]"
+    if isinstance(value, (np.ndarray, RingBuffer)):
+        values = np.ascontiguousarray(value)
+        return f"array({values.dtype},{values.shape},{hashlib.sha256(values.tobytes()).hexdigest()})"
+    if isinstance(value, type):
+        return f"{value.__module__}.{value.__qualname__}({class_fingerprint(value)})"
+    if isinstance(value, types.CodeType):
+        return f"code({value.co_code.hex()},{describe(list(value.co_consts))},{describe(list(value.co_names))})"
+    if isinstance(value, types.FunctionType):
+        closure = [cell.cell_contents for cell in value.__closure__ or ()]
+        return f"{value.__module__}.{value.__qualname__}({describe(value.__code__)},{describe(closure)})"
+    if isinstance(value, types.BuiltinFunctionType):
+        return f"{getattr(value, '__module__', None)}.{value.__qualname__}"
+    if hasattr(value, "__dict__") and not callable(value):
+        return f"{describe(type(value))}{describe(vars(value))}"
+    return repr(value)
+
+
+def configuration_key(*parts) -> str:
+    """
+    Key of a configuration for the burn-in cache, a hash of the description of its parts, the cache version and the
+    source of the package
+
+    :param parts: values which determine the burn-in, e.g. the initial state, the population and the seed
+    :return: key
+    """
+    digest = hashlib.sha256(f"{CACHE_VERSION},{package_fingerprint()}\0".encode())
+    for part in parts:
+        digest.update(describe(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+class BurnInCache:
+    """
+    Cache of simulation snapshots taken at the end of the burn-in, keyed by the configuration and seed of the run.
+
+    For a given population, initial state and seed the warm-up of an episode is the same every time it is run, so a
+    run that finds its key in the cache forks the stored warm state instead of simulating the warm-up again. Forks
+    restore the random state at the snapshot, so the continuation is the same as with the warm-up simulated.
+    Snapshots are kept in memory, up to max_entries with the least recently used dropped first, and in a directory
+    if one is given, as checkpoint files shared by all processes, e.g. the workers of a MonteCarloRunner, and later
+    sessions.
+    """
+
+    def __init__(self, directory: str = None, max_entries: int = None):
+        """
+        Constructor
+        :param directory: directory of the snapshot files, None to keep snapshots in memory only
+        :param max_entries: number of snapshots kept in memory, None for no limit
+        """
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_entries = max_entries
+        self.snapshots = OrderedDict()
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"burn_in_{key}.ckpt")
+
+    def get(self, key: str) -> SimulationSnapshot:
+        """
+        Looks up the snapshot of a key, in memory and then in the directory
+
+        :param key: key of the run
+        :return: snapshot, None if the burn-in of the key was not cached
+        """
+        snapshot = self.snapshots.get(key)
+        if snapshot is None and self.directory is not None and os.path.exists(self.path(key)):
+            snapshot = read(self.path(key))
+            self.remember(key, snapshot)
+        elif snapshot is not None:
+            self.snapshots.move_to_end(key)
+        return snapshot
+
+    def put(self, key: str, snapshot: SimulationSnapshot) -> NoReturn:
+        """
+        Stores the snapshot of a key in memory and in the directory
+
+        :param key: key of the run
+        :param snapshot: snapshot at the end of the burn-in
+        :return: NoReturn
+        """
+        self.remember(key, snapshot)
+        if self.directory is not None:
+            write(self.path(key), dumps(snapshot))
+
+    def remember(self, key: str, snapshot: SimulationSnapshot) -> NoReturn:
+        self.snapshots[key] = snapshot
+        self.snapshots.move_to_end(key)
+        if self.max_entries is not None and len(self.snapshots) > self.max_entries:
+            self.snapshots.popitem(last=False)
+
+    def burn_in(self, key: str, simulate: Callable[[], SimulationSnapshot]) -> tuple:
+        """
+        Starts a run after its burn-in, forking the cached snapshot or simulating the burn-in and caching its snapshot
+
+        :param key: key of the run, e.g. from configuration_key
+        :param simulate: function simulating the burn-in and returning a snapshot at its end
+        :return: environment, agents and other objects of the snapshot, forked from it
+        """
+        snapshot = self.get(key)
+        if snapshot is None:
+            self.n_misses += 1
+            snapshot = simulate()
+            self.put(key, snapshot)
+        else:
+            self.n_hits += 1
+        return snapshot.fork(restore_random_state=True)
@@ -0,0 +1,255 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import NoReturn
+import numpy as np
+
+
+class Cadence:
+    """
+    Update cadence of an agent class in a stepped simulation, deciding at which steps an agent updates.
+
+    Between two updates the orders of an agent are carried forward, so the matching engine sees the same quotes
+    again, or expire after the step they were submitted for if expire_orders is set. The base class updates the
+    agent every step.
+    """
+
+    def __init__(self, expire_orders: bool = False):
+        """
+        Constructor
+        :param expire_orders: if True orders are withdrawn in the steps without an update
+        """
+        self.expire_orders = expire_orders
+
+    def is_due(self, agent, step: int) -> bool:
+        """
+        Tells if an agent scheduled for a check at a step updates in it
+
+        :param agent: agent
+        :param step: current step
+        :return: True if the agent updates
+        """
+        return True
+
+    def next_check(self, agent, step: int) -> int:
+        """
+        Step at which an agent is checked next
+
+        :param agent: agent checked at the current step
+        :param step: current step
+        :return: step of the next check, None to never check the agent again
+        """
+        return step + 1
+
+    def update(self, agent, state: dict) -> NoReturn:
+        agent.update(state)
+
+
+class EveryKSteps(Cadence):
+    """
+    Updates an agent every k steps
+    """
+
+    def __init__(self, k: int, expire_orders: bool = False):
+        """
+        Constructor
+        :param k: number of steps between two updates
+        :param expire_orders: if True orders are withdrawn in the steps without an update
+        """
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        super().__init__(expire_orders)
+        self.k = k
+
+    def next_check(self, agent, step: int) -> int:
+        return step + self.k
+
+
+class PriceThreshold(Cadence):
+    """
+    Updates an agent when the market price has moved by more than a relative threshold since its last update.
+    The scheduler checks all agents with this cadence in one vectorized comparison per step.
+    """
+
+    def __init__(self, threshold: float, expire_orders: bool = False):
+        """
+        Constructor
+        :param threshold: relative price move triggering an update
+        :param expire_orders: if True orders are withdrawn in the steps without an update
+        """
+        super().__init__(expire_orders)
+        self.threshold = threshold
+
+
+class BernoulliArrival(Cadence):
+    """
+    Updates an agent which acts with a small probability per step, like an InvestorAgent, only at the steps it
+    acts. Agents give the probability through activity_probability, and tell through is_busy that they act at every
+    step, like an investor working through its queue. When the agent turns idle, the step of its next arrival is
+    pre-sampled from the geometric distribution and the agent is left alone until then. At the arrival it is
+    updated with arrival=True, so it draws its decision given that it acts, which leaves the distribution of the
+    simulation unchanged. Orders expire by default, as an idle agent does not quote. The pre-sampled arrival is
+    kept in the next_arrival of the agent, so it survives copies and checkpoints of the simulation and one cadence
+    can be shared by several simulations.
+    """
+
+    def __init__(self, expire_orders: bool = True):
+        """
+        Constructor
+        :param expire_orders: if True orders are withdrawn in the steps without an update
+        """
+        super().__init__(expire_orders)
+
+    def is_due(self, agent, step: int) -> bool:
+        if agent.is_busy():
+            return True
+        if agent.next_arrival is None:
+            # The agent turned idle in the last step, so its position is final until it acts again
+            probability = agent.activity_probability()
+            if probability <= 0:
+                agent.next_arrival = np.inf
+            elif probability >= 1:
+                agent.next_arrival = step
+            else:
+                agent.next_arrival = step + int(np.floor(np.log1p(-agent.random.uniform()) / np.log1p(-probability)))
+        return agent.next_arrival == step
+
+    def next_check(self, agent, step: int) -> int:
+        arrival = agent.next_arrival
+        if arrival is None or arrival == step:
+            agent.next_arrival = None
+            return step + 1
+        return arrival if arrival < np.inf else None
+
+    def update(self, agent, state: dict) -> NoReturn:
+        agent.update(state, arrival=not agent.is_busy())
+
+
+class UpdateScheduler:
+    """
+    Updates a population from the market state, calling each agent's update only at the steps its cadence asks for.
+
+    Replaces the loop updating every agent after each step of a market environment. The cadence of an agent is
+    given per agent class, or taken from the update_cadence of the class, where None updates the agent every step.
+    Agents are kept in a calendar keyed by the step of their next check, so an agent costs nothing in the steps in
+    between, while agents with a PriceThreshold cadence are checked together with one vectorized comparison.
+    Agents are updated in the order of the agent list, like the loop.
+
+    With decision threads, the prepare_update of every due agent with a concurrent_decision, e.g. the policy
+    forward passes of an ActorCriticAgent, is submitted to a thread pool before the updates start. The other agents
+    update in the meantime, and each of these agents waits for its preparation when its turn comes. Preparations
+    draw no random numbers, so the updates consume all generators in the same order as without threads and the
+    results are the same, while the step takes about as long as the slowest preparation instead of their sum.
+    """
+
+    def __init__(self, agents: list, cadences: dict = None, decision_threads: int = None):
+        """
+        Constructor
+        :param agents: agents in the order they are updated
+        :param cadences: cadence of each agent class, overriding the update_cadence of the class
+        :param decision_threads: number of threads preparing the updates of agents with a concurrent_decision,
+        None to update all agents in this thread
+        """
+        cadences = {} if cadences is None else cadences
+        self.agents = agents
+        self.cadences = [cadences.get(type(agent), agent.update_cadence) for agent in agents]
+        self.step = 0
+        self.calendar = {0: []}  # step -> indices of the agents checked in it
+        self.every_step = []
+        threshold_agents, thresholds = [], []
+        for index, cadence in enumerate(self.cadences):
+            if cadence is None:
+                self.cadences[index] = Cadence()
+                self.every_step.append(index)
+            elif isinstance(cadence, PriceThreshold):
+                threshold_agents.append(index)
+                thresholds.append(cadence.threshold)
+            else:
+                self.calendar[0].append(index)
+        self.threshold_agents = np.array(threshold_agents, dtype=np.int64)
+        self.thresholds = np.array(thresholds, dtype=float)
+        self.reference_prices = np.full(len(threshold_agents), np.nan)  # price at the last update
+        self.expiring = []  # agents whose orders expire unless they update in the current step
+        self.n_updates = 0
+        self.decision_threads = decision_threads
+        self.concurrent_agents = {index for index, agent in enumerate(agents) if agent.concurrent_decision}
+        self.executor = None
+
+    def __getstate__(self) -> dict:
+        """
+        State for copying and pickling, without the thread pool, which is created again when needed
+        """
+        state = self.__dict__.copy()
+        state['executor'] = None
+        return state
+
+    def prepare(self, due: list, state: dict) -> dict:
+        """
+        Submits the preparation of the due agents with a concurrent decision to the thread pool
+
+        :param due: indices of the agents updating in the current step
+        :param state: market state
+        :return: future of each prepared agent index
+        """
+        if self.decision_threads is None or len(self.concurrent_agents) == 0:
+            return {}
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.decision_threads)
+        return {index: self.executor.submit(self.agents[index].prepare_update, state)
+                for index in due if index in self.concurrent_agents}
+
+    def due_agents(self, state: dict) -> list:
+        """
+        Finds the agents updating in the current step
+
+        :param state: market state
+        :return: sorted agent indices
+        """
+        due = [index for index in self.calendar.pop(self.step, [])
+               if self.cadences[index].is_due(self.agents[index], self.step)]
+        if len(self.threshold_agents) > 0:
+            price = state["market_prices"][-1]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                moved = ~(np.abs(price / self.reference_prices - 1) <= self.thresholds)
+            self.reference_prices[moved] = price
+            due += self.threshold_agents[moved].tolist()
+        return sorted(self.every_step + due)
+
+    def update(self, state: dict) -> list:
+        """
+        Updates the agents due in the current step and moves to the next step
+
+        :param state: market state
+        :return: indices of the updated agents
+        """
+        step = self.step
+        scheduled = self.calendar.get(step, [])
+        due = self.due_agents(state)
+        preparations = self.prepare(due, state)
+        for index in due:
+            if index in preparations:
+                preparations[index].result()
+            self.cadences[index].update(self.agents[index], state)
+        self.n_updates += len(due)
+
+        # Schedule the next check of every calendar agent checked now, due or not
+        for index in scheduled:
+            next_check = self.cadences[index].next_check(self.agents[index], step)
+            if next_check is not None:
+                self.calendar.setdefault(next_check, []).append(index)
+
+        # Withdraw the orders of agents which did not update since submitting them
+        updated = set(due)
+        for index in self.expiring:
+            if index not in updated:
+                self.expire(self.agents[index])
+        self.expiring = [index for index in due if self.cadences[index].expire_orders]
+        self.step += 1
+        return due
+
+    @staticmethod
+    def expire(agent) -> NoReturn:
+        """
+        Withdraws the orders of an agent
+        """
+        agent.buy_price = np.nan
+        agent.sell_price = np.nan
+        agent.submit_orders()
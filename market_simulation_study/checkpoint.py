@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import NoReturn
+import os
+import pickle
+import numpy as np
+from market_simulation_study.snapshot import get_random_state, set_random_state
+
+MAGIC = b"MSSCKPT1"
+ALIGNMENT = 64
+
+
+def aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def dumps(objects) -> list:
+    """
+    Serializes objects with pickle protocol 5, keeping numpy arrays out of band as raw buffers.
+    The buffers are copied, so the objects can change as soon as this returns.
+
+    :param objects: objects to serialize
+    :return: chunks of the checkpoint file, header and pickle stream followed by the buffers
+    """
+    buffers = []
+    stream = pickle.dumps(objects, protocol=5, buffer_callback=buffers.append)
+    buffers = [bytes(buffer.raw()) for buffer in buffers]
+    lengths = [len(stream)] + [len(buffer) for buffer in buffers]
+    header = MAGIC + np.array([len(buffers)] + lengths, dtype="<i8").tobytes()
+    return [header, stream] + buffers
+
+
+def write(path: str, chunks: list) -> NoReturn:
+    """
+    Writes the chunks of a checkpoint, each starting at an aligned offset, to a temporary file which then replaces
+    the file at path, so a crash while writing never leaves a partial checkpoint behind
+
+    :param path: path of the checkpoint
+    :param chunks: output of dumps
+    :return: NoReturn
+    """
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        offset = 0
+        for chunk in chunks:
+            file.write(bytes(aligned(offset) - offset))
+            file.write(chunk)
+            offset = aligned(offset) + len(chunk)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+def read(path: str):
+    """
+    Reads a checkpoint with one read into memory, from which the numpy arrays are restored without copying
+
+    :param path: path of the checkpoint
+    :return: serialized objects
+    """
+    data = bytearray(os.path.getsize(path))
+    with open(path, "rb") as file:
+        file.readinto(data)
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a checkpoint")
+    n_buffers = int(np.frombuffer(data, dtype="<i8", count=1, offset=len(MAGIC))[0])
+    lengths = np.frombuffer(data, dtype="<i8", count=n_buffers + 1, offset=len(MAGIC) + 8).tolist()
+    view = memoryview(data)
+    chunks = []
+    offset = len(MAGIC) + 8 * (n_buffers + 2)
+    for length in lengths:
+        offset = aligned(offset)
+        chunks.append(view[offset:offset + length])
+        offset += length
+    return pickle.loads(chunks[0], buffers=chunks[1:])
+
+
+class Checkpointer:
+    """
+    Periodic checkpoints of a simulation, from which a crashed or preempted run is resumed.
+
+    A checkpoint holds the environment, the agents, other objects of the simulation like an UpdateScheduler, the
+    loop counters and the state of the global random generators. Everything is serialized with pickle protocol 5,
+    with numpy arrays such as histories, the fill ledger and books stored as raw buffers, torch models and optimizers
+    as their tensors, the replay memory of an ActorCriticAgent as stacked tensors and the order DataFrames of the
+    agents left out. Serialization happens in the simulation loop, which only takes as long as pickling and copying
+    the buffers, while the file is written by a background thread. A checkpoint is restored with one read, without
+    copying the arrays again.
+    """
+
+    def __init__(self, directory: str, interval: int = 100, keep: int = 2, background: bool = True):
+        """
+        Constructor
+        :param directory: directory of the checkpoint files
+        :param interval: number of steps between two checkpoints taken by maybe_save
+        :param keep: number of most recent checkpoints kept
+        :param background: if True the files are written by a background thread
+        """
+        if keep < 1:
+            raise ValueError("keep must be at least 1")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.executor = ThreadPoolExecutor(max_workers=1) if background else None
+        self.pending = None
+
+    def path(self, step: int) -> str:
+        return os.path.join(self.directory, f"checkpoint_{step:010d}.ckpt")
+
+    def checkpoints(self) -> list:
+        """
+        Paths of the checkpoints in the directory, oldest first
+        """
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith("checkpoint_") and name.endswith(".ckpt"))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def maybe_save(self, step: int, environment, agents: list, objects: tuple = (), counters: dict = None) -> bool:
+        """
+        Saves a checkpoint if the step is a multiple of the interval
+
+        :return: True if a checkpoint was taken
+        """
+        if step % self.interval != 0:
+            return False
+        self.save(step, environment, agents, objects, counters)
+        return True
+
+    def save(self, step: int, environment, agents: list, objects: tuple = (), counters: dict = None) -> str:
+        """
+        Takes a checkpoint, which is written in the background unless the checkpointer was created without
+
+        :param step: step of the loop, the checkpoint is resumed from the next step
+        :param environment: market environment
+        :param agents: agents trading in the environment
+        :param objects: other objects of the simulation
+        :param counters: loop counters and any other values of the loop, like recorded series
+        :return: path of the checkpoint
+        """
+        checkpoint = {'step': step,
+                      'environment': environment,
+                      'agents': agents,
+                      'objects': tuple(objects),
+                      'counters': {} if counters is None else counters,
+                      'random_state': get_random_state()}
+        chunks = dumps(checkpoint)
+        path = self.path(step)
+        self.wait()
+        if self.executor is None:
+            self.write(path, chunks)
+        else:
+            self.pending = self.executor.submit(self.write, path, chunks)
+        return path
+
+    def write(self, path: str, chunks: list) -> NoReturn:
+        """
+        Writes a checkpoint and removes the checkpoints older than the last keep
+        """
+        write(path, chunks)
+        for old_path in self.checkpoints()[:-self.keep]:
+            os.remove(old_path)
+
+    def wait(self) -> NoReturn:
+        """
+        Waits until the last checkpoint is written, raising the error of the write if it failed
+        """
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def restore(self, path: str = None) -> dict:
+        """
+        Loads a checkpoint and restores the global random generators, so the run continues as if uninterrupted
+
+        :param path: path of the checkpoint, by default the most recent one in the directory
+        :return: checkpoint with the keys step, environment, agents, objects and counters, None if there is none
+        """
+        self.wait()
+        if path is None:
+            paths = self.checkpoints()
+            if len(paths) == 0:
+                return None
+            path = paths[-1]
+        checkpoint = read(path)
+        set_random_state(checkpoint.pop('random_state'))
+        return checkpoint
+
+    def close(self) -> NoReturn:
+        """
+        Waits for the last checkpoint and stops the background thread
+        """
+        self.wait()
+        if self.executor is not None:
+            self.executor.shutdown()
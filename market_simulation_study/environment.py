@@ -1,111 +1,245 @@
-from typing import NoReturn
+from typing import NoReturn, Tuple
+import copy
 import numpy as np
+from numpy import ndarray
 import pandas as pd
 import random
 from codelib.stats import weighted_percentile
+from market_simulation_study.order_book import ArrayOrderBook, PersistentOrderBook, PriceLadder
+from market_simulation_study.ledger import FillLedger
+from market_simulation_study.auction import clearing_price, allocate, pair_fills
+from market_simulation_study.scheduler import LatencyScheduler
+from market_simulation_study.market_state import RingBuffer, MarketState
+from market_simulation_study.indicators import IndicatorEngine
+from market_simulation_study.snapshot import SimulationSnapshot
+from market_simulation_study.trade_tape import TradeTape
 
 
 class MarketEnvironment:
     def __init__(self,
                  state: dict,
-                 use_last_traded_price=True):
+                 use_last_traded_price=True,
+                 matching_engine: str = "dataframe",
+                 auction_allocation: str = "pro_rata",
+                 tick_size: float = None,
+                 depth_levels: int = 5,
+                 order_ttl: int = None,
+                 draw_latencies: bool = False,
+                 history_capacity: int = None,
+                 zero_volume_fills: bool = True,
+                 incremental_indicators: bool = False,
+                 trade_tape: TradeTape = None):
+        """
+        Constructor
+        :param state: initial market state
+        :param use_last_traded_price: if True the market price is the last traded price, else the volume weighted median
+        :param matching_engine: "dataframe" for the original pandas order book, "array" for the numpy order book,
+        "auction" for a call auction clearing all orders of a step at one price or "persistent" for a
+        good-till-cancelled book where only changed quotes are submitted
+        :param auction_allocation: "pro_rata" or "latency", how the auction shares the marginal price level
+        :param tick_size: if given, buy prices are rounded down and sell prices up to this tick size, and a depth
+        snapshot of the resting book is published in the state
+        :param depth_levels: number of price levels on each side in the depth snapshot
+        :param order_ttl: number of steps orders rest in the persistent book, None for no expiry
+        :param draw_latencies: if True the latencies of all agents are drawn at once when matching, instead of by
+        each agent's update
+        :param history_capacity: number of market prices and traded volumes kept in the state, None to keep the
+        full history
+        :param zero_volume_fills: if True priced orders without volume are matched like in the original order book,
+        producing zero volume fills against crossing resting orders, else the array engine leaves them out
+        :param incremental_indicators: if True the state holds an IndicatorEngine under "indicators", from which
+        agents take rolling means and standard deviations of the market prices instead of computing them from the
+        history
+        :param trade_tape: if given, every fill is streamed to this TradeTape when the state is published, whose
+        close is to be called at the end of the episode
+        """
+        if matching_engine not in ("dataframe", "array", "auction", "persistent"):
+            raise ValueError(f"Unknown matching engine: {matching_engine}")
+        if auction_allocation not in ("pro_rata", "latency"):
+            raise ValueError(f"Unknown auction allocation: {auction_allocation}")
+        if tick_size is not None and matching_engine == "dataframe":
+            raise ValueError("tick_size requires a matching engine other than dataframe")
+        if draw_latencies and matching_engine == "dataframe":
+            raise ValueError("draw_latencies requires a matching engine other than dataframe")
+        if not zero_volume_fills and matching_engine == "dataframe":
+            raise ValueError("zero_volume_fills=False requires a matching engine other than dataframe")
         self.state = state.copy()
         self.use_last_traded_price = use_last_traded_price
-        self.market_prices = state["market_prices"].copy()
+        self.zero_volume_fills = zero_volume_fills
+        self.matching_engine = matching_engine
+        self.auction_allocation = auction_allocation
+        self.scheduler = LatencyScheduler(draw_latencies)
+        self.queue = None
+        self.order_book = ArrayOrderBook()
+        self.persistent_book = PersistentOrderBook() if matching_engine == "persistent" else None
+        self.order_ttl = order_ttl
+        self.submitted_quotes = np.zeros((0, 4))  # ledger slot -> last submitted buy/sell price and volume
+        self.resting_sequences = np.zeros((0, 2), dtype=np.int64)  # ledger slot -> resting buy/sell order
+        self.tick_size = tick_size
+        self.price_ladder = PriceLadder(tick_size, depth_levels) if tick_size is not None else None
+        self.market_prices = RingBuffer(state["market_prices"], history_capacity)
+        self.volume_history = RingBuffer(capacity=history_capacity)
+        self.indicators = IndicatorEngine(self.market_prices) if incremental_indicators else None
         self.matched_volumes = state["volume"]
         self.fee = state["fee"]
         self.slippage = state["slippage"]
         self.agents = None
         self.all_traded_prices = []
-
-    def get_latencies(self):
-        latencies = [0] * len(self.agents)
-        for i in range(len(self.agents)):
-            latencies[i] = self.agents[i].latency
-        # que_indices = range(len(self.agents))
-
-        return latencies
-
-    def get_agent_ids(self):
-        agent_ids = [0] * len(self.agents)
-        for i in range(len(self.agents)):
-            agent_ids[i] = self.agents[i].agent_id
-        return agent_ids
-
-    def calc_mean_order_prices(self) -> NoReturn:
-        sell_prices, buy_prices = [0] * len(self.agents), [0] * len(self.agents)
-        sell_volumes, buy_volumes = [0] * len(self.agents), [0] * len(self.agents)
-        for i, agent in enumerate(self.agents):
-            sell_prices[i] = agent.sell_price
-            buy_prices[i] = agent.buy_price
-            sell_volumes[i] = agent.sell_volume
-            buy_volumes[i] = agent.buy_volume
-
-        sell_price_list = np.array(sell_prices)
-        weights = np.array(sell_volumes)
-        mean_sell = np.ma.MaskedArray(sell_price_list, mask=np.isnan(sell_price_list))
-        mean_sell = np.ma.average(mean_sell, weights=weights)
-        self.mean_sell_price = mean_sell
-
-        buy_price_list = np.array(buy_prices)
-        weights = np.array(buy_volumes)
-        mean_buy = np.ma.MaskedArray(buy_price_list, mask=np.isnan(buy_price_list))
-        mean_buy = np.ma.average(mean_buy, weights=weights)
-        self.mean_buy_price = mean_buy
+        self.time = 0
+        self.ledger = FillLedger()
+        self.trade_tape = trade_tape
+        self.accounts = []  # ledger slot -> agent
+        self.agent_slots = None
+        self.n_short_circuited_steps = 0
+
+    def get_latencies(self) -> ndarray:
+        return np.fromiter((agent.latency for agent in self.agents), dtype=float, count=len(self.agents))
+
+    def get_agent_ids(self) -> ndarray:
+        return np.fromiter((agent.agent_id for agent in self.agents), dtype=float, count=len(self.agents))
+
+    def calc_order_metrics(self) -> NoReturn:
+        """
+        Calculates the order metrics of the step in one vectorized pass over the order arrays of the population.
+
+        Mean buy and sell prices are weighted by volume and ignore nan prices, and are nan when no volume is quoted.
+        Total volumes include every submitted volume, while the quote counts and the order imbalance only count
+        orders with a price and positive volume.
+        """
+        buy_prices, buy_volumes = self.buy_orders[:, 0], self.buy_orders[:, 1]
+        sell_prices, sell_volumes = self.sell_orders[:, 0], self.sell_orders[:, 1]
+        buy_quoted, sell_quoted = ~np.isnan(buy_prices), ~np.isnan(sell_prices)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.mean_buy_price = (np.sum(np.where(buy_quoted, buy_prices * buy_volumes, 0))
+                                   / np.sum(np.where(buy_quoted, buy_volumes, 0)))
+            self.mean_sell_price = (np.sum(np.where(sell_quoted, sell_prices * sell_volumes, 0))
+                                    / np.sum(np.where(sell_quoted, sell_volumes, 0)))
+
+        self.total_buy_volume = np.sum(buy_volumes)
+        self.total_sell_volume = np.sum(sell_volumes)
+
+        # Index of the orders taking part in matching, so idle agents never enter the matching loop
+        buy_live, sell_live = buy_quoted & (buy_volumes > 0), sell_quoted & (sell_volumes > 0)
+        self.live_buys, self.live_sells = buy_live, sell_live
+        self.active_buys = buy_quoted if self.zero_volume_fills else buy_live
+        self.active_sells = sell_quoted if self.zero_volume_fills else sell_live
+        self.n_buy_quotes = np.count_nonzero(buy_live)
+        self.n_sell_quotes = np.count_nonzero(sell_live)
+        live_buy_volume, live_sell_volume = buy_volumes[buy_live].sum(), sell_volumes[sell_live].sum()
+        live_volume = live_buy_volume + live_sell_volume
+        self.order_imbalance = (live_buy_volume - live_sell_volume) / live_volume if live_volume > 0 else 0.0
+
+    def register_agents(self) -> NoReturn:
+        """
+        Opens a fill ledger account for agents new to the environment, or reset since their last step
+        """
+        for agent in self.agents:
+            if agent.ledger is not self.ledger:
+                slot = self.ledger.open_account(agent.agent_id, agent.calculate_realized_value(), agent.position)
+                agent.attach_ledger(self.ledger, slot)
+                self.accounts.append(agent)
+        self.agent_slots = np.array([agent.ledger_slot for agent in self.agents])
+
+    def get_orders(self) -> Tuple[ndarray, ndarray]:
+        """
+        Collects the current orders of all agents
+
+        :return: buy and sell orders as arrays with rows (price, volume, latency, agent_id)
+        """
+        buy_orders = np.array([agent.buy_record.values() for agent in self.agents], dtype=float)
+        sell_orders = np.array([agent.sell_record.values() for agent in self.agents], dtype=float)
+        if self.scheduler.draw_latencies:
+            buy_orders[:, 2] = sell_orders[:, 2] = self.scheduler.latencies
+        if self.price_ladder is not None:
+            buy_orders[:, 0] = self.price_ladder.buy_ticks(buy_orders[:, 0]) * self.tick_size
+            sell_orders[:, 0] = self.price_ladder.sell_ticks(sell_orders[:, 0]) * self.tick_size
+        return buy_orders, sell_orders
 
     def match(self):
-        latencies = self.get_latencies()
-        self.calc_mean_order_prices()
+        """
+        Matches the orders of all agents using the selected matching engine.
+
+        Only the dataframe and array engines are skipped for steps where no buy price reaches a sell price, as such
+        a step cannot produce any fill, and n_short_circuited_steps counts the skipped steps. The persistent engine
+        always runs, since the quotes of a step are matched against orders resting from earlier steps, as does the
+        auction, which clears all orders in one vectorized call.
+        """
+        self.queue = self.scheduler.schedule(self.agents)
+        self.buy_orders, self.sell_orders = self.get_orders()
+        self.calc_order_metrics()
+        if self.matching_engine in ("dataframe", "array") and not self.orders_cross():
+            self.finalize_without_trades()
+        elif self.matching_engine == "array":
+            self.match_array()
+        elif self.matching_engine == "auction":
+            self.match_auction()
+        elif self.matching_engine == "persistent":
+            self.match_persistent()
+        else:
+            self.match_dataframe()
+
+    def orders_cross(self) -> bool:
+        """
+        Checks if the best active buy price reaches the best active sell price
+
+        :return: True if at least one buy and one sell order cross
+        """
+        buy_prices = self.buy_orders[self.active_buys, 0]
+        sell_prices = self.sell_orders[self.active_sells, 0]
+        return len(buy_prices) > 0 and len(sell_prices) > 0 and buy_prices.max() >= sell_prices.min()
+
+    def finalize_without_trades(self) -> NoReturn:
+        """
+        Finalizes a step without fills, with the same outcome as running the matching engine
+        """
+        if self.price_ladder is not None:
+            self.price_ladder.update(self.buy_orders[self.live_buys, 0], self.buy_orders[self.live_buys, 1],
+                                     self.sell_orders[self.live_sells, 0], self.sell_orders[self.live_sells, 1])
+        self.update_prices(np.array([]), np.array([]))
+        self.n_short_circuited_steps += 1
+
+    def match_dataframe(self):
         matched_volume = []
         matched_price = []
-        # Sort agents corresponding to latencies
-        self.agents = [x for _, x in sorted(zip(latencies, self.agents))]  # Sorting buyers according to latency
+        # Agents are processed in latency order
+        queue = [self.agents[i] for i in self.queue]
 
-        sell_order_book = self.agents[0].sell_order
-        buy_order_book = self.agents[0].buy_order
+        sell_order_book = queue[0].sell_order
+        buy_order_book = queue[0].buy_order
         sell_order_book = pd.DataFrame(sell_order_book, index=sell_order_book.iloc[:, -1])
         buy_order_book = pd.DataFrame(buy_order_book, index=buy_order_book.iloc[:, -1])
 
-        total_buy_volume = self.agents[0].buy_volume
-        total_sell_volume = self.agents[0].sell_volume
-
-        for i in range(len(self.agents) - 1):
-            total_buy_volume += self.agents[i + 1].buy_volume
-            total_sell_volume += self.agents[i + 1].sell_volume
+        for i in range(len(queue) - 1):
             # ========================================#
             # CHECK IF AGENT i CAN MAKE A BUY TRADE #
             # ========================================#
-            if any(self.agents[i + 1].buy_order["buy_price"].values >= sell_order_book.iloc[:, 0].values):
+            if any(queue[i + 1].buy_order["buy_price"].values >= sell_order_book.iloc[:, 0].values):
                 # print("price_match: ", self.agents[i+1].buy_order["buy_price"].values, sell_order_book.iloc[:, 0].values)
 
                 matched_order_book = sell_order_book[
-                    sell_order_book["sell_price"].values <= self.agents[i + 1].buy_order["buy_price"].values]
+                    sell_order_book["sell_price"].values <= queue[i + 1].buy_order["buy_price"].values]
                 matched_order_book = matched_order_book.sort_values(["sell_price", "latency"], ascending=[True, True])
 
                 for index, order in matched_order_book.iterrows():
-                    if self.agents[i + 1].buy_order["buy_volume"].values > order["sell_volume"]:
+                    if queue[i + 1].buy_order["buy_volume"].values > order["sell_volume"]:
                         trade_volume = order["sell_volume"].copy()
 
                     else:
-                        trade_volume = self.agents[i + 1].buy_order["buy_volume"].values[0].copy()
+                        trade_volume = queue[i + 1].buy_order["buy_volume"].values[0].copy()
 
-                    self.agents[i + 1].buy_order["buy_volume"] -= trade_volume
+                    queue[i + 1].buy_order["buy_volume"] -= trade_volume
                     # self.agents[int(order["agent_id"])].sell_order["sell_volume"] -= trade_volume
                     sell_order_book.at[index, 'sell_volume'] -= trade_volume
                     trade_price = order["sell_price"]
-                    buy_trade = np.array([trade_price, -trade_volume])
-                    sell_trade = np.array([trade_price, trade_volume])
 
-                    self.agents[i + 1].position += trade_volume
-                    self.agents[i + 1].all_trades = np.vstack((self.agents[i + 1].all_trades, buy_trade))
+                    queue[i + 1].position += trade_volume
 
                     # Update agent who traded from order book position and trade history
-                    for j in range(len(self.agents)):
-                        if self.agents[j].agent_id == index:
-                            # self.agents[int(order["agent_id"])].position += trade_volume
-                            # self.agents[int(order["agent_id"])].all_trades = np.vstack((self.agents[int(order["agent_id"])].all_trades, buy_trade))
-                            self.agents[j].all_trades = np.vstack((self.agents[j].all_trades, sell_trade))
-                            self.agents[j].position -= trade_volume
+                    seller = self.accounts[self.ledger.slots[index]]
+                    seller.position -= trade_volume
+                    self.ledger.record(self.time, trade_price, trade_volume, queue[i + 1].ledger_slot,
+                                       seller.ledger_slot, True)
 
                     # self.agents[int(order["agent_id"])].position -= trade_volume
                     # self.agents[int(order["agent_id"])].all_trades = np.vstack((self.agents[int(order["agent_id"])].all_trades, buy_trade))
@@ -115,8 +249,8 @@ class MarketEnvironment:
                     matched_volume.append(trade_volume)
             # SELL ORDER INTO SELL ORDER
             sell_order_book = sell_order_book[sell_order_book["sell_volume"] > 0]
-            if self.agents[i + 1].buy_order["buy_volume"].values > 0:
-                buy_order_book = buy_order_book.append(self.agents[i + 1].buy_order)
+            if queue[i + 1].buy_order["buy_volume"].values > 0:
+                buy_order_book = buy_order_book.append(queue[i + 1].buy_order)
 
             sell_order_book = pd.DataFrame(sell_order_book, index=sell_order_book.iloc[:, -1])
             buy_order_book = pd.DataFrame(buy_order_book, index=buy_order_book.iloc[:, -1])
@@ -124,38 +258,32 @@ class MarketEnvironment:
             # ========================================#
             # CHECK IF AGENT i CAN MAKE A SELL TRADE #
             # ========================================#
-            if any(self.agents[i + 1].sell_order["sell_price"].values <= buy_order_book.iloc[:, 0].values):
+            if any(queue[i + 1].sell_order["sell_price"].values <= buy_order_book.iloc[:, 0].values):
                 # print("price_match: ", self.agents[i+1].sell_order["sell_price"].values, buy_order_book.iloc[:, 0].values)
 
                 matched_order_book = buy_order_book[
-                    buy_order_book["buy_price"].values >= self.agents[i + 1].sell_order["sell_price"].values]
+                    buy_order_book["buy_price"].values >= queue[i + 1].sell_order["sell_price"].values]
                 matched_order_book = matched_order_book.sort_values(["buy_price", "latency"], ascending=[False, True])
 
                 for index, order in matched_order_book.iterrows():
-                    if self.agents[i + 1].sell_order["sell_volume"].values > order["buy_volume"]:
+                    if queue[i + 1].sell_order["sell_volume"].values > order["buy_volume"]:
                         trade_volume = order["buy_volume"].copy()
                     else:
-                        trade_volume = self.agents[i + 1].sell_order["sell_volume"].values[0].copy()
+                        trade_volume = queue[i + 1].sell_order["sell_volume"].values[0].copy()
 
-                    self.agents[i + 1].sell_order["sell_volume"] -= trade_volume
+                    queue[i + 1].sell_order["sell_volume"] -= trade_volume
                     # self.agents[int(order["agent_id"])].buy_order["buy_volume"] -= trade_volume
                     buy_order_book.at[index, 'buy_volume'] -= trade_volume
                     trade_price = order["buy_price"]
 
-                    buy_trade = np.array([trade_price, -trade_volume])
-                    sell_trade = np.array([trade_price, trade_volume])
-
                     # Update agent i's position and trade history
-                    self.agents[i + 1].all_trades = np.vstack((self.agents[i + 1].all_trades, sell_trade))
-                    self.agents[i + 1].position -= trade_volume
+                    queue[i + 1].position -= trade_volume
 
                     # Update agent who traded from order book position and trade history
-                    for j in range(len(self.agents)):
-                        if self.agents[j].agent_id == index:
-                            # self.agents[int(order["agent_id"])].position += trade_volume
-                            # self.agents[int(order["agent_id"])].all_trades = np.vstack((self.agents[int(order["agent_id"])].all_trades, buy_trade))
-                            self.agents[j].all_trades = np.vstack((self.agents[j].all_trades, buy_trade))
-                            self.agents[j].position += trade_volume
+                    buyer = self.accounts[self.ledger.slots[index]]
+                    buyer.position += trade_volume
+                    self.ledger.record(self.time, trade_price, trade_volume, buyer.ledger_slot,
+                                       queue[i + 1].ledger_slot, False)
 
                     # UPDATE ALL MATCHED PRICES AND VOLUMES
                     matched_price.append(trade_price)
@@ -164,51 +292,314 @@ class MarketEnvironment:
 
             # buy ORDER INTO buy ORDER
             buy_order_book = buy_order_book[buy_order_book["buy_volume"] > 0]
-            if self.agents[i + 1].sell_order["sell_volume"].values > 0:
-                sell_order_book = sell_order_book.append(self.agents[i + 1].sell_order)
+            if queue[i + 1].sell_order["sell_volume"].values > 0:
+                sell_order_book = sell_order_book.append(queue[i + 1].sell_order)
 
             sell_order_book = pd.DataFrame(sell_order_book, index=sell_order_book.iloc[:, -1])
             buy_order_book = pd.DataFrame(buy_order_book, index=buy_order_book.iloc[:, -1])
 
+        self.update_prices(np.array(matched_price), np.array(matched_volume))
+
+    def match_array(self):
+        """
+        Matches the orders of all agents in latency order on the numpy order book.
+
+        Produces the same fills, prices and trade histories as match_dataframe, but never builds DataFrames and
+        leaves the order of the agent list untouched. Sides without an active order are skipped, so the cost of a
+        step grows with the number of quoting agents rather than the population.
+        """
+        buy_orders, sell_orders = self.buy_orders, self.sell_orders
+        n_agents = len(self.agents)
+        queue = self.queue
+
+        book = self.order_book
+        book.reset(capacity=n_agents)
+        first = queue[0]
+        if self.active_buys[first]:
+            book.add_buy_order(buy_orders[first, 0], buy_orders[first, 1], buy_orders[first, 2], first)
+        if self.active_sells[first]:
+            book.add_sell_order(sell_orders[first, 0], sell_orders[first, 1], sell_orders[first, 2], first)
+
+        # Only agents with an active order are visited. The agent after the seed is always checked, since its
+        # checks prune the seed orders.
+        active_buys, active_sells = self.active_buys, self.active_sells
+        later = queue[2:]
+        later = later[active_buys[later] | active_sells[later]]
+        trade_prices, trade_volumes, aggressors, counterparties, aggressor_buys = [], [], [], [], []
+        for position, i in enumerate(np.concatenate((queue[1:2], later))):
+            # CHECK IF AGENT i CAN MAKE A BUY TRADE
+            if position == 0 or active_buys[i]:
+                buy_price, buy_volume, latency = buy_orders[i, :3]
+                prices, volumes, sellers = book.match_buy_order(buy_price, buy_volume)
+                if len(prices) > 0:
+                    trade_prices.append(prices)
+                    trade_volumes.append(volumes)
+                    aggressors.append(np.full(len(prices), i))
+                    counterparties.append(sellers)
+                    aggressor_buys.append(np.ones(len(prices), dtype=bool))
+                    buy_volume -= volumes.sum()
+                book.prune_sell_orders()
+                if buy_volume > 0:
+                    book.add_buy_order(buy_price, buy_volume, latency, i)
+
+            # CHECK IF AGENT i CAN MAKE A SELL TRADE
+            if position == 0 or active_sells[i]:
+                sell_price, sell_volume, latency = sell_orders[i, :3]
+                prices, volumes, buyers = book.match_sell_order(sell_price, sell_volume)
+                if len(prices) > 0:
+                    trade_prices.append(prices)
+                    trade_volumes.append(volumes)
+                    aggressors.append(np.full(len(prices), i))
+                    counterparties.append(buyers)
+                    aggressor_buys.append(np.zeros(len(prices), dtype=bool))
+                    sell_volume -= volumes.sum()
+                book.prune_buy_orders()
+                if sell_volume > 0:
+                    book.add_sell_order(sell_price, sell_volume, latency, i)
+
+        if len(trade_prices) > 0:
+            trade_prices = np.concatenate(trade_prices)
+            trade_volumes = np.concatenate(trade_volumes)
+            aggressor_buys = np.concatenate(aggressor_buys)
+            aggressors = np.concatenate(aggressors)
+            counterparties = np.concatenate(counterparties)
+            buyers = np.where(aggressor_buys, aggressors, counterparties)
+            sellers = np.where(aggressor_buys, counterparties, aggressors)
+            self.settle_trades(trade_prices, trade_volumes, buyers, sellers, aggressor_buys)
+        else:
+            trade_prices, trade_volumes = np.array([]), np.array([])
+
+        if self.price_ladder is not None:
+            buy_orders = book.buy_orders[:book.n_buy_orders]
+            sell_orders = book.sell_orders[:book.n_sell_orders]
+            buy_orders = buy_orders[~np.isnan(buy_orders["price"]) & (buy_orders["volume"] > 0)]
+            sell_orders = sell_orders[~np.isnan(sell_orders["price"]) & (sell_orders["volume"] > 0)]
+            self.price_ladder.update(buy_orders["price"], buy_orders["volume"],
+                                     sell_orders["price"], sell_orders["volume"])
+
+        self.update_prices(trade_prices, trade_volumes)
+
+    def match_auction(self):
+        """
+        Clears the orders of all agents in a single call auction.
+
+        All orders of the step meet at the uniform price maximizing the executed volume. Better priced orders are
+        filled first and the marginal price level is shared pro-rata or by latency priority. The later of the two
+        orders in a fill is recorded as the aggressor.
+        """
+        buy_orders, sell_orders = self.buy_orders, self.sell_orders
+        buy_indices = np.flatnonzero(self.live_buys)
+        sell_indices = np.flatnonzero(self.live_sells)
+        buy_orders, sell_orders = buy_orders[buy_indices], sell_orders[sell_indices]
+
+        price, volume = clearing_price(buy_orders[:, 0], buy_orders[:, 1], sell_orders[:, 0], sell_orders[:, 1],
+                                       self.market_prices[-1])
+        buy_residual, sell_residual = buy_orders[:, 1].copy(), sell_orders[:, 1].copy()
+        if volume > 0:
+            buy_crossing = np.flatnonzero(buy_orders[:, 0] >= price)
+            sell_crossing = np.flatnonzero(sell_orders[:, 0] <= price)
+            buy_fills, buy_volumes = allocate(-buy_orders[buy_crossing, 0], buy_orders[buy_crossing, 1],
+                                              buy_orders[buy_crossing, 2], volume, self.auction_allocation)
+            sell_fills, sell_volumes = allocate(sell_orders[sell_crossing, 0], sell_orders[sell_crossing, 1],
+                                                sell_orders[sell_crossing, 2], volume, self.auction_allocation)
+            buy_fills, sell_fills = buy_crossing[buy_fills], sell_crossing[sell_fills]
+            buy_residual[buy_fills] -= buy_volumes
+            sell_residual[sell_fills] -= sell_volumes
+
+            buy_positions, sell_positions, trade_volumes = pair_fills(buy_volumes, sell_volumes)
+            buy_fills, sell_fills = buy_fills[buy_positions], sell_fills[sell_positions]
+            trade_prices = np.full(len(trade_volumes), price)
+            aggressor_buys = buy_orders[buy_fills, 2] > sell_orders[sell_fills, 2]
+            self.settle_trades(trade_prices, trade_volumes, buy_indices[buy_fills], sell_indices[sell_fills],
+                               aggressor_buys)
+        else:
+            trade_prices, trade_volumes = np.array([]), np.array([])
+
+        if self.price_ladder is not None:
+            self.price_ladder.update(buy_orders[buy_residual > 0, 0], buy_residual[buy_residual > 0],
+                                     sell_orders[sell_residual > 0, 0], sell_residual[sell_residual > 0])
+
+        self.update_prices(trade_prices, trade_volumes)
+
+    def match_persistent(self):
+        """
+        Matches only the quotes which changed since the agents' last submission against the persistent book.
+
+        An agent whose buy or sell price or volume differs from what it submitted before has its resting order on
+        that side cancelled. The new order is matched in latency order against the other side and any remainder
+        rests in the book. Unchanged quotes keep their resting orders and time priority.
+        """
+        buy_orders, sell_orders = self.buy_orders, self.sell_orders
+        n_slots = len(self.accounts)
+        if len(self.submitted_quotes) < n_slots:
+            n_new = n_slots - len(self.submitted_quotes)
+            self.submitted_quotes = np.vstack((self.submitted_quotes, np.full((n_new, 4), np.nan)))
+            self.resting_sequences = np.vstack((self.resting_sequences, np.zeros((n_new, 2), dtype=np.int64)))
+
+        slots = self.agent_slots
+        quotes = np.column_stack((buy_orders[:, :2], sell_orders[:, :2]))
+        previous_quotes = self.submitted_quotes[slots]
+        unchanged = (quotes == previous_quotes) | (np.isnan(quotes) & np.isnan(previous_quotes))
+        changed = ~(unchanged[:, [0, 2]] & unchanged[:, [1, 3]])
+        self.submitted_quotes[slots] = quotes
+
+        slot_indices = np.full(n_slots, -1)
+        slot_indices[slots] = np.arange(len(self.agents))
+        is_live = (slot_indices >= 0).__getitem__
+        expiry = self.time + self.order_ttl if self.order_ttl is not None else np.inf
+        book = self.persistent_book
+
+        movers = np.flatnonzero(changed.any(axis=1))
+        movers = self.queue[np.isin(self.queue, movers)]
+        trade_prices, trade_volumes, buyers, sellers, aggressor_buys = [], [], [], [], []
+        for i in movers:
+            for side, orders in enumerate((buy_orders, sell_orders)):
+                if not changed[i, side]:
+                    continue
+                is_buy = side == 0
+                book.cancel_order(self.resting_sequences[slots[i], side])
+                self.resting_sequences[slots[i], side] = 0
+                price, volume, latency = orders[i, :3]
+                if not volume > 0 or np.isnan(price):
+                    continue
+
+                prices, volumes, counterparty_slots = book.match_order(is_buy, price, volume, self.time, is_live)
+                if len(prices) > 0:
+                    counterparties = slot_indices[counterparty_slots]
+                    trade_prices.extend(prices)
+                    trade_volumes.extend(volumes)
+                    buyers.extend([i] * len(prices) if is_buy else counterparties)
+                    sellers.extend(counterparties if is_buy else [i] * len(prices))
+                    aggressor_buys.extend([is_buy] * len(prices))
+                    volume -= sum(volumes)
+                if volume > 0:
+                    self.resting_sequences[slots[i], side] = book.add_order(is_buy, price, volume, latency, slots[i],
+                                                                            expiry)
+
+        trade_prices, trade_volumes = np.array(trade_prices, dtype=float), np.array(trade_volumes, dtype=float)
+        if len(trade_prices) > 0:
+            self.settle_trades(trade_prices, trade_volumes, np.array(buyers), np.array(sellers),
+                               np.array(aggressor_buys))
+
+        if self.price_ladder is not None:
+            self.price_ladder.update(*book.resting_orders(self.time))
+
+        self.update_prices(trade_prices, trade_volumes)
+
+    def settle_trades(self, trade_prices: ndarray, trade_volumes: ndarray, buyers: ndarray, sellers: ndarray,
+                      aggressor_buys: ndarray) -> NoReturn:
+        """
+        Records a sequence of fills in the ledger and updates the positions of the agents who took part
+
+        :param trade_prices: fill prices
+        :param trade_volumes: fill volumes
+        :param buyers: agent indices of the buyers
+        :param sellers: agent indices of the sellers
+        :param aggressor_buys: True where the incoming order was the buy order
+        :return: NoReturn
+        """
+        self.ledger.record(self.time, trade_prices, trade_volumes, self.agent_slots[buyers],
+                           self.agent_slots[sellers], aggressor_buys)
+
+        n_agents = len(self.agents)
+        net_volumes = (np.bincount(buyers, weights=trade_volumes, minlength=n_agents)
+                       - np.bincount(sellers, weights=trade_volumes, minlength=n_agents))
+        for agent_index in np.unique(np.concatenate((buyers, sellers))):
+            self.agents[agent_index].position += net_volumes[agent_index]
+
+    def calculate_profit_and_loss(self) -> ndarray:
+        """
+        Marks all agents to the last market price in one vectorized pass, with the slippage adjustment for long
+        and short positions used by the agents' calculate_profit_and_loss
+
+        :return: profit and loss of each agent, in the order of the agent list
+        """
+        cash = self.ledger.cash.view()[self.agent_slots]
+        positions = self.ledger.positions.view()[self.agent_slots]
+        slippage = np.where(positions < 0, 1 + self.slippage, 1 - self.slippage)
+        return cash + positions * self.market_prices[-1] * slippage
+
+    def aggregate_by_class(self, values: ndarray) -> dict:
+        """
+        Sums a quantity given for each agent, like the output of calculate_profit_and_loss, over the agent classes
+
+        :param values: values in the order of the agent list
+        :return: sum of the values of each agent class, keyed by class name
+        """
+        return {agent_class.__name__: values[indices].sum() for agent_class, indices in self.scheduler.classes}
+
+    def update_prices(self, matched_price: ndarray, matched_volume: ndarray) -> NoReturn:
+        """
+        Updates the market price and traded volume from the fills of the current step
+
+        :param matched_price: fill prices in the order they were matched
+        :param matched_volume: fill volumes in the order they were matched
+        :return: NoReturn
+        """
         if np.sum(matched_volume) > 0:
             # mean_price = np.average(matched_price, weights = matched_volume)
             if self.use_last_traded_price:
                 median_price = matched_price[-1]
             else:
-                median_price = weighted_percentile(np.array(matched_price), p=0.5, probs=np.array(matched_volume))
+                median_price = weighted_percentile(matched_price, p=0.5, probs=matched_volume)
         else:
             median_price = self.market_prices[-1]
-            mean_price = self.market_prices[-1]
 
         # Update prices and trade info
-        # self.market_prices.append(mean_price)
-        self.market_prices.append(median_price)
-        # matched_trades = np.array([matched_buy_price, matched_sell_price, matched_buy_volume, matched_sell_volume])
+        if self.indicators is not None:
+            self.indicators.append(median_price)
+        else:
+            self.market_prices.append(median_price)
         self.matched_volumes = np.sum(matched_volume)
-
-        # Rearrange agents corresponding to agent ids
-
-        agent_ids = self.get_agent_ids()
-        self.agents = [x for _, x in sorted(zip(agent_ids, self.agents))]  # Sorting buyers according to latency
-        self.total_buy_volume = total_buy_volume
-        self.total_sell_volume = total_sell_volume
-        self.all_traded_prices = np.array(matched_price).copy()
+        self.volume_history.append(self.matched_volumes)
+        self.all_traded_prices = matched_price
+        self.n_trades = np.count_nonzero(matched_volume > 0)
+        self.vwap = np.sum(matched_price * matched_volume) / self.matched_volumes if self.n_trades > 0 else np.nan
 
     def update_market(self) -> NoReturn:
 
-        self.state = {'volume': self.matched_volumes,  # Total volume
-                      'market_prices': self.market_prices,
-                      'fee': self.fee,
-                      'mean_buy_price': self.mean_buy_price,
-                      'mean_sell_price': self.mean_sell_price,
-                      'slippage': self.slippage,
-                      'total_buy_volume': self.total_buy_volume,
-                      'total_sell_volume': self.total_sell_volume,
-                      'all_traded_prices': self.all_traded_prices}
+        values = {'volume': self.matched_volumes,  # Total volume
+                  'market_prices': self.market_prices,
+                  'volume_history': self.volume_history,
+                  'fee': self.fee,
+                  'mean_buy_price': self.mean_buy_price,
+                  'mean_sell_price': self.mean_sell_price,
+                  'slippage': self.slippage,
+                  'total_buy_volume': self.total_buy_volume,
+                  'total_sell_volume': self.total_sell_volume,
+                  'all_traded_prices': self.all_traded_prices,
+                  'n_buy_quotes': self.n_buy_quotes,
+                  'n_sell_quotes': self.n_sell_quotes,
+                  'order_imbalance': self.order_imbalance,
+                  'n_trades': self.n_trades,
+                  'vwap': self.vwap}
+        if self.indicators is not None:
+            values['indicators'] = self.indicators
+        lazy_values = {}
+        if self.price_ladder is not None:
+            # The ladder rebinds its arrays on update, so a shallow copy keeps this step's book for the snapshot
+            snapshot = copy.copy(self.price_ladder).snapshot
+            lazy_values = dict.fromkeys(self.price_ladder.snapshot_keys, snapshot)
+        self.state = MarketState(values, lazy_values)
+        if self.trade_tape is not None:
+            self.trade_tape.record(self)
+
+    def snapshot(self, agents: list = None, objects: tuple = (), shared: tuple = ()) -> SimulationSnapshot:
+        """
+        Takes a snapshot of the market and its agents, from which branches of the simulation can be forked
+
+        :param agents: agents of the simulation, by default those of the last step
+        :param objects: other objects of the simulation to copy with the market, e.g. an UpdateScheduler
+        :param shared: objects which all branches share instead of copying, e.g. networks of a frozen policy
+        :return: snapshot, whose fork returns the environment, the agents and the other objects of a branch
+        """
+        return SimulationSnapshot(self, self.agents if agents is None else agents, objects, shared)
 
     def step(self, agents: list) -> dict:
         self.agents = agents
+        self.register_agents()
         self.match()
         self.update_market()
+        self.time += 1
 
         return self.agents, self.state
@@ -0,0 +1,310 @@
+from typing import NoReturn
+import asyncio
+import heapq
+import numpy as np
+from numpy import ndarray
+from market_simulation_study.environment import MarketEnvironment
+from market_simulation_study.order_book import PersistentOrderBook
+
+# Kinds of events, in the order events at the same time are processed
+PERIOD_END, ORDER_ARRIVAL, TIMER, WAKE_UP, REQUOTE = range(5)
+
+
+class EventDrivenSimulator:
+    """
+    Runs a market environment in continuous simulated time, driven by a priority queue of events instead of steps.
+
+    Every agent wakes up at the times it chooses through next_wake_up, updates from the last published state and
+    submits its quotes, which reach the book latency later. Agents with wake_up_on_fill, like market makers, also
+    requote once after the fills of their orders at a time, without changing their regular wake-ups. An arriving
+    quote which differs from the agent's last one replaces its resting order on that side and is matched at once
+    against the persistent book, with the arrival time as time priority. The cost of a simulation therefore scales
+    with the number of events, not with agents times periods. At the end of every period the environment publishes
+    a state from the fills and the arrived orders of the period, with the same keys as a stepped MarketEnvironment.
+    If the environment draws the latencies, the latency of an agent is drawn from the scheduler whenever it wakes up
+    or requotes.
+
+    Events at the same time are processed period ends first, then order arrivals, strategy timers, wake-ups and
+    requotes after fills, each in the order they were scheduled.
+    """
+
+    def __init__(self,
+                 environment: MarketEnvironment,
+                 agents: list,
+                 period_length: float = 1.0,
+                 start_time: float = 0.0):
+        """
+        Constructor
+        :param environment: market environment keeping prices, ledger and state, its matching engine is not used
+        :param agents: agents trading in the market, including those driven by external strategies
+        :param period_length: simulated time between two published states
+        :param start_time: simulated time of the first wake-up of every agent
+        """
+        if period_length <= 0:
+            raise ValueError("period_length must be positive")
+        self.environment = environment
+        self.agents = agents
+        self.period_length = period_length
+        self.time = start_time
+        self.state = environment.state
+        self.book = PersistentOrderBook()
+        self.events = []  # entries (time, kind, sequence, payload)
+        self.sequence = 0
+        self.n_events = 0
+
+        environment.agents = agents
+        environment.register_agents()
+        environment.scheduler.set_population(agents)
+        self.slot_indices = np.full(len(environment.accounts), -1)  # ledger slot -> agent index
+        self.slot_indices[environment.agent_slots] = np.arange(len(agents))
+        self.submitted_quotes = np.full((len(agents), 4), np.nan)  # agent -> last buy/sell price and volume
+        self.resting_sequences = np.zeros((len(agents), 2), dtype=np.int64)  # agent -> resting buy/sell order
+        self.wakes_on_fill = np.array([agent.wake_up_on_fill for agent in agents], dtype=bool)
+        self.requote_pending = np.zeros(len(agents), dtype=bool)
+
+        self.period_orders = []
+        self.period_prices = []
+        self.period_volumes = []
+
+        # External strategies
+        self.strategies = []
+        self.n_waiting = 0
+        self.waiting = None  # future resolved when a strategy starts to wait for simulated time
+
+        for index, agent in enumerate(agents):
+            if agent.wake_up_interval is not None:
+                self.schedule(start_time, WAKE_UP, index)
+        self.schedule(start_time + period_length, PERIOD_END, None)
+
+    def schedule(self, time: float, kind: int, payload) -> NoReturn:
+        """
+        Adds an event to the queue
+
+        :param time: simulated time of the event
+        :param kind: PERIOD_END, ORDER_ARRIVAL, TIMER, WAKE_UP or REQUOTE
+        :param payload: data of the event
+        :return: NoReturn
+        """
+        self.sequence += 1
+        heapq.heappush(self.events, (time, kind, self.sequence, payload))
+
+    def submit(self, agent) -> NoReturn:
+        """
+        Sends the current orders of an agent to the book, where they arrive after the agent's latency
+
+        :param agent: agent of the simulation
+        :return: NoReturn
+        """
+        index = self.slot_indices[agent.ledger_slot]
+        self.schedule(self.time + agent.latency, ORDER_ARRIVAL,
+                      (index, agent.buy_record.values(), agent.sell_record.values()))
+
+    def process_next_event(self) -> int:
+        """
+        Removes the earliest event from the queue and processes it
+
+        :return: kind of the event
+        """
+        time, kind, _, payload = heapq.heappop(self.events)
+        self.time = time
+        self.n_events += 1
+        if kind == PERIOD_END:
+            self.close_period()
+        elif kind == ORDER_ARRIVAL:
+            self.arrive(*payload)
+        elif kind == TIMER:
+            self.n_waiting -= 1
+            if not payload.cancelled():
+                payload.set_result(self.state)
+        elif kind == WAKE_UP:
+            self.wake_up(payload)
+        else:
+            self.requote(payload)
+        return kind
+
+    def wake_up(self, index: int) -> NoReturn:
+        """
+        Lets an agent update from the last published state, submit its orders and schedule its next wake-up
+
+        :param index: index of the agent
+        :return: NoReturn
+        """
+        agent = self.agents[index]
+        self.draw_latency(agent)
+        agent.wake_up(self.state)
+        self.submit(agent)
+        next_wake_up = agent.next_wake_up(self.time)
+        if next_wake_up is not None:
+            if not next_wake_up > self.time:
+                raise ValueError(f"Agent {agent.agent_id} scheduled its next wake-up at {next_wake_up}, "
+                                 f"which is not after the current time {self.time}")
+            self.schedule(next_wake_up, WAKE_UP, index)
+
+    def requote(self, index: int) -> NoReturn:
+        """
+        Lets an agent whose orders were filled update from the last published state and submit its orders
+
+        :param index: index of the agent
+        :return: NoReturn
+        """
+        self.requote_pending[index] = False
+        agent = self.agents[index]
+        self.draw_latency(agent)
+        agent.update(self.state)
+        self.submit(agent)
+
+    def draw_latency(self, agent) -> NoReturn:
+        """
+        Draws the latency of an agent about to update, if the environment draws the latencies instead of the agents
+        """
+        scheduler = self.environment.scheduler
+        if scheduler.draw_latencies:
+            scheduler.draw_agent(agent)
+
+    def schedule_requotes(self, indices: ndarray) -> NoReturn:
+        """
+        Schedules a requote at the current time for the agents among the filled ones which wake up on fills and have
+        none pending
+
+        :param indices: indices of the filled agents
+        :return: NoReturn
+        """
+        for index in np.unique(indices[self.wakes_on_fill[indices]]):
+            if not self.requote_pending[index]:
+                self.requote_pending[index] = True
+                self.schedule(self.time, REQUOTE, index)
+
+    def arrive(self, index: int, buy_order: tuple, sell_order: tuple) -> NoReturn:
+        """
+        Replaces the resting orders of an agent with the arriving ones, matching them against the book
+
+        :param index: index of the agent
+        :param buy_order: (price, volume, latency, agent_id) of the buy order
+        :param sell_order: (price, volume, latency, agent_id) of the sell order
+        :return: NoReturn
+        """
+        environment = self.environment
+        self.period_orders.append((buy_order, sell_order))
+        expiry = self.time + environment.order_ttl * self.period_length if environment.order_ttl is not None else np.inf
+
+        for side, (price, volume, _, _) in enumerate((buy_order, sell_order)):
+            previous_price, previous_volume = self.submitted_quotes[index, 2 * side:2 * side + 2]
+            if ((price == previous_price or (np.isnan(price) and np.isnan(previous_price)))
+                    and volume == previous_volume):
+                continue
+            self.submitted_quotes[index, 2 * side:2 * side + 2] = price, volume
+            is_buy = side == 0
+            self.book.cancel_order(self.resting_sequences[index, side])
+            self.resting_sequences[index, side] = 0
+            if not volume > 0 or np.isnan(price):
+                continue
+            if environment.price_ladder is not None:
+                ticks = environment.price_ladder.buy_ticks if is_buy else environment.price_ladder.sell_ticks
+                price = ticks(np.array([price]))[0] * environment.tick_size
+
+            prices, volumes, counterparty_slots = self.book.match_order(is_buy, price, volume, self.time)
+            if len(prices) > 0:
+                counterparties = self.slot_indices[counterparty_slots]
+                incoming = np.full(len(prices), index)
+                environment.settle_trades(np.array(prices), np.array(volumes),
+                                          incoming if is_buy else counterparties,
+                                          counterparties if is_buy else incoming,
+                                          np.full(len(prices), is_buy))
+                self.period_prices.extend(prices)
+                self.period_volumes.extend(volumes)
+                volume -= sum(volumes)
+                self.schedule_requotes(np.append(counterparties, index))
+            if volume > 0:
+                self.resting_sequences[index, side] = self.book.add_order(is_buy, price, volume, self.time,
+                                                                          environment.agent_slots[index], expiry)
+
+    def close_period(self) -> NoReturn:
+        """
+        Publishes the state of the period which ends now and schedules the end of the next period
+        """
+        environment = self.environment
+        orders = np.array(self.period_orders, dtype=float).reshape(-1, 2, 4)
+        environment.buy_orders, environment.sell_orders = orders[:, 0], orders[:, 1]
+        environment.calc_order_metrics()
+        if environment.price_ladder is not None:
+            environment.price_ladder.update(*self.book.resting_orders(self.time))
+        environment.update_prices(np.array(self.period_prices, dtype=float),
+                                  np.array(self.period_volumes, dtype=float))
+        environment.update_market()
+        environment.time += 1
+        self.state = environment.state
+
+        self.period_orders = []
+        self.period_prices = []
+        self.period_volumes = []
+        self.schedule(self.time + self.period_length, PERIOD_END, None)
+
+    def run(self, until: float) -> dict:
+        """
+        Processes all events up to and including a simulated time
+
+        :param until: simulated time to run to
+        :return: last published state
+        """
+        while self.events and self.events[0][0] <= until:
+            self.process_next_event()
+        return self.state
+
+    def sleep_until(self, time: float) -> asyncio.Future:
+        """
+        Returns a future resolved with the last published state once the simulation reaches a time. External
+        strategies await it to wait for simulated time to pass.
+
+        :param time: simulated time to wake up at, times in the past wake up at the current time
+        :return: future of the market state
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.schedule(max(time, self.time), TIMER, future)
+        self.n_waiting += 1
+        if self.waiting is not None and not self.waiting.done():
+            self.waiting.set_result(None)
+        return future
+
+    def add_strategy(self, strategy) -> NoReturn:
+        """
+        Adds an external strategy, a coroutine which trades through an agent of the simulation by setting its
+        orders, calling submit and awaiting sleep_until. It starts with the next call of run_async.
+
+        :param strategy: coroutine
+        :return: NoReturn
+        """
+        self.strategies.append(strategy)
+
+    async def wait_for_strategies(self) -> NoReturn:
+        """
+        Waits until every running strategy waits for simulated time, waking up whenever a strategy finishes or
+        starts to wait
+        """
+        for index, strategy in enumerate(self.strategies):
+            if asyncio.iscoroutine(strategy):
+                self.strategies[index] = asyncio.ensure_future(strategy)
+        await asyncio.sleep(0)
+        while True:
+            running = [task for task in self.strategies if not task.done()]
+            if self.n_waiting >= len(running):
+                break
+            self.waiting = asyncio.get_running_loop().create_future()
+            await asyncio.wait(running + [self.waiting], return_when=asyncio.FIRST_COMPLETED)
+        self.waiting = None
+        for task in self.strategies:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    async def run_async(self, until: float) -> dict:
+        """
+        Processes all events up to and including a simulated time, letting the external strategies act whenever
+        they are woken. Simulated time only advances once every strategy waits for it again.
+
+        :param until: simulated time to run to
+        :return: last published state
+        """
+        await self.wait_for_strategies()
+        while self.events and self.events[0][0] <= until:
+            if self.process_next_event() == TIMER:
+                await self.wait_for_strategies()
+        return self.state
@@ -0,0 +1,117 @@
+from typing import NoReturn
+import numpy as np
+from market_simulation_study.market_state import RingBuffer
+
+
+class IndicatorEngine:
+    """
+    Rolling means and standard deviations of the market price history for any window, shared by all agents.
+
+    A window is registered the first time an agent asks for it, and from then on its mean and variance are
+    updated in O(1) per step with Welford's method, adding the new price and removing the one leaving the window.
+    All windows are updated with one vectorized pass, so the cost of a step grows with the number of distinct
+    windows instead of agents times window lengths. Like slicing the history, a window longer than the history
+    covers the whole history. The statistics are recomputed from the history every refresh_interval steps to
+    keep rounding errors from accumulating.
+    """
+
+    def __init__(self, prices: RingBuffer, refresh_interval: int = 1000):
+        """
+        Constructor
+        :param prices: market price history of the environment, appended to through append
+        :param refresh_interval: number of steps after which the statistics are recomputed from the history
+        """
+        self.prices = prices
+        self.refresh_interval = refresh_interval
+        self.window_index = {}  # window -> position in the arrays
+        self.windows = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.means = np.zeros(0)
+        self.m2s = np.zeros(0)  # sums of squared deviations from the mean
+        self.n_appends = 0
+
+    def register(self, window: int) -> int:
+        """
+        Starts tracking a window, computing its statistics from the history
+
+        :param window: number of most recent prices
+        :return: position of the window in the arrays
+        """
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        index = len(self.windows)
+        self.window_index[window] = index
+        values = self.prices[-window:]
+        self.windows = np.append(self.windows, window)
+        self.counts = np.append(self.counts, len(values))
+        mean = np.mean(values) if len(values) > 0 else 0.0
+        self.means = np.append(self.means, mean)
+        self.m2s = np.append(self.m2s, np.sum((values - mean) ** 2))
+        return index
+
+    def refresh(self) -> NoReturn:
+        """
+        Recomputes the statistics of all windows from the history
+        """
+        for window, index in self.window_index.items():
+            values = self.prices[-window:]
+            self.counts[index] = len(values)
+            self.means[index] = np.mean(values)
+            self.m2s[index] = np.sum((values - self.means[index]) ** 2)
+
+    def append(self, price: float) -> NoReturn:
+        """
+        Appends a new price to the history and updates all windows
+
+        :param price: new market price
+        :return: NoReturn
+        """
+        history = self.prices.view()
+        n_prices = len(history)
+        if len(self.windows) > 0:
+            # Remove the prices leaving full windows, including the oldest price if a bounded history drops it
+            full = (self.counts == self.windows) | (n_prices == self.prices.capacity)
+            full &= self.counts > 0
+            if full.any():
+                dropped = history[n_prices - self.counts[full]]
+                counts = self.counts[full] - 1
+                means = self.means[full]
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    new_means = np.where(counts > 0, (means * (counts + 1) - dropped) / counts, 0.0)
+                self.m2s[full] = np.where(counts > 0, self.m2s[full] - (dropped - means) * (dropped - new_means), 0.0)
+                self.means[full] = new_means
+                self.counts[full] = counts
+
+            self.counts += 1
+            deltas = price - self.means
+            self.means += deltas / self.counts
+            self.m2s = np.maximum(self.m2s + deltas * (price - self.means), 0.0)
+
+        self.prices.append(price)
+        self.n_appends += 1
+        if self.n_appends % self.refresh_interval == 0:
+            self.refresh()
+
+    def mean(self, window: int) -> float:
+        """
+        Mean of the last window prices
+
+        :param window: number of most recent prices
+        :return: mean
+        """
+        index = self.window_index.get(window)
+        if index is None:
+            index = self.register(window)
+        return self.means[index] if self.counts[index] > 0 else np.nan
+
+    def std(self, window: int) -> float:
+        """
+        Standard deviation of the last window prices, like np.std
+
+        :param window: number of most recent prices
+        :return: standard deviation
+        """
+        index = self.window_index.get(window)
+        if index is None:
+            index = self.register(window)
+        return np.sqrt(self.m2s[index] / self.counts[index])
@@ -0,0 +1,199 @@
+from typing import NoReturn
+import numpy as np
+from numpy import ndarray
+
+
+class GrowableArray:
+    """
+    One dimensional numpy array with amortized O(1) appends. A deep copy shares the array copy-on-write, so
+    snapshots of a simulation do not copy its ledger.
+    """
+    shared = False
+
+    def __init__(self, dtype=np.float64, capacity: int = 16):
+        """
+        Constructor
+        :param dtype: dtype of the elements
+        :param capacity: initial number of elements which fit without reallocating
+        """
+        self.values = np.zeros(capacity, dtype=dtype)
+        self.n = 0
+
+    def __len__(self) -> int:
+        return self.n
+
+    def append(self, values) -> NoReturn:
+        """
+        Appends one or more values
+
+        :param values: scalar or array of values
+        :return: NoReturn
+        """
+        values = np.atleast_1d(values)
+        n_new = self.n + len(values)
+        if self.shared and n_new <= len(self.values):
+            self.values = self.values.copy()
+            self.shared = False
+        if n_new > len(self.values):
+            grown = np.zeros(max(n_new, 2 * len(self.values)), dtype=self.values.dtype)
+            grown[:self.n] = self.values[:self.n]
+            self.values = grown
+            self.shared = False
+        self.values[self.n:n_new] = values
+        self.n = n_new
+
+    def view(self) -> ndarray:
+        """
+        Returns the filled part of the array without copying
+        """
+        return self.values[:self.n]
+
+    def mutable_view(self) -> ndarray:
+        """
+        Returns the filled part of the array for writing in place, copying it first if it is shared with a copy
+        """
+        if self.shared:
+            self.values = self.values.copy()
+            self.shared = False
+        return self.values[:self.n]
+
+    def __getstate__(self) -> dict:
+        """
+        State for pickling, without the unused capacity of the array
+        """
+        state = self.__dict__.copy()
+        state['values'] = self.values[:self.n]
+        state['shared'] = False
+        return state
+
+    def __deepcopy__(self, memo: dict) -> "GrowableArray":
+        """
+        Copies the array without copying its values, which both arrays copy before they are next written to
+        """
+        copy = object.__new__(type(self))
+        copy.__dict__.update(self.__dict__)
+        self.shared = copy.shared = True
+        memo[id(self)] = copy
+        return copy
+
+
+class FillLedger:
+    """
+    Append-only ledger of all fills in a market environment.
+
+    Fills are stored in typed columns (step, price, volume, buyer slot, seller slot, aggressor side). Every agent
+    is given a slot, and each slot keeps the ledger rows it took part in, so an agent's trade history can be
+    derived without scanning the whole ledger. Cash and position of every slot are updated with each fill, so the
+    accounts of the whole population are available as arrays indexed by slot.
+    """
+
+    def __init__(self):
+        self.step = GrowableArray(np.int64)
+        self.price = GrowableArray(np.float64)
+        self.volume = GrowableArray(np.float64)
+        self.buyer = GrowableArray(np.int64)
+        self.seller = GrowableArray(np.int64)
+        self.buyer_is_aggressor = GrowableArray(np.bool_)
+        self.slots = {}  # agent id -> slot
+        self.agent_ids = []  # slot -> agent id
+        self.slot_rows = []  # slot -> ledger rows the agent took part in
+        self.slot_signs = []  # slot -> -1 where the agent bought and 1 where it sold
+        self.cash = GrowableArray(np.float64)  # slot -> sum of price times signed volume
+        self.positions = GrowableArray(np.float64)  # slot -> position
+
+    def __len__(self) -> int:
+        return len(self.price)
+
+    def open_account(self, agent_id, cash: float = 0.0, position: float = 0.0) -> int:
+        """
+        Opens a new slot without fills for an agent and points the agent id at it
+
+        :param agent_id: id of the agent
+        :param cash: cash flow of the agent's trades before joining the ledger
+        :param position: position of the agent when joining the ledger
+        :return: slot
+        """
+        slot = len(self.agent_ids)
+        self.slots[agent_id] = slot
+        self.agent_ids.append(agent_id)
+        self.slot_rows.append(GrowableArray(np.int64))
+        self.slot_signs.append(GrowableArray(np.int8))
+        self.cash.append(cash)
+        self.positions.append(position)
+        return slot
+
+    def record(self, step: int, prices: ndarray, volumes: ndarray, buyers: ndarray, sellers: ndarray,
+               buyer_is_aggressor: ndarray) -> NoReturn:
+        """
+        Appends a sequence of fills to the ledger
+
+        :param step: step of the market environment
+        :param prices: fill prices
+        :param volumes: fill volumes
+        :param buyers: slots of the buyers
+        :param sellers: slots of the sellers
+        :param buyer_is_aggressor: True where the incoming order was the buy order
+        :return: NoReturn
+        """
+        prices = np.atleast_1d(prices)
+        volumes = np.atleast_1d(volumes)
+        buyers = np.atleast_1d(buyers)
+        sellers = np.atleast_1d(sellers)
+        buyer_is_aggressor = np.atleast_1d(buyer_is_aggressor)
+        rows = np.arange(len(self), len(self) + len(prices))
+
+        self.step.append(np.full(len(prices), step))
+        self.price.append(prices)
+        self.volume.append(volumes)
+        self.buyer.append(buyers)
+        self.seller.append(sellers)
+        self.buyer_is_aggressor.append(buyer_is_aggressor)
+
+        values = prices * volumes
+        np.add.at(self.cash.mutable_view(), buyers, -values)
+        np.add.at(self.cash.mutable_view(), sellers, values)
+        np.add.at(self.positions.mutable_view(), buyers, volumes)
+        np.add.at(self.positions.mutable_view(), sellers, -volumes)
+
+        # The aggressor is listed first, which orders the two rows of a self trade
+        first = np.where(buyer_is_aggressor, buyers, sellers)
+        second = np.where(buyer_is_aggressor, sellers, buyers)
+        first_signs = np.where(buyer_is_aggressor, -1, 1)
+        slots = np.column_stack((first, second)).ravel()
+        signs = np.column_stack((first_signs, -first_signs)).ravel()
+        rows = np.repeat(rows, 2)
+
+        order = np.argsort(slots, kind="stable")
+        slots, rows, signs = slots[order], rows[order], signs[order]
+        unique_slots, starts = np.unique(slots, return_index=True)
+        for slot, slot_rows, slot_signs in zip(unique_slots, np.split(rows, starts[1:]), np.split(signs, starts[1:])):
+            self.slot_rows[slot].append(slot_rows)
+            self.slot_signs[slot].append(slot_signs)
+
+    def agent_trades(self, slot: int, prior_trades: ndarray = None) -> ndarray:
+        """
+        Derives the trade history of an agent as rows of (price, -volume) for buys and (price, volume) for sells
+
+        :param slot: slot of the agent
+        :param prior_trades: trades the agent made before joining the ledger
+        :return: trade history
+        """
+        rows = self.slot_rows[slot].view()
+        if prior_trades is not None and len(rows) == 0:
+            return prior_trades
+        n_prior = 0 if prior_trades is None else len(prior_trades)
+        trades = np.empty((n_prior + len(rows), 2))
+        if n_prior > 0:
+            trades[:n_prior] = prior_trades
+        trades[n_prior:, 0] = self.price.view()[rows]
+        trades[n_prior:, 1] = self.slot_signs[slot].view() * self.volume.view()[rows]
+        return trades
+
+    def realized_value(self, slot: int) -> float:
+        """
+        Returns the cash flow of an agent's trades, including those made before joining the ledger
+
+        :param slot: slot of the agent
+        :return: sum of price times signed volume
+        """
+        return self.cash.view()[slot]
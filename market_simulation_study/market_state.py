@@ -0,0 +1,169 @@
+from collections.abc import MutableMapping
+from typing import Callable, NoReturn
+import numpy as np
+from numpy import ndarray
+
+
+class RingBuffer:
+    """
+    Price or volume history stored in a numpy array.
+
+    Values are only ever written past the newest value, so indexing and slicing behave like a list and return
+    read-only views, never copies, which later appends do not change. With a capacity, only the last capacity values
+    are kept: once the buffer of twice the capacity is full, the kept values move to a new buffer, leaving the old one
+    to the views still holding it. Without a capacity the buffer grows by doubling and keeps the full history.
+    Values can be arrays of a fixed shape, e.g. one price per market, in which case time is the first axis.
+    A deep copy shares the buffer copy-on-write, so snapshots of a simulation do not copy its history.
+    """
+    shared = False
+
+    def __init__(self, values=(), capacity: int = None, shape: tuple = ()):
+        """
+        Constructor
+        :param values: initial values, of which the last capacity are kept
+        :param capacity: maximum number of values kept, None to keep all of them
+        :param shape: shape of each value
+        """
+        if capacity is not None and capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        values = np.asarray(values, dtype=float).reshape((-1,) + tuple(shape))
+        self.capacity = capacity
+        self.shape = tuple(shape)
+        if capacity is not None:
+            values = values[len(values) - min(len(values), capacity):]
+        n_rows = 2 * capacity if capacity is not None else max(16, 2 * len(values))
+        self.buffer = np.zeros((n_rows,) + self.shape)
+        self.buffer[:len(values)] = values
+        self.n = self.end = len(values)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __array__(self, dtype=None) -> ndarray:
+        return self.view() if dtype is None else self.view().astype(dtype)
+
+    def __repr__(self) -> str:
+        return f"RingBuffer({self.view().tolist()}, capacity={self.capacity}, shape={self.shape})"
+
+    def append(self, value: float) -> NoReturn:
+        """
+        Appends a value, dropping the oldest value if the buffer is full
+
+        :param value: value to append
+        :return: NoReturn
+        """
+        if self.shared:
+            self.buffer = self.buffer.copy()
+            self.shared = False
+        if self.end == len(self.buffer):
+            if self.capacity is None:
+                self.buffer = np.concatenate((self.buffer, np.zeros_like(self.buffer)))
+            else:
+                kept = self.capacity - 1
+                buffer = np.zeros_like(self.buffer)
+                buffer[:kept] = self.buffer[self.end - kept:self.end]
+                self.buffer, self.end = buffer, kept
+        self.buffer[self.end] = value
+        self.end += 1
+        self.n = self.n + 1 if self.capacity is None else min(self.n + 1, self.capacity)
+
+    def view(self) -> ndarray:
+        """
+        Returns the kept values, oldest first, as a read-only view of the buffer
+        """
+        view = self.buffer[self.end - self.n:self.end]
+        view.flags.writeable = False
+        return view
+
+    def copy(self) -> "RingBuffer":
+        return RingBuffer(self.view(), self.capacity, self.shape)
+
+    def __getstate__(self) -> dict:
+        """
+        State for pickling, without the unused rows of a buffer keeping the full history
+        """
+        state = self.__dict__.copy()
+        if self.capacity is None:
+            state['buffer'] = self.buffer[:max(self.end, 16)]
+        state['shared'] = False
+        return state
+
+    def __deepcopy__(self, memo: dict) -> "RingBuffer":
+        """
+        Copies the buffer without copying its values, which both buffers copy before their next append
+        """
+        copy = object.__new__(type(self))
+        copy.__dict__.update(self.__dict__)
+        self.shared = copy.shared = True
+        memo[id(self)] = copy
+        return copy
+
+    def tolist(self) -> list:
+        return self.view().tolist()
+
+
+class MarketState(MutableMapping):
+    """
+    Market state handed to the agents after each step.
+
+    Behaves like the state dict, but values can also be given as callables which are evaluated the first time the
+    key is read, so fields no agent reads are never built.
+    """
+
+    def __init__(self, values: dict = None, lazy_values: dict = None):
+        """
+        Constructor
+        :param values: state values
+        :param lazy_values: functions returning a dict of state values, keyed by the state keys they provide
+        """
+        self.values = {} if values is None else values
+        self.lazy_values = {} if lazy_values is None else lazy_values
+
+    def materialize(self, key) -> NoReturn:
+        """
+        Evaluates the function providing a lazy key and stores every value it returns
+
+        :param key: state key
+        :return: NoReturn
+        """
+        function: Callable[[], dict] = self.lazy_values[key]
+        values = function()
+        for lazy_key in values:
+            self.lazy_values.pop(lazy_key, None)
+        self.values.update(values)
+
+    def __getitem__(self, key):
+        if key not in self.values and key in self.lazy_values:
+            self.materialize(key)
+        return self.values[key]
+
+    def __setitem__(self, key, value) -> NoReturn:
+        self.lazy_values.pop(key, None)
+        self.values[key] = value
+
+    def __delitem__(self, key) -> NoReturn:
+        if key in self.lazy_values:
+            self.materialize(key)
+        del self.values[key]
+
+    def __iter__(self):
+        yield from self.values
+        yield from [key for key in self.lazy_values if key not in self.values]
+
+    def __len__(self) -> int:
+        return len(self.values) + sum(key not in self.values for key in self.lazy_values)
+
+    def __contains__(self, key) -> bool:
+        return key in self.values or key in self.lazy_values
+
+    def __repr__(self) -> str:
+        return f"MarketState({dict(self)})"
+
+    def copy(self) -> dict:
+        return dict(self)
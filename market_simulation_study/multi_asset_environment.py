@@ -0,0 +1,83 @@
+from typing import NoReturn
+import numpy as np
+from numpy import ndarray
+from market_simulation_study.vectorized_environment import VectorizedMarketEnvironment
+
+
+class MultiAssetMarketEnvironment(VectorizedMarketEnvironment):
+    """
+    Market with several instruments, each with its own order book, traded by the same agents.
+
+    Every agent submits a vector of orders across the instruments each step, from the price histories of all
+    instruments and its positions in all of them, so quotes can depend on cross-asset state, like the inventory of a
+    CrossAssetMarketMakerPopulation. Agents are given as populations like in VectorizedMarketEnvironment, with the
+    instruments in place of the independent markets: the books of all instruments are matched together with one
+    vectorized operation along the asset axis per queue position, so a step costs about as much Python work as a
+    single instrument. Positions, cash and profit and loss are kept as arrays of shape (assets, agents).
+
+    An agent has one latency for all instruments, drawn once per step and broadcast across the assets, so its orders
+    reach every book at the same time. A market maker keeping its quotes in all instruments also keeps its latency.
+    """
+
+    def __init__(self,
+                 state: dict,
+                 populations: list,
+                 asset_names: list,
+                 use_last_traded_price: bool = True,
+                 history_capacity: int = None,
+                 zero_volume_fills: bool = True,
+                 matching_engine: str = None):
+        """
+        Constructor
+        :param state: initial market state, whose market price history is given per instrument with shape
+        (time, assets), or with shape (time,) to start all instruments from the same history
+        :param populations: agent populations, each quoting every instrument
+        :param asset_names: names of the instruments
+        :param use_last_traded_price: if True the market price is the last traded price, else the volume weighted median
+        :param history_capacity: number of market prices and traded volumes kept, None to keep the full history
+        :param zero_volume_fills: if True matching follows the original order book, see VectorizedMarketEnvironment
+        :param matching_engine: "batch" or "sequential", see VectorizedMarketEnvironment
+        """
+        self.asset_names = list(asset_names)
+        self.asset_index = {name: index for index, name in enumerate(self.asset_names)}
+        initial_prices = np.asarray(state["market_prices"], dtype=float)
+        if initial_prices.ndim == 2 and initial_prices.shape[1] != len(self.asset_names):
+            raise ValueError(f"market_prices of shape {initial_prices.shape} do not match "
+                             f"{len(self.asset_names)} instruments")
+        for population in populations:
+            population.shared_latency = True
+        super().__init__(state, populations, len(self.asset_names), use_last_traded_price, history_capacity,
+                         zero_volume_fills, matching_engine)
+
+    @property
+    def n_assets(self) -> int:
+        return self.n_markets
+
+    def update_market(self) -> NoReturn:
+        super().update_market()
+        self.state['asset_names'] = self.asset_names
+
+    def get_asset_state(self, asset) -> dict:
+        """
+        Extracts the state of one instrument in the format of MarketEnvironment
+
+        :param asset: name or index of the instrument
+        :return: market state
+        """
+        return self.get_market_state(self.asset_index.get(asset, asset))
+
+    def exposures(self) -> ndarray:
+        """
+        Values the positions of all agents at the last market price of every instrument
+
+        :return: exposures of shape (assets, agents)
+        """
+        return self.positions * self.market_prices[-1][:, None]
+
+    def portfolio_profit_and_loss(self) -> ndarray:
+        """
+        Profit and loss of every agent over all instruments, summing calculate_profit_and_loss over the assets
+
+        :return: profit and loss of shape (agents,)
+        """
+        return self.calculate_profit_and_loss().sum(axis=0)
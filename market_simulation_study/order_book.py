@@ -0,0 +1,557 @@
+from typing import NoReturn, Tuple
+import heapq
+import numpy as np
+from numpy import ndarray
+
+ORDER_DTYPE = np.dtype([("price", np.float64),
+                        ("volume", np.float64),
+                        ("latency", np.float64),
+                        ("agent_index", np.int64)])
+
+
+class ArrayOrderBook:
+    """
+    Order book holding resting buy and sell orders in preallocated numpy structured arrays.
+
+    Incoming orders are matched with a vectorized crossing mask and price/latency priority is found with
+    np.lexsort. Orders which are completely filled are retired by setting their price to nan, so they never
+    cross again, instead of being removed from the arrays.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """
+        Constructor
+        :param capacity: initial number of orders which can rest on each side of the book
+        """
+        self.capacity = capacity
+        self.buy_orders = np.zeros(capacity, dtype=ORDER_DTYPE)
+        self.sell_orders = np.zeros(capacity, dtype=ORDER_DTYPE)
+        self.n_buy_orders = 0
+        self.n_sell_orders = 0
+
+    def reset(self, capacity: int = None) -> NoReturn:
+        """
+        Empties both sides of the book and grows the preallocated arrays if needed
+
+        :param capacity: number of orders which must fit on each side of the book
+        :return: NoReturn
+        """
+        if capacity is not None and capacity > self.capacity:
+            self.capacity = capacity
+            self.buy_orders = np.zeros(capacity, dtype=ORDER_DTYPE)
+            self.sell_orders = np.zeros(capacity, dtype=ORDER_DTYPE)
+        self.n_buy_orders = 0
+        self.n_sell_orders = 0
+
+    def grow(self) -> NoReturn:
+        """
+        Doubles the capacity of both sides of the book
+        """
+        self.capacity *= 2
+        buy_orders = np.zeros(self.capacity, dtype=ORDER_DTYPE)
+        sell_orders = np.zeros(self.capacity, dtype=ORDER_DTYPE)
+        buy_orders[:self.n_buy_orders] = self.buy_orders[:self.n_buy_orders]
+        sell_orders[:self.n_sell_orders] = self.sell_orders[:self.n_sell_orders]
+        self.buy_orders = buy_orders
+        self.sell_orders = sell_orders
+
+    def add_buy_order(self, price: float, volume: float, latency: float, agent_index: int) -> NoReturn:
+        """
+        Places a buy order in the book
+
+        :param price: buy price
+        :param volume: buy volume
+        :param latency: latency of the order, used as secondary priority
+        :param agent_index: index of the submitting agent
+        :return: NoReturn
+        """
+        if self.n_buy_orders == self.capacity:
+            self.grow()
+        self.buy_orders[self.n_buy_orders] = (price, volume, latency, agent_index)
+        self.n_buy_orders += 1
+
+    def add_sell_order(self, price: float, volume: float, latency: float, agent_index: int) -> NoReturn:
+        """
+        Places a sell order in the book
+
+        :param price: sell price
+        :param volume: sell volume
+        :param latency: latency of the order, used as secondary priority
+        :param agent_index: index of the submitting agent
+        :return: NoReturn
+        """
+        if self.n_sell_orders == self.capacity:
+            self.grow()
+        self.sell_orders[self.n_sell_orders] = (price, volume, latency, agent_index)
+        self.n_sell_orders += 1
+
+    def match_buy_order(self, price: float, volume: float) -> Tuple[ndarray, ndarray, ndarray]:
+        """
+        Matches an incoming buy order against the resting sell orders, lowest price and latency first
+
+        :param price: buy price
+        :param volume: buy volume
+        :return: trade prices, trade volumes and agent indices of the resting sellers
+        """
+        sell_orders = self.sell_orders[:self.n_sell_orders]
+        sell_prices = sell_orders["price"]
+        crossing = sell_prices <= price
+        return self.fill(sell_orders, crossing, sell_prices, volume)
+
+    def match_sell_order(self, price: float, volume: float) -> Tuple[ndarray, ndarray, ndarray]:
+        """
+        Matches an incoming sell order against the resting buy orders, highest price and lowest latency first
+
+        :param price: sell price
+        :param volume: sell volume
+        :return: trade prices, trade volumes and agent indices of the resting buyers
+        """
+        buy_orders = self.buy_orders[:self.n_buy_orders]
+        buy_prices = buy_orders["price"]
+        crossing = buy_prices >= price
+        return self.fill(buy_orders, crossing, -buy_prices, volume)
+
+    @staticmethod
+    def fill(orders: ndarray, crossing: ndarray, priority: ndarray, volume: float) -> Tuple[ndarray, ndarray, ndarray]:
+        """
+        Fills an incoming volume against the crossing resting orders in (priority, latency) order.
+
+        Every crossing order produces a fill, also after the incoming volume is exhausted, in which case the
+        trade volume is zero. This is the behaviour of the original DataFrame matching loop.
+
+        :param orders: resting orders of one side of the book
+        :param crossing: mask of resting orders whose price crosses the incoming price
+        :param priority: primary sort key, ascending
+        :param volume: incoming volume
+        :return: trade prices, trade volumes and agent indices of the resting orders
+        """
+        index = np.flatnonzero(crossing)
+        if len(index) > 1:
+            index = index[np.lexsort((orders["latency"][index], priority[index]))]
+        resting_volumes = orders["volume"][index]
+        unfilled_volumes = volume - (np.cumsum(resting_volumes) - resting_volumes)
+        trade_volumes = np.minimum(resting_volumes, np.maximum(unfilled_volumes, 0))
+        orders["volume"][index] = resting_volumes - trade_volumes
+
+        return orders["price"][index], trade_volumes, orders["agent_index"][index]
+
+    def prune_buy_orders(self) -> NoReturn:
+        """
+        Retires buy orders without positive volume
+        """
+        buy_orders = self.buy_orders[:self.n_buy_orders]
+        buy_orders["price"][~(buy_orders["volume"] > 0)] = np.nan
+
+    def prune_sell_orders(self) -> NoReturn:
+        """
+        Retires sell orders without positive volume
+        """
+        sell_orders = self.sell_orders[:self.n_sell_orders]
+        sell_orders["price"][~(sell_orders["volume"] > 0)] = np.nan
+
+
+class BatchBookSide:
+    """
+    One side of the order books of a batch of independent markets, as arrays of shape (markets, capacity).
+
+    Every call handles one incoming order per market, so a batch of markets advances through its matching queue
+    with one vectorized operation per queue position. Matching follows ArrayOrderBook: crossing resting orders are
+    filled in (price, latency) order at their own price, also with zero volume once the incoming volume is
+    exhausted, and orders without volume are retired by setting their price to nan.
+    """
+
+    def __init__(self, is_buy: bool):
+        """
+        Constructor
+        :param is_buy: True for the buy side
+        """
+        self.is_buy = is_buy
+        self.prices = np.zeros((0, 0))
+        self.volumes = np.zeros((0, 0))
+        self.latencies = np.zeros((0, 0))
+        self.agents = np.zeros((0, 0), dtype=np.int64)
+        self.n_orders = np.zeros(0, dtype=np.int64)
+        self.markets = np.zeros(0, dtype=np.int64)
+
+    def reset(self, n_markets: int, capacity: int) -> NoReturn:
+        """
+        Empties the side in every market
+
+        :param n_markets: number of markets
+        :param capacity: number of orders which can rest in each market
+        :return: NoReturn
+        """
+        if self.prices.shape != (n_markets, capacity):
+            self.prices = np.empty((n_markets, capacity))
+            self.volumes = np.zeros((n_markets, capacity))
+            self.latencies = np.zeros((n_markets, capacity))
+            self.agents = np.zeros((n_markets, capacity), dtype=np.int64)
+            self.markets = np.arange(n_markets)
+        self.prices.fill(np.nan)
+        self.n_orders = np.zeros(n_markets, dtype=np.int64)
+
+    def add_orders(self, prices: ndarray, volumes: ndarray, latencies: ndarray, agents: ndarray,
+                   mask: ndarray) -> NoReturn:
+        """
+        Places one order in each market selected by mask
+
+        :param prices: order prices, one per market
+        :param volumes: order volumes, one per market
+        :param latencies: order latencies, one per market
+        :param agents: agent indices, one per market
+        :param mask: markets in which the order is placed
+        :return: NoReturn
+        """
+        markets = self.markets[mask]
+        slots = self.n_orders[mask]
+        self.prices[markets, slots] = prices[mask]
+        self.volumes[markets, slots] = volumes[mask]
+        self.latencies[markets, slots] = latencies[mask]
+        self.agents[markets, slots] = agents[mask]
+        self.n_orders[mask] += 1
+
+    def match_orders(self, prices: ndarray, volumes: ndarray) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        """
+        Matches one incoming order of the other side per market against the resting orders
+
+        :param prices: incoming prices, one per market, nan for no order
+        :param volumes: incoming volumes, one per market
+        :return: markets, prices, volumes and resting agent indices of the fills, ordered by market and priority
+        """
+        width = self.n_orders.max(initial=0)
+        resting_prices = self.prices[:, :width]
+        crossing = resting_prices >= prices[:, None] if self.is_buy else resting_prices <= prices[:, None]
+        n_crossing = crossing.sum(axis=1)
+        markets = np.flatnonzero(n_crossing)
+        if len(markets) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, np.zeros(0), np.zeros(0), empty
+
+        # Only markets with crossing orders are sorted, and only as far as their crossing orders reach
+        crossing, resting_prices = crossing[markets], resting_prices[markets]
+        priority = np.where(crossing, -resting_prices if self.is_buy else resting_prices, np.inf)
+        order = np.lexsort((self.latencies[markets, :width], priority), axis=-1)[:, :n_crossing.max()]
+        rows, market_rows = np.arange(len(markets))[:, None], markets[:, None]
+        crossing = crossing[rows, order]
+        resting_volumes = np.where(crossing, self.volumes[market_rows, order], 0)
+        unfilled_volumes = volumes[market_rows] - (np.cumsum(resting_volumes, axis=1) - resting_volumes)
+        trade_volumes = np.minimum(resting_volumes, np.maximum(unfilled_volumes, 0))
+        self.volumes[market_rows, order] -= trade_volumes
+
+        fill_rows, positions = np.nonzero(crossing)
+        orders = order[fill_rows, positions]
+        fill_markets = markets[fill_rows]
+        return (fill_markets, resting_prices[fill_rows, orders], trade_volumes[fill_rows, positions],
+                self.agents[fill_markets, orders])
+
+    def prune_orders(self, markets: ndarray = None) -> NoReturn:
+        """
+        Retires orders without positive volume
+
+        :param markets: markets to prune, None for all of them
+        :return: NoReturn
+        """
+        width = self.n_orders.max(initial=0)
+        if markets is None:
+            self.prices[:, :width][~(self.volumes[:, :width] > 0)] = np.nan
+        else:
+            prices = self.prices[markets, :width]
+            prices[~(self.volumes[markets, :width] > 0)] = np.nan
+            self.prices[markets, :width] = prices
+
+
+class PersistentOrderBook:
+    """
+    Good-till-cancelled order book where orders rest across steps until they are filled, cancelled or expire.
+
+    Each side is a heap keyed on (price priority, latency, sequence number), so inserting an order is O(log n).
+    Cancelled and expired orders are removed lazily when they reach the top of their heap. A side whose heap holds
+    more than compaction_factor entries per live order, plus compaction_minimum, is rebuilt from its live orders
+    when an order is cancelled, so the heaps stay proportional to the book when agents requote every step.
+    """
+    compaction_factor = 2
+    compaction_minimum = 64
+
+    def __init__(self):
+        self.buy_heap = []  # entries (-price, latency, sequence)
+        self.sell_heap = []  # entries (price, latency, sequence)
+        self.orders = {}  # sequence -> [is_buy, price, volume, latency, slot, expiry]
+        self.n_orders = [0, 0]  # number of sell and buy orders in orders
+        self.sequence = 0
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def add_order(self, is_buy: bool, price: float, volume: float, latency: float, slot: int,
+                  expiry: float = np.inf) -> int:
+        """
+        Places an order in the book
+
+        :param is_buy: True for a buy order
+        :param price: order price
+        :param volume: order volume
+        :param latency: latency of the order, used as secondary priority
+        :param slot: ledger slot of the submitting agent
+        :param expiry: first step at which the order is no longer valid
+        :return: sequence number identifying the order
+        """
+        self.sequence += 1
+        self.orders[self.sequence] = [is_buy, price, volume, latency, slot, expiry]
+        self.n_orders[is_buy] += 1
+        if is_buy:
+            heapq.heappush(self.buy_heap, (-price, latency, self.sequence))
+        else:
+            heapq.heappush(self.sell_heap, (price, latency, self.sequence))
+        return self.sequence
+
+    def cancel_order(self, sequence: int) -> NoReturn:
+        """
+        Cancels an order, doing nothing if it is already filled, cancelled or expired
+
+        :param sequence: sequence number of the order
+        :return: NoReturn
+        """
+        order = self.remove_order(sequence)
+        if order is not None:
+            is_buy = order[0]
+            heap = self.buy_heap if is_buy else self.sell_heap
+            if len(heap) > self.compaction_factor * self.n_orders[is_buy] + self.compaction_minimum:
+                self.compact(heap)
+
+    def remove_order(self, sequence: int) -> list:
+        """
+        Removes an order from the orders, leaving its heap entry to be discarded later
+
+        :param sequence: sequence number of the order
+        :return: the removed order, None if there is no such order
+        """
+        order = self.orders.pop(sequence, None)
+        if order is not None:
+            self.n_orders[order[0]] -= 1
+        return order
+
+    def compact(self, heap: list) -> NoReturn:
+        """
+        Rebuilds a heap from the entries of the orders still in the book
+        """
+        heap[:] = [entry for entry in heap if entry[2] in self.orders]
+        heapq.heapify(heap)
+
+    def top(self, heap: list, time: int, is_live) -> int:
+        """
+        Removes cancelled, expired and dead orders from the top of a heap and returns the best live order
+
+        :param heap: buy or sell heap
+        :param time: current step
+        :param is_live: function of a slot telling if its agent still trades in the market
+        :return: sequence number of the best order or None if the side is empty
+        """
+        while heap:
+            sequence = heap[0][2]
+            order = self.orders.get(sequence)
+            if order is not None and order[5] > time and is_live(order[4]):
+                return sequence
+            heapq.heappop(heap)
+            self.remove_order(sequence)
+        return None
+
+    def match_order(self, is_buy: bool, price: float, volume: float, time: int,
+                    is_live=lambda slot: True, zero_volume_fills: bool = False) -> Tuple[list, list, list]:
+        """
+        Matches an incoming order against the best resting orders of the other side until it stops crossing or
+        its volume is used up
+
+        :param is_buy: True for an incoming buy order
+        :param price: incoming price
+        :param volume: incoming volume
+        :param time: current step
+        :param is_live: function of a slot telling if its agent still trades in the market
+        :param zero_volume_fills: if True every crossing resting order is filled like in ArrayOrderBook, with zero
+        volume once the incoming volume is used up, and resting orders without volume are removed when filled
+        :return: trade prices, trade volumes and slots of the resting orders
+        """
+        heap = self.sell_heap if is_buy else self.buy_heap
+        trade_prices, trade_volumes, slots = [], [], []
+        passed = []  # crossing orders left with volume, put back once the incoming order stops crossing
+        while volume > 0 or zero_volume_fills:
+            sequence = self.top(heap, time, is_live)
+            if sequence is None:
+                break
+            order = self.orders[sequence]
+            if (is_buy and not order[1] <= price) or (not is_buy and not order[1] >= price):
+                break
+            trade_volume = min(volume, order[2])
+            volume -= trade_volume
+            order[2] -= trade_volume
+            trade_prices.append(order[1])
+            trade_volumes.append(trade_volume)
+            slots.append(order[4])
+            if order[2] <= 0:
+                heapq.heappop(heap)
+                self.remove_order(sequence)
+            elif zero_volume_fills:
+                passed.append(heapq.heappop(heap))
+        for entry in passed:
+            heapq.heappush(heap, entry)
+        return trade_prices, trade_volumes, slots
+
+    def resting_orders(self, time: int) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        """
+        Prices and volumes of all valid resting orders
+
+        :param time: current step
+        :return: buy prices, buy volumes, sell prices, sell volumes
+        """
+        orders = np.array([order[:3] for order in self.orders.values() if order[5] > time], dtype=float)
+        orders = orders.reshape(-1, 3)
+        is_buy = orders[:, 0] > 0
+        return orders[is_buy, 1], orders[is_buy, 2], orders[~is_buy, 1], orders[~is_buy, 2]
+
+
+class PriceLadder:
+    """
+    Resting volume per price level on an integer tick grid.
+
+    Bid and ask volumes are aggregated into arrays indexed by the distance in ticks from the best price of their
+    side, so the best prices are found once per update and depth queries are O(levels) slices of the ladder instead
+    of sorts of the order book. Each side keeps the levels from its best price to its n_levels-th occupied level, so
+    orders far from the best price, like stale quotes, do not widen the ladder. Depth queries cover these levels.
+    """
+
+    snapshot_keys = ("bid_prices", "bid_volumes", "ask_prices", "ask_volumes", "best_bid", "best_ask", "spread",
+                     "depth_imbalance")
+
+    def __init__(self, tick_size: float, n_levels: int = 5):
+        """
+        Constructor
+        :param tick_size: price difference between two levels
+        :param n_levels: number of levels on each side published in the depth snapshot
+        """
+        self.tick_size = tick_size
+        self.n_levels = n_levels
+        self.bid_levels = np.zeros(0)  # volume per tick below the best bid, best first
+        self.ask_levels = np.zeros(0)  # volume per tick above the best ask, best first
+        self.best_bid_tick = None
+        self.best_ask_tick = None
+
+    def buy_ticks(self, prices: ndarray) -> ndarray:
+        """
+        Quantizes buy prices down to the tick grid
+
+        :param prices: buy prices
+        :return: integer ticks
+        """
+        return np.floor(prices / self.tick_size + 1e-9)
+
+    def sell_ticks(self, prices: ndarray) -> ndarray:
+        """
+        Quantizes sell prices up to the tick grid
+
+        :param prices: sell prices
+        :return: integer ticks
+        """
+        return np.ceil(prices / self.tick_size - 1e-9)
+
+    def side_levels(self, distances: ndarray, volumes: ndarray) -> ndarray:
+        """
+        Aggregates the volumes of one side by distance from its best tick, up to its n_levels-th occupied level. The
+        ladder is binned over a window of ticks, which is widened only while it holds too few occupied levels.
+
+        :param distances: distance in ticks of each order from the best tick of its side
+        :param volumes: volume of each order
+        :return: volume per level, best first
+        """
+        width = 4 * self.n_levels
+        while True:
+            kept = distances < width
+            levels = np.bincount(distances[kept], weights=volumes[kept], minlength=width)
+            occupied = np.flatnonzero(levels)
+            if len(occupied) >= self.n_levels or kept.all():
+                break
+            width *= 4
+        return levels[:occupied[self.n_levels - 1] + 1] if len(occupied) >= self.n_levels else levels
+
+    def update(self, buy_prices: ndarray, buy_volumes: ndarray, sell_prices: ndarray,
+               sell_volumes: ndarray) -> NoReturn:
+        """
+        Rebuilds the ladder from resting orders with prices on the tick grid
+
+        :param buy_prices: buy prices
+        :param buy_volumes: buy volumes
+        :param sell_prices: sell prices
+        :param sell_volumes: sell volumes
+        :return: NoReturn
+        """
+        buy_volumes, sell_volumes = np.asarray(buy_volumes), np.asarray(sell_volumes)
+        buy_ticks = np.rint(np.asarray(buy_prices)[buy_volumes > 0] / self.tick_size).astype(np.int64)
+        sell_ticks = np.rint(np.asarray(sell_prices)[sell_volumes > 0] / self.tick_size).astype(np.int64)
+        if len(buy_ticks) > 0:
+            self.best_bid_tick = buy_ticks.max()
+            self.bid_levels = self.side_levels(self.best_bid_tick - buy_ticks, buy_volumes[buy_volumes > 0])
+        else:
+            self.best_bid_tick, self.bid_levels = None, np.zeros(0)
+        if len(sell_ticks) > 0:
+            self.best_ask_tick = sell_ticks.min()
+            self.ask_levels = self.side_levels(sell_ticks - self.best_ask_tick, sell_volumes[sell_volumes > 0])
+        else:
+            self.best_ask_tick, self.ask_levels = None, np.zeros(0)
+
+    @property
+    def best_bid(self) -> float:
+        return np.nan if self.best_bid_tick is None else self.best_bid_tick * self.tick_size
+
+    @property
+    def best_ask(self) -> float:
+        return np.nan if self.best_ask_tick is None else self.best_ask_tick * self.tick_size
+
+    def cumulative_bid_depth(self, price: float) -> float:
+        """
+        Resting buy volume priced at or above a price
+        """
+        if self.best_bid_tick is None:
+            return 0.0
+        level = self.best_bid_tick - int(self.sell_ticks(price))
+        return self.bid_levels[:max(level + 1, 0)].sum()
+
+    def cumulative_ask_depth(self, price: float) -> float:
+        """
+        Resting sell volume priced at or below a price
+        """
+        if self.best_ask_tick is None:
+            return 0.0
+        level = int(self.buy_ticks(price)) - self.best_ask_tick
+        return self.ask_levels[:max(level + 1, 0)].sum()
+
+    def depth(self) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        """
+        Top levels of both sides, best first, padded with nan prices and zero volumes
+
+        :return: bid prices, bid volumes, ask prices, ask volumes
+        """
+        bid_prices, ask_prices = np.full(self.n_levels, np.nan), np.full(self.n_levels, np.nan)
+        bid_volumes, ask_volumes = np.zeros(self.n_levels), np.zeros(self.n_levels)
+
+        bid_levels = np.flatnonzero(self.bid_levels)[:self.n_levels]
+        ask_levels = np.flatnonzero(self.ask_levels)[:self.n_levels]
+        if len(bid_levels) > 0:
+            bid_prices[:len(bid_levels)] = (self.best_bid_tick - bid_levels) * self.tick_size
+            bid_volumes[:len(bid_levels)] = self.bid_levels[bid_levels]
+        if len(ask_levels) > 0:
+            ask_prices[:len(ask_levels)] = (self.best_ask_tick + ask_levels) * self.tick_size
+            ask_volumes[:len(ask_levels)] = self.ask_levels[ask_levels]
+        return bid_prices, bid_volumes, ask_prices, ask_volumes
+
+    def snapshot(self) -> dict:
+        """
+        L2 depth snapshot for the market state
+        """
+        bid_prices, bid_volumes, ask_prices, ask_volumes = self.depth()
+        total_depth = bid_volumes.sum() + ask_volumes.sum()
+        return {'bid_prices': bid_prices,
+                'bid_volumes': bid_volumes,
+                'ask_prices': ask_prices,
+                'ask_volumes': ask_volumes,
+                'best_bid': self.best_bid,
+                'best_ask': self.best_ask,
+                'spread': self.best_ask - self.best_bid,
+                'depth_imbalance': (bid_volumes.sum() - ask_volumes.sum()) / total_depth if total_depth > 0 else 0.0}
@@ -0,0 +1,416 @@
+from typing import NoReturn, Tuple
+import numpy as np
+from numpy import ndarray
+from market_simulation_study.agent import RandomAgent, InvestorAgent, TrendAgent, MarketMakerAgent
+
+
+class Population:
+    """
+    Abstract class for a population of agents of one class, simulated in a batch of independent markets.
+
+    Parameters are given per agent, as scalars shared by all agents of the population, or as distributions drawn
+    from once per agent: functions of the number of agents, e.g. lambda size: np.random.randint(10, 30, size), or
+    frozen scipy.stats distributions. The state of the agents is kept in arrays of shape (markets, agents), and
+    update produces the quotes of every agent in every market with one vectorized pass following the update of
+    the agent class. Variates are drawn from the np.random module or an attached stream of
+    market_simulation_study.random_streams.
+    """
+    agent_class = None
+    random = np.random
+    shared_latency = False  # one latency per agent for all markets, when the markets are instruments of one market
+
+    def __init__(self, n_agents: int, delta=1, position=0):
+        """
+        Constructor
+        :param n_agents: number of agents
+        :param delta: base latency
+        :param position: initial position
+        """
+        self.n_agents = n_agents
+        self.delta = self.parameter(delta)
+        self.initial_position = self.parameter(position)
+        self.n_markets = 0
+        self.latency = None
+        self.buy_volume = None
+        self.sell_volume = None
+
+    def parameter(self, value, dtype=float) -> ndarray:
+        """
+        Broadcasts a parameter to one value per agent, drawing it first if it is given as a distribution
+
+        :param value: scalar, one value per agent or distribution
+        :param dtype: dtype of the parameter
+        :return: array of length n_agents
+        """
+        if hasattr(value, "rvs"):
+            value = value.rvs(size=self.n_agents)
+        elif callable(value):
+            value = value(self.n_agents)
+        return np.broadcast_to(np.asarray(value, dtype=dtype), (self.n_agents,)).copy()
+
+    def reset(self, n_markets: int) -> NoReturn:
+        """
+        Allocates the state of the agents for a batch of markets
+
+        :param n_markets: number of markets
+        :return: NoReturn
+        """
+        self.n_markets = n_markets
+        self.latency = np.broadcast_to(self.delta, (n_markets, self.n_agents)).copy()
+        self.buy_volume = np.zeros((n_markets, self.n_agents))
+        self.sell_volume = np.zeros((n_markets, self.n_agents))
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.n_markets, self.n_agents
+
+    def update_latency(self, redraw: ndarray = None) -> NoReturn:
+        """
+        Draws new latencies for all agents with the latency model of the agent class
+
+        :param redraw: if given, only the agents where it is True get a new latency, the others keep theirs. With
+        shared_latency an agent gets a new latency in all markets if it is True in any of them.
+        :return: NoReturn
+        """
+        if self.agent_class.latency_bounds is not None:
+            if self.shared_latency:
+                draws = self.random.uniform(*self.agent_class.latency_bounds, size=(1, self.n_agents))
+                redraw = None if redraw is None else np.any(redraw, axis=0)
+            else:
+                draws = self.random.uniform(*self.agent_class.latency_bounds, size=self.shape)
+            latency = np.broadcast_to(self.agent_class.latency_from_draw(self.delta, draws), self.shape)
+            self.latency = latency.copy() if redraw is None else np.where(redraw, latency, self.latency)
+
+    def update(self, prices: ndarray, positions: ndarray) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        """
+        Updates the latencies and quotes of all agents
+
+        :param prices: market price history of shape (time, markets)
+        :param positions: positions of the agents of shape (markets, agents)
+        :return: buy prices, buy volumes, sell prices and sell volumes of shape (markets, agents)
+        """
+        raise NotImplementedError("Abstract Class")
+
+
+class RandomPopulation(Population):
+    """
+    Population of RandomAgents
+    """
+    agent_class = RandomAgent
+
+    def __init__(self,
+                 n_agents: int,
+                 delta=1,
+                 position=0,
+                 noise_range: Tuple = (0.001, 0.005),
+                 mid_price_noise=0.001,
+                 n_coin_flips=3,
+                 coin_bias_buy=0.5,
+                 coin_bias_sell=0.5,
+                 mid_price_correlation: ndarray = None):
+        """
+        Constructor
+        :param n_agents: number of agents
+        :param delta: base latency
+        :param position: initial position
+        :param noise_range: range of the uniform noise between the random mid price and the quotes
+        :param mid_price_noise: standard deviation of the relative noise of the random mid price
+        :param n_coin_flips: number of coin flips drawing the volumes
+        :param coin_bias_buy: probability of a coin flip adding to the buy volume
+        :param coin_bias_sell: probability of a coin flip adding to the sell volume
+        :param mid_price_correlation: correlation matrix of the mid price noise of an agent across the markets, for
+        markets which are instruments of one multi-asset market. None draws the noise independently per market.
+        """
+        super().__init__(n_agents, delta, position)
+        self.noise_low = self.parameter(noise_range[0])
+        self.noise_high = self.parameter(noise_range[1])
+        self.mid_price_noise = self.parameter(mid_price_noise)
+        self.n_coin_flips = self.parameter(n_coin_flips, dtype=int)
+        self.coin_bias_buy = self.parameter(coin_bias_buy)
+        self.coin_bias_sell = self.parameter(coin_bias_sell)
+        self.noise_factor = None if mid_price_correlation is None else np.linalg.cholesky(mid_price_correlation)
+
+    def mid_price_noises(self) -> ndarray:
+        """
+        Draws the relative noise of the random mid price of every agent in every market
+
+        :return: noise of shape (markets, agents)
+        """
+        if self.noise_factor is None:
+            return self.random.normal(0, self.mid_price_noise, size=self.shape)
+        if len(self.noise_factor) != self.n_markets:
+            raise ValueError(f"mid_price_correlation is given for {len(self.noise_factor)} markets, "
+                             f"but the population trades in {self.n_markets}")
+        return self.noise_factor @ self.random.normal(0, 1, size=self.shape) * self.mid_price_noise
+
+    def update(self, prices: ndarray, positions: ndarray) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        self.update_latency()
+        random_agent_price = prices[-1][:, None] * (1 + self.mid_price_noises())
+        buy_prices = np.maximum(
+            random_agent_price * (1 - self.random.uniform(self.noise_low, self.noise_high, size=self.shape)), 0)
+        sell_prices = np.maximum(
+            random_agent_price * (1 + self.random.uniform(self.noise_low, self.noise_high, size=self.shape)), 0)
+        self.buy_volume = self.random.binomial(self.n_coin_flips, self.coin_bias_buy, size=self.shape).astype(float)
+        self.sell_volume = self.random.binomial(self.n_coin_flips, self.coin_bias_sell, size=self.shape).astype(float)
+        return buy_prices, self.buy_volume, sell_prices, self.sell_volume
+
+
+class InvestorPopulation(Population):
+    """
+    Population of InvestorAgents, each working through its queue of orders independently in every market
+    """
+    agent_class = InvestorAgent
+
+    def __init__(self,
+                 n_agents: int,
+                 delta=1,
+                 position=0,
+                 buy_volume=5,
+                 sell_volume=10,
+                 intensity=0.01,
+                 n_orders=20,
+                 buy_price_margin=0.025,
+                 sell_price_margin=0.05,
+                 can_short=False):
+        """
+        Constructor
+        :param n_agents: number of agents
+        :param delta: base latency
+        :param position: initial position
+        :param buy_volume: volume of each buy order
+        :param sell_volume: volume of each sell order
+        :param intensity: probability of starting to buy or sell in a step
+        :param n_orders: number of buy orders placed once the agent starts buying, half of it when selling
+        :param buy_price_margin: relative margin above the market price of the buy orders
+        :param sell_price_margin: relative margin below the market price of the sell orders
+        :param can_short: if False the agent only starts selling with a large enough position
+        """
+        super().__init__(n_agents, delta, position)
+        self.order_buy_volume = self.parameter(buy_volume)
+        self.order_sell_volume = self.parameter(sell_volume)
+        self.intensity = self.parameter(intensity)
+        self.n_orders = self.parameter(n_orders, dtype=int)
+        self.buy_price_margin = self.parameter(buy_price_margin)
+        self.sell_price_margin = self.parameter(sell_price_margin)
+        self.can_short = self.parameter(can_short, dtype=bool)
+        self.orders_in_queue = None
+        self.is_buying = None
+
+    def reset(self, n_markets: int) -> NoReturn:
+        super().reset(n_markets)
+        self.buy_volume = np.broadcast_to(self.order_buy_volume, self.shape).copy()
+        self.sell_volume = np.broadcast_to(self.order_sell_volume, self.shape).copy()
+        self.orders_in_queue = np.zeros(self.shape, dtype=int)
+        self.is_buying = np.zeros(self.shape, dtype=bool)
+
+    def update(self, prices: ndarray, positions: ndarray) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        self.update_latency()
+        will_buy = self.random.uniform(0, 1, size=self.shape) < self.intensity
+        sell_is_possible = self.can_short | (positions >= self.n_orders / 2 * self.sell_volume)
+        will_sell = (self.random.uniform(0, 0.95, size=self.shape) < self.intensity) & sell_is_possible
+
+        queued = self.orders_in_queue > 0
+        self.is_buying &= queued
+        buying = queued & self.is_buying
+        selling = queued & ~self.is_buying
+        starts_buying = ~queued & will_buy
+        starts_selling = ~queued & ~will_buy & will_sell
+
+        self.orders_in_queue = np.select([queued, starts_buying, starts_selling],
+                                         [self.orders_in_queue - 1,
+                                          np.broadcast_to(self.n_orders - 1, self.shape),
+                                          np.broadcast_to(self.n_orders // 2 - 1, self.shape)],
+                                         self.orders_in_queue)
+        self.is_buying |= starts_buying
+
+        last_prices = prices[-1][:, None]
+        buy_prices = np.where(buying | starts_buying, np.maximum(last_prices * (1 + self.buy_price_margin), 0), np.nan)
+        sell_prices = np.where(selling | starts_selling, np.maximum(last_prices * (1 - self.sell_price_margin), 0),
+                               np.nan)
+        return buy_prices, self.buy_volume, sell_prices, self.sell_volume
+
+
+class TrendPopulation(Population):
+    """
+    Population of TrendAgents. The moving averages are computed once per distinct window length.
+    """
+    agent_class = TrendAgent
+
+    def __init__(self,
+                 n_agents: int,
+                 delta=1,
+                 position=0,
+                 price_margin=0.05,
+                 const_position_size=5,
+                 moving_average_one=25,
+                 moving_average_two=100):
+        """
+        Constructor
+        :param n_agents: number of agents
+        :param delta: base latency
+        :param position: initial position
+        :param price_margin: relative margin above the market price of the buy orders
+        :param const_position_size: position the agent aims for in the direction of the trend
+        :param moving_average_one: window of the short moving average
+        :param moving_average_two: window of the long moving average
+        """
+        super().__init__(n_agents, delta, position)
+        self.price_margin = self.parameter(price_margin)
+        self.const_position_size = self.parameter(const_position_size)
+        self.moving_average_one = self.parameter(moving_average_one, dtype=int)
+        self.moving_average_two = self.parameter(moving_average_two, dtype=int)
+        self.windows, window_index = np.unique(np.concatenate((self.moving_average_one, self.moving_average_two)),
+                                               return_inverse=True)
+        self.window_one, self.window_two = window_index[:n_agents], window_index[n_agents:]
+
+    def moving_averages(self, prices: ndarray) -> ndarray:
+        """
+        Averages the last prices of every market over each distinct window
+
+        :param prices: market price history of shape (time, markets)
+        :return: moving averages of shape (windows, markets)
+        """
+        return np.stack([np.mean(prices[-window:], axis=0) for window in self.windows])
+
+    def update(self, prices: ndarray, positions: ndarray) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        self.update_latency()
+        moving_averages = self.moving_averages(prices)
+        trend = (moving_averages[self.window_one] / moving_averages[self.window_two]).T
+
+        buys = (trend >= 1) & (positions < self.const_position_size)
+        sells = (trend < 1) & (positions >= -self.const_position_size)
+        last_prices = prices[-1][:, None]
+        buy_noise = self.random.normal(0, 0.0001, size=self.shape)
+        sell_noise = self.random.normal(0, 0.0001, size=self.shape)
+        buy_prices = np.where(buys, np.maximum(last_prices * (1 + self.price_margin + buy_noise), 0), np.nan)
+        sell_prices = np.where(sells, np.maximum(last_prices * (1 + sell_noise), 0), np.nan)
+        self.buy_volume = np.where(buys, self.const_position_size - positions, self.buy_volume)
+        self.sell_volume = np.where(sells, self.const_position_size + positions, self.sell_volume)
+        return buy_prices, self.buy_volume, sell_prices, self.sell_volume
+
+
+class MarketMakerPopulation(Population):
+    """
+    Population of MarketMakerAgents
+    """
+    agent_class = MarketMakerAgent
+
+    def __init__(self,
+                 n_agents: int,
+                 delta=1,
+                 position=0,
+                 gamma=0.01,
+                 gamma2=0.5,
+                 spread_zero=0.001,
+                 n_volume=3,
+                 requote_threshold: float = None,
+                 n_observations: int = 10):
+        """
+        Constructor
+        :param n_agents: number of agents
+        :param delta: base latency
+        :param position: initial position
+        :param gamma: mid price sensitivity to the position
+        :param gamma2: spread sensitivity to the volatility
+        :param spread_zero: spread without volatility
+        :param n_volume: volume of the quotes
+        :param requote_threshold: if given, quotes are only recalculated when the mid price moves more than this or
+        the position changes
+        :param n_observations: number of prices the volatility is calculated from
+        """
+        super().__init__(n_agents, delta, position)
+        self.gamma = self.parameter(gamma)
+        self.gamma2 = self.parameter(gamma2)
+        self.spread_zero = self.parameter(spread_zero)
+        self.n_volume = self.parameter(n_volume)
+        self.requote_threshold = requote_threshold
+        self.n_observations = n_observations
+        self.mid_price = None
+        self.quoted_positions = None
+        self.buy_prices = None
+        self.sell_prices = None
+
+    def reset(self, n_markets: int) -> NoReturn:
+        super().reset(n_markets)
+        self.buy_volume = np.broadcast_to(self.n_volume, self.shape).copy()
+        self.sell_volume = np.broadcast_to(self.n_volume, self.shape).copy()
+        self.mid_price = np.full(self.shape, np.nan)
+        self.quoted_positions = np.full(self.shape, np.nan)
+        self.buy_prices = np.full(self.shape, np.nan)
+        self.sell_prices = np.full(self.shape, np.nan)
+
+    def inventory(self, positions: ndarray) -> ndarray:
+        """
+        Inventory the mid price of every agent is skewed against, its position in each market
+
+        :param positions: positions of the agents of shape (markets, agents)
+        :return: inventory of shape (markets, agents)
+        """
+        return positions
+
+    def update(self, prices: ndarray, positions: ndarray) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        # Like the agent, decide on the requote first, so agents keeping their quotes also keep their latency
+        mid_price = prices[-1][:, None] * (1 - self.gamma * self.inventory(positions))
+        requote = np.ones(self.shape, dtype=bool)
+        if self.requote_threshold is not None:
+            requote = (np.isnan(self.mid_price) | (positions != self.quoted_positions)
+                       | (np.abs(mid_price - self.mid_price) > self.requote_threshold))
+        self.update_latency(requote)
+
+        spread = np.std(prices[-self.n_observations:], axis=0)[:, None] * self.gamma2 + self.spread_zero
+        buy_prices = mid_price - spread / 2 + self.random.normal(0, 0.0001, size=self.shape)
+        sell_prices = mid_price + spread / 2 + self.random.normal(0, 0.0001, size=self.shape)
+        self.mid_price = np.where(requote, mid_price, self.mid_price)
+        self.quoted_positions = np.where(requote, positions, self.quoted_positions)
+        self.buy_prices = np.where(requote, buy_prices, self.buy_prices)
+        self.sell_prices = np.where(requote, sell_prices, self.sell_prices)
+        return self.buy_prices, self.buy_volume, self.sell_prices, self.sell_volume
+
+
+class CrossAssetMarketMakerPopulation(MarketMakerPopulation):
+    """
+    Population of MarketMakerAgents quoting every instrument of a multi-asset market, whose mid price in each
+    instrument is skewed against the inventory in all instruments. The inventory of instrument i is the sum over the
+    instruments j of inventory_weights[i, j] times the position in j, e.g. hedge ratios of correlated instruments,
+    so a long position in one instrument also lowers the quotes of the instruments it is hedged with. The identity
+    matrix gives the per instrument MarketMakerPopulation.
+    """
+
+    def __init__(self,
+                 n_agents: int,
+                 inventory_weights: ndarray,
+                 delta=1,
+                 position=0,
+                 gamma=0.01,
+                 gamma2=0.5,
+                 spread_zero=0.001,
+                 n_volume=3,
+                 requote_threshold: float = None,
+                 n_observations: int = 10):
+        """
+        Constructor
+        :param n_agents: number of agents
+        :param inventory_weights: weight of the position in each instrument (columns) in the inventory of each
+        instrument (rows), of shape (assets, assets)
+        :param delta: base latency
+        :param position: initial position
+        :param gamma: mid price sensitivity to the inventory
+        :param gamma2: spread sensitivity to the volatility
+        :param spread_zero: spread without volatility
+        :param n_volume: volume of the quotes
+        :param requote_threshold: if given, quotes are only recalculated when the mid price moves more than this or
+        the position changes
+        :param n_observations: number of prices the volatility is calculated from
+        """
+        super().__init__(n_agents, delta, position, gamma, gamma2, spread_zero, n_volume, requote_threshold,
+                         n_observations)
+        self.inventory_weights = np.asarray(inventory_weights, dtype=float)
+
+    def reset(self, n_markets: int) -> NoReturn:
+        if self.inventory_weights.shape != (n_markets, n_markets):
+            raise ValueError(f"inventory_weights of shape {self.inventory_weights.shape} do not match "
+                             f"{n_markets} instruments")
+        super().reset(n_markets)
+
+    def inventory(self, positions: ndarray) -> ndarray:
+        return self.inventory_weights @ positions
@@ -0,0 +1,141 @@
+from copy import deepcopy
+from typing import NoReturn
+import numpy as np
+
+# First element of the key of each kind of stream
+AGENT_STREAMS, ENVIRONMENT_STREAMS, POPULATION_STREAMS = range(3)
+
+
+class RandomStream:
+    """
+    Random variates of one agent or component of a simulation, drawn from its own np.random.Generator.
+
+    Scalar draws are served from blocks of standard uniform and normal variates drawn with one generator call,
+    while draws with a size go to the generator directly. The methods follow the signatures of np.random, so a
+    stream can be used wherever the np.random module is.
+    """
+
+    def __init__(self, generator: np.random.Generator, block_size: int = 256):
+        """
+        Constructor
+        :param generator: generator of the stream
+        :param block_size: number of variates drawn at once for scalar draws
+        """
+        self.generator = generator
+        self.block_size = block_size
+        self.uniforms = []
+        self.next_uniform = 0
+        self.normals = []
+        self.next_normal = 0
+
+    def __deepcopy__(self, memo: dict) -> "RandomStream":
+        """
+        Copies the generator, sharing the blocks of variates, which are replaced when used up but never changed
+        """
+        copy = object.__new__(type(self))
+        copy.__dict__.update(self.__dict__)
+        copy.generator = deepcopy(self.generator, memo)
+        memo[id(self)] = copy
+        return copy
+
+    def standard_uniform(self) -> float:
+        if self.next_uniform == len(self.uniforms):
+            self.uniforms = self.generator.random(self.block_size).tolist()
+            self.next_uniform = 0
+        self.next_uniform += 1
+        return self.uniforms[self.next_uniform - 1]
+
+    def standard_normal(self) -> float:
+        if self.next_normal == len(self.normals):
+            self.normals = self.generator.standard_normal(self.block_size).tolist()
+            self.next_normal = 0
+        self.next_normal += 1
+        return self.normals[self.next_normal - 1]
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        if size is not None:
+            return self.generator.uniform(low, high, size)
+        return low + (high - low) * self.standard_uniform()
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        if size is not None:
+            return self.generator.normal(loc, scale, size)
+        return loc + scale * self.standard_normal()
+
+    def binomial(self, n, p, size=None):
+        """
+        Binomial draw, by inversion of the distribution function from one standard uniform for a scalar draw with
+        few trials
+        """
+        if size is not None or n > 64:
+            return self.generator.binomial(n, p, size)
+        if not 0 < p < 1:
+            return int(n) if p >= 1 else 0
+        u = self.standard_uniform()
+        odds = p / (1 - p)
+        probability = (1 - p) ** n
+        cumulative = probability
+        k = 0
+        while u >= cumulative and k < n:
+            probability *= odds * (n - k) / (k + 1)
+            k += 1
+            cumulative += probability
+        return k
+
+    def randint(self, low, high=None, size=None):
+        """
+        Integer draw from low, inclusive, to high, exclusive, or from 0 to low if high is not given
+        """
+        if high is None:
+            low, high = 0, low
+        if size is not None:
+            return self.generator.integers(low, high, size)
+        return low + int((high - low) * self.standard_uniform())
+
+
+class RandomStreams:
+    """
+    Random number service of a simulation, giving every agent and component an independent stream.
+
+    Streams are derived from the seed and a key with np.random.SeedSequence, so the stream of an agent only
+    depends on the seed and the agent id. Results are therefore reproducible for a seed regardless of the order
+    in which agents are updated and of how a simulation is spread over threads or processes.
+    """
+
+    def __init__(self, seed: int, block_size: int = 256):
+        """
+        Constructor
+        :param seed: seed of the simulation
+        :param block_size: number of variates each stream draws at once for scalar draws
+        """
+        self.seed = seed
+        self.block_size = block_size
+        self.streams = {}
+
+    def stream(self, *key) -> RandomStream:
+        """
+        Returns the stream of a key, which is the same for the same seed in any process
+
+        :param key: non-negative integers identifying the stream, starting with the kind of stream
+        :return: stream
+        """
+        if key not in self.streams:
+            sequence = np.random.SeedSequence(self.seed, spawn_key=key)
+            self.streams[key] = RandomStream(np.random.Generator(np.random.PCG64(sequence)), self.block_size)
+        return self.streams[key]
+
+    def attach(self, agents: list = (), environment=None, populations: list = ()) -> NoReturn:
+        """
+        Makes agents, the latency draws of an environment and populations draw from their own streams
+
+        :param agents: agents, whose streams are keyed by agent id
+        :param environment: MarketEnvironment whose scheduler draws the latencies
+        :param populations: populations, whose streams are keyed by their position in the list
+        :return: NoReturn
+        """
+        for agent in agents:
+            agent.random = self.stream(AGENT_STREAMS, int(agent.agent_id))
+        if environment is not None:
+            environment.scheduler.random = self.stream(ENVIRONMENT_STREAMS, 0)
+        for index, population in enumerate(populations):
+            population.random = self.stream(POPULATION_STREAMS, index)
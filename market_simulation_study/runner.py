@@ -0,0 +1,238 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import NoReturn
+import multiprocessing
+import pickle
+import numpy as np
+from numpy import ndarray
+from market_simulation_study.environment import MarketEnvironment
+from market_simulation_study.random_streams import RandomStreams
+from market_simulation_study.cadence import UpdateScheduler
+from market_simulation_study.burn_in import BurnInCache, configuration_key
+from market_simulation_study.snapshot import SimulationSnapshot, seed_random
+
+
+class Scenario:
+    """
+    Specification of a market simulation episode: the agent population, the initial state and the number of periods.
+
+    Agents are given as (agent class, number of agents, parameters) groups. A parameter may be a function without
+    arguments, which is called for every agent after the episode is seeded, e.g. to draw moving average windows.
+    During the episode every agent draws from its own stream of RandomStreams seeded with the episode seed.
+    With a BurnInCache, an episode whose warm-up was simulated before for the same configuration and seed starts
+    from the cached state at the end of the warm-up.
+    """
+
+    def __init__(self,
+                 state0: dict,
+                 agent_groups: list,
+                 time_periods: int,
+                 warm_up_periods: int = 0,
+                 environment_parameters: dict = None,
+                 cadences: dict = None,
+                 burn_in_cache: BurnInCache = None,
+                 decision_threads: int = None):
+        """
+        Constructor
+        :param state0: initial market state
+        :param agent_groups: list of (agent class, number of agents, dict of constructor parameters)
+        :param time_periods: number of recorded periods of an episode
+        :param warm_up_periods: number of periods simulated before recording starts
+        :param environment_parameters: keyword arguments of MarketEnvironment
+        :param cadences: update cadence of each agent class, see market_simulation_study.cadence
+        :param burn_in_cache: cache of the states at the end of the warm-up, None to always simulate the warm-up
+        :param decision_threads: number of threads preparing the decisions of agents with a concurrent_decision
+        """
+        self.state0 = state0
+        self.agent_groups = agent_groups
+        self.time_periods = time_periods
+        self.warm_up_periods = warm_up_periods
+        self.environment_parameters = environment_parameters if environment_parameters else {}
+        self.cadences = cadences
+        self.burn_in_cache = burn_in_cache
+        self.decision_threads = decision_threads
+        self.class_names = list(dict.fromkeys(agent_class.__name__ for agent_class, _, _ in agent_groups))
+
+    def build_agents(self) -> list:
+        """
+        Creates the agents of the scenario with consecutive agent ids
+
+        :return: list of agents
+        """
+        agents = []
+        for agent_class, n_agents, parameters in self.agent_groups:
+            for _ in range(n_agents):
+                values = {key: value() if callable(value) else value for key, value in parameters.items()}
+                agents.append(agent_class(agent_id=len(agents), **values))
+        return agents
+
+    def burn_in_key(self, seed: int) -> str:
+        """
+        Key of the warm-up of an episode, which depends on everything but the number of recorded periods
+        """
+        return configuration_key(self.state0, self.agent_groups, self.warm_up_periods, self.environment_parameters,
+                                 self.cadences, seed)
+
+    def simulate_burn_in(self, seed: int) -> tuple:
+        """
+        Simulates the warm-up of an episode
+
+        :param seed: seed of the episode
+        :return: environment, agents and update scheduler at the end of the warm-up
+        """
+        seed_random(seed)
+        agents = self.build_agents()
+        environment = MarketEnvironment(self.state0, **self.environment_parameters)
+        RandomStreams(seed).attach(agents, environment)
+        scheduler = UpdateScheduler(agents, self.cadences, self.decision_threads)
+        scheduler.update(self.state0)
+        for _ in range(self.warm_up_periods):
+            agents, state = environment.step(agents)
+            scheduler.update(state)
+        return environment, agents, scheduler
+
+    def snapshot_burn_in(self, seed: int) -> SimulationSnapshot:
+        environment, agents, scheduler = self.simulate_burn_in(seed)
+        return environment.snapshot(agents, (scheduler,))
+
+    def run_episode(self, seed: int, market_prices: ndarray, volumes: ndarray, class_pnl: ndarray) -> NoReturn:
+        """
+        Simulates one episode and writes the recorded periods into the given arrays
+
+        :param seed: seed of the episode
+        :param market_prices: market price of each recorded period
+        :param volumes: traded volume of each recorded period
+        :param class_pnl: profit and loss of each agent class, shape (periods, classes)
+        :return: NoReturn
+        """
+        if self.burn_in_cache is None:
+            environment, agents, scheduler = self.simulate_burn_in(seed)
+        else:
+            environment, agents, scheduler = self.burn_in_cache.burn_in(self.burn_in_key(seed),
+                                                                        lambda: self.snapshot_burn_in(seed))
+
+        for period in range(self.time_periods):
+            agents, state = environment.step(agents)
+            scheduler.update(state)
+            market_prices[period] = state["market_prices"][-1]
+            volumes[period] = state["volume"]
+            pnl = environment.aggregate_by_class(environment.calculate_profit_and_loss())
+            class_pnl[period] = [pnl.get(name, 0.0) for name in self.class_names]
+
+
+# Worker state, set by the pool initializer
+worker_scenario = None
+worker_blocks = {}
+worker_results = {}
+
+
+def attach_results(scenario: Scenario, block_names: dict, shapes: dict) -> NoReturn:
+    """
+    Pool initializer attaching a worker to the shared result arrays
+
+    :param scenario: scenario of the run
+    :param block_names: shared memory block name of each result
+    :param shapes: shape of each result
+    :return: NoReturn
+    """
+    global worker_scenario
+    worker_scenario = scenario
+    for key, name in block_names.items():
+        worker_blocks[key] = shared_memory.SharedMemory(name=name)
+        worker_results[key] = np.ndarray(shapes[key], dtype=np.float64, buffer=worker_blocks[key].buf)
+
+
+def run_worker_episode(episode: int, seed: int) -> int:
+    """
+    Simulates one episode in a worker and writes it into the shared result arrays
+
+    :param episode: row of the episode in the results
+    :param seed: seed of the episode
+    :return: episode
+    """
+    worker_scenario.run_episode(seed, worker_results["market_prices"][episode], worker_results["volumes"][episode],
+                                worker_results["class_pnl"][episode])
+    return episode
+
+
+class MonteCarloRunner:
+    """
+    Runs the episodes of a scenario on a process pool.
+
+    Results are written by the workers straight into preallocated shared memory arrays, one row per episode. Every
+    episode only depends on its seed, so the results do not depend on the number of workers.
+
+    Workers are started with the fork start method where the platform has it, so they inherit the scenario, whose
+    parameter functions may be lambdas or closures. With another start method, e.g. spawn on Windows, the scenario is
+    pickled to the workers and its agent classes and parameter functions must be defined at module level.
+    """
+
+    def __init__(self, scenario: Scenario, n_workers: int = None, start_method: str = None):
+        """
+        Constructor
+        :param scenario: scenario to simulate
+        :param n_workers: number of worker processes, None for the number of cpus and 1 to run in this process
+        :param start_method: start method of the worker processes, None for fork where available and the default
+        start method of the platform otherwise
+        """
+        if start_method is None and "fork" in multiprocessing.get_all_start_methods():
+            start_method = "fork"
+        self.scenario = scenario
+        self.n_workers = n_workers if n_workers is not None else multiprocessing.cpu_count()
+        self.mp_context = multiprocessing.get_context(start_method)
+
+    def check_picklable(self) -> NoReturn:
+        """
+        Checks that the scenario can be sent to workers which do not inherit it from a fork
+        """
+        if self.mp_context.get_start_method() == "fork":
+            return
+        try:
+            pickle.dumps(self.scenario)
+        except (pickle.PicklingError, AttributeError, TypeError) as error:
+            raise ValueError(f"The scenario cannot be pickled for the {self.mp_context.get_start_method()} start "
+                             f"method, define its agent classes and parameter functions at module level") from error
+
+    def result_shapes(self, n_episodes: int) -> dict:
+        n_periods = self.scenario.time_periods
+        return {"market_prices": (n_episodes, n_periods),
+                "volumes": (n_episodes, n_periods),
+                "class_pnl": (n_episodes, n_periods, len(self.scenario.class_names))}
+
+    def run(self, seeds: list) -> dict:
+        """
+        Simulates one episode per seed
+
+        :param seeds: seed of each episode
+        :return: dict with market prices and volumes of shape (episodes, periods), the profit and loss of each agent
+        class of shape (episodes, periods, classes) and the class names
+        """
+        shapes = self.result_shapes(len(seeds))
+        if self.n_workers == 1:
+            results = {key: np.zeros(shape) for key, shape in shapes.items()}
+            for episode, seed in enumerate(seeds):
+                self.scenario.run_episode(seed, results["market_prices"][episode], results["volumes"][episode],
+                                          results["class_pnl"][episode])
+        else:
+            self.check_picklable()
+            blocks = {key: shared_memory.SharedMemory(create=True, size=max(8 * int(np.prod(shape)), 1))
+                      for key, shape in shapes.items()}
+            try:
+                shared_results = {key: np.ndarray(shape, dtype=np.float64, buffer=blocks[key].buf)
+                                  for key, shape in shapes.items()}
+                for result in shared_results.values():
+                    result.fill(np.nan)
+                block_names = {key: block.name for key, block in blocks.items()}
+                with ProcessPoolExecutor(max_workers=min(self.n_workers, len(seeds)), mp_context=self.mp_context,
+                                         initializer=attach_results,
+                                         initargs=(self.scenario, block_names, shapes)) as executor:
+                    list(executor.map(run_worker_episode, range(len(seeds)), seeds))
+                results = {key: result.copy() for key, result in shared_results.items()}
+                del shared_results
+            finally:
+                for block in blocks.values():
+                    block.close()
+                    block.unlink()
+
+        results["class_names"] = self.scenario.class_names
+        return results
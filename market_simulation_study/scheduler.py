@@ -0,0 +1,94 @@
+from typing import NoReturn
+import numpy as np
+from numpy import ndarray
+
+
+class LatencyScheduler:
+    """
+    Keeps the latencies and ids of a population in numpy arrays and produces the order agents are matched in.
+
+    Agents are processed by increasing latency with ties broken by agent id, through a permutation, so the list of
+    agents itself is never reordered. If draw_latencies is set, the scheduler also draws the latencies of all agents
+    of a class with one vectorized call, using the latency_bounds and latency_from_draw of the class, from the
+    np.random module or an attached stream of market_simulation_study.random_streams.
+    """
+    random = np.random
+
+    def __init__(self, draw_latencies: bool = False):
+        """
+        Constructor
+        :param draw_latencies: if True latencies are drawn by the scheduler instead of by each agent's update
+        """
+        self.draw_latencies = draw_latencies
+        self.agents = None
+        self.n_agents = 0
+        self.agent_ids = np.zeros(0)
+        self.deltas = np.zeros(0)
+        self.latencies = np.zeros(0)
+        self.classes = []  # (agent class, indices of its agents)
+
+    def set_population(self, agents: list) -> NoReturn:
+        """
+        Caches ids, base latencies and class groups of a population, keeping its own copy of the list so agents
+        replaced in the list of the caller are noticed
+
+        :param agents: list of agents
+        :return: NoReturn
+        """
+        self.agents = list(agents)
+        self.n_agents = len(agents)
+        self.agent_ids = np.array([agent.agent_id for agent in agents], dtype=float)
+        self.deltas = np.array([agent.delta for agent in agents], dtype=float)
+        self.latencies = np.array([agent.latency for agent in agents], dtype=float)
+
+        classes = {}
+        for i, agent in enumerate(agents):
+            classes.setdefault(type(agent), []).append(i)
+            agent.latency_scheduled = self.draw_latencies and agent.latency_bounds is not None
+        self.classes = [(agent_class, np.array(indices)) for agent_class, indices in classes.items()]
+
+    def draw(self) -> NoReturn:
+        """
+        Draws new latencies for every class with random latencies and stores them on the agents
+        """
+        for agent_class, indices in self.classes:
+            if agent_class.latency_bounds is None:
+                continue
+            draws = self.random.uniform(*agent_class.latency_bounds, size=len(indices))
+            self.latencies[indices] = agent_class.latency_from_draw(self.deltas[indices], draws)
+        for agent, latency in zip(self.agents, self.latencies):
+            agent.latency = latency
+
+    def draw_agent(self, agent) -> NoReturn:
+        """
+        Draws a new latency for one agent, for simulation drivers which update the agents one at a time
+
+        :param agent: agent of the population
+        :return: NoReturn
+        """
+        if agent.latency_bounds is not None:
+            agent.latency = agent.latency_from_draw(agent.delta, self.random.uniform(*agent.latency_bounds))
+
+    def population_changed(self, agents: list) -> bool:
+        """
+        Tells if agents differ from the cached population, also when agents of the same list were replaced
+
+        :param agents: list of agents
+        :return: True if the cache has to be rebuilt
+        """
+        return len(agents) != self.n_agents or any(agent is not cached for agent, cached in zip(agents, self.agents))
+
+    def schedule(self, agents: list) -> ndarray:
+        """
+        Returns the order in which the agents are matched, by latency and then agent id
+
+        :param agents: list of agents
+        :return: permutation of agent indices
+        """
+        if self.population_changed(agents):
+            self.set_population(agents)
+        if self.draw_latencies:
+            self.draw()
+        else:
+            self.latencies = np.fromiter((agent.latency for agent in agents), dtype=float, count=len(agents))
+        return np.lexsort((self.agent_ids, self.latencies))
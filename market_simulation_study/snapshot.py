@@ -0,0 +1,94 @@
+from typing import NoReturn
+import copy
+import random
+import sys
+import numpy as np
+
+
+def get_random_state() -> dict:
+    """
+    Captures the state of the global random generators of numpy, Python and torch, if it is imported
+
+    :return: generator states
+    """
+    torch = sys.modules.get("torch")
+    return {'numpy': np.random.get_state(),
+            'python': random.getstate(),
+            'torch': torch.get_rng_state() if torch is not None else None}
+
+
+def set_random_state(state: dict) -> NoReturn:
+    """
+    Restores the global random generators to a state captured with get_random_state
+
+    :param state: generator states
+    :return: NoReturn
+    """
+    np.random.set_state(state['numpy'])
+    random.setstate(state['python'])
+    torch = sys.modules.get("torch")
+    if torch is not None and state['torch'] is not None:
+        torch.set_rng_state(state['torch'])
+
+
+def seed_random(seed: int) -> NoReturn:
+    """
+    Seeds the global random generators of numpy, Python and torch, if it is imported
+    """
+    np.random.seed(seed)
+    random.seed(seed)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.manual_seed(seed)
+
+
+class SimulationSnapshot:
+    """
+    State of a running simulation at one step, from which any number of independent branches can be forked.
+
+    The snapshot is a deep copy of the environment, its agents and any other objects driving the simulation, like an
+    UpdateScheduler, taken in one pass so references between them are kept. Price and volume histories and the fill
+    ledger, which grow with the length of the simulation, are shared copy-on-write between the running simulation,
+    the snapshot and its branches, so a snapshot and a fork cost about as much as the per agent state. Objects
+    given as shared, e.g. the networks of a frozen policy, are not copied at all and are shared by all branches.
+
+    The snapshot also keeps the state of the global random generators of numpy, Python and torch, if it is
+    imported, which a fork restores only when asked to, so forking never rewinds the generators of the caller.
+    Random streams attached to agents (see market_simulation_study.random_streams) are copied with them.
+    """
+
+    def __init__(self, environment, agents: list, objects: tuple = (), shared: tuple = ()):
+        """
+        Constructor
+        :param environment: market environment
+        :param agents: agents trading in the environment
+        :param objects: other objects of the simulation, copied together with the environment and the agents
+        :param shared: objects referenced by the simulation which are shared instead of copied
+        """
+        self.shared = tuple(shared)
+        self.time = environment.time
+        self.objects = copy.deepcopy((environment, agents) + tuple(objects), self.memo())
+        self.random_state = get_random_state()
+
+    def memo(self) -> dict:
+        """
+        Deep copy memo mapping the shared objects to themselves
+        """
+        return {id(shared): shared for shared in self.shared}
+
+    def fork(self, seed: int = None, restore_random_state: bool = False) -> tuple:
+        """
+        Creates an independent branch of the simulation starting from the snapshot
+
+        :param seed: if given, the global random generators are seeded with it so branches draw different numbers
+        :param restore_random_state: if no seed is given, whether to restore the global random generators to their
+        state at the snapshot, so the branch draws the same numbers as the simulation continued from the snapshot, as
+        long as agents are updated in the same way. Otherwise the global random generators are left as they are.
+        :return: environment, agents and the other objects of the branch
+        """
+        branch = copy.deepcopy(self.objects, self.memo())
+        if seed is not None:
+            seed_random(seed)
+        elif restore_random_state:
+            set_random_state(self.random_state)
+        return branch
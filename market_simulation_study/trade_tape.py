@@ -0,0 +1,196 @@
+from typing import NoReturn
+import glob
+import os
+import numpy as np
+import pandas as pd
+
+COLUMNS = {'step': np.int64,
+           'sequence': np.int64,
+           'price': np.float64,
+           'volume': np.float64,
+           'buyer_id': np.int64,
+           'seller_id': np.int64,
+           'buyer_class': np.int16,
+           'seller_class': np.int16,
+           'buyer_is_aggressor': np.bool_}
+
+
+class TradeTape:
+    """
+    Streams every fill of a market environment to disk, in files of chunk_size fills.
+
+    Fills are read from the fill ledger of the environment each time it publishes a state, so every matching engine
+    and the event driven simulator are covered, and copied into preallocated column arrays. A full chunk is written
+    to a Parquet or Feather file under directory/run=<run>/episode=<episode>/branch=<branch>/, a layout which
+    pyarrow.dataset reads as hive partitions, so the memory of the tape stays bounded however long the run is. Each
+    fill is stored with its step, its sequence number in the episode, price, volume, the ids and classes of buyer and
+    seller and whether the buyer was the aggressor. Fills without volume are left out.
+
+    A tape starts in branch "0". A deep copy of it, e.g. in a snapshot or a fork of the environment, writes to a
+    branch of its own named after its parent, like "0.1" and "0.2", so branches never overwrite each other's files.
+    A branch holds the fills after the copy, the fills before it are those of the parent with lower sequence numbers.
+
+    Files are written with pandas, which needs pyarrow. Uncompressed Feather files can be memory-mapped when read,
+    e.g. with pyarrow.feather.read_table(path, memory_map=True).
+    """
+
+    def __init__(self,
+                 directory: str,
+                 run: str = "0",
+                 episode: int = 0,
+                 chunk_size: int = 65536,
+                 file_format: str = "parquet",
+                 compression: str = "zstd"):
+        """
+        Constructor
+        :param directory: root directory of the tapes
+        :param run: name of the run
+        :param episode: episode of the run
+        :param chunk_size: number of fills per file
+        :param file_format: "parquet" or "feather"
+        :param compression: compression of the files, e.g. "zstd", "lz4" or "uncompressed"
+        """
+        if file_format not in ("parquet", "feather"):
+            raise ValueError(f"Unknown file format {file_format}")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.episode_directory = os.path.join(directory, f"run={run}", f"episode={episode}")
+        self.branch = "0"
+        self.n_branches = 0
+        self.chunk_size = chunk_size
+        self.file_format = file_format
+        self.compression = compression
+        self.columns = {name: np.zeros(chunk_size, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.n_buffered = 0
+        self.n_chunks = 0
+        self.n_recorded = 0  # ledger rows recorded so far
+        self.class_names = []
+        self.class_codes = {}  # class name -> code
+        self.slot_ids = np.zeros(0, dtype=np.int64)  # ledger slot -> agent id
+        self.slot_classes = np.zeros(0, dtype=np.int16)  # ledger slot -> class code
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(self.episode_directory, f"branch={self.branch}")
+
+    def __deepcopy__(self, memo: dict) -> "TradeTape":
+        """
+        Copies the tape into a new branch, without the fills buffered by this tape, which it writes itself
+        """
+        copy = object.__new__(type(self))
+        memo[id(self)] = copy
+        copy.__dict__.update(self.__dict__)
+        self.n_branches += 1
+        copy.branch = f"{self.branch}.{self.n_branches}"
+        copy.n_branches = 0
+        copy.columns = {name: np.zeros_like(column) for name, column in self.columns.items()}
+        copy.n_buffered = 0
+        copy.n_chunks = 0
+        copy.class_names = list(self.class_names)
+        copy.class_codes = dict(self.class_codes)
+        return copy
+
+    def update_slots(self, environment) -> NoReturn:
+        """
+        Extends the agent ids and classes of the ledger slots to the accounts opened since the last step
+        """
+        n_slots = len(environment.ledger.agent_ids)
+        if n_slots == len(self.slot_ids):
+            return
+        new_slots = range(len(self.slot_ids), n_slots)
+        classes = []
+        for slot in new_slots:
+            name = type(environment.accounts[slot]).__name__
+            if name not in self.class_codes:
+                self.class_codes[name] = len(self.class_names)
+                self.class_names.append(name)
+            classes.append(self.class_codes[name])
+        self.slot_ids = np.concatenate((self.slot_ids, np.array(environment.ledger.agent_ids[len(self.slot_ids):],
+                                                                dtype=np.int64)))
+        self.slot_classes = np.concatenate((self.slot_classes, np.array(classes, dtype=np.int16)))
+
+    def record(self, environment) -> NoReturn:
+        """
+        Appends the fills added to the ledger of an environment since the last call
+
+        :param environment: MarketEnvironment
+        :return: NoReturn
+        """
+        ledger = environment.ledger
+        start, end = self.n_recorded, len(ledger)
+        if end == start:
+            return
+        self.update_slots(environment)
+        traded = ledger.volume.view()[start:end] != 0
+        buyers = ledger.buyer.view()[start:end][traded]
+        sellers = ledger.seller.view()[start:end][traded]
+        fills = {'step': ledger.step.view()[start:end][traded],
+                 'sequence': np.arange(start, end)[traded],
+                 'price': ledger.price.view()[start:end][traded],
+                 'volume': ledger.volume.view()[start:end][traded],
+                 'buyer_id': self.slot_ids[buyers],
+                 'seller_id': self.slot_ids[sellers],
+                 'buyer_class': self.slot_classes[buyers],
+                 'seller_class': self.slot_classes[sellers],
+                 'buyer_is_aggressor': ledger.buyer_is_aggressor.view()[start:end][traded]}
+        n_fills = len(buyers)
+        offset = 0
+        while offset < n_fills:
+            n_copied = min(n_fills - offset, self.chunk_size - self.n_buffered)
+            for name, column in self.columns.items():
+                column[self.n_buffered:self.n_buffered + n_copied] = fills[name][offset:offset + n_copied]
+            self.n_buffered += n_copied
+            offset += n_copied
+            if self.n_buffered == self.chunk_size:
+                self.flush()
+        self.n_recorded = end
+
+    def flush(self) -> NoReturn:
+        """
+        Writes the buffered fills to the next file of the branch
+        """
+        if self.n_buffered == 0:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        data = pd.DataFrame({name: column[:self.n_buffered] for name, column in self.columns.items()})
+        for side in ("buyer_class", "seller_class"):
+            data[side] = pd.Categorical.from_codes(data[side], categories=self.class_names)
+        path = os.path.join(self.directory, f"part-{self.n_chunks:05d}.{self.file_format}")
+        if self.file_format == "parquet":
+            compression = None if self.compression == "uncompressed" else self.compression
+            data.to_parquet(path, compression=compression, index=False)
+        else:
+            data.to_feather(path, compression=self.compression)
+        self.n_chunks += 1
+        self.n_buffered = 0
+
+    def close(self) -> NoReturn:
+        """
+        Writes the fills still buffered, to be called at the end of the episode
+        """
+        self.flush()
+
+
+def read_tape(directory: str, run: str = "*", episode="*", branch: str = "*") -> pd.DataFrame:
+    """
+    Reads the fills of recorded tapes into one DataFrame
+
+    :param directory: root directory of the tapes
+    :param run: name of the run, "*" for all runs
+    :param episode: episode, "*" for all episodes
+    :param branch: branch of the episode, "*" for all branches
+    :return: fills with run, episode and branch columns, in file order
+    """
+    frames = []
+    pattern = os.path.join(directory, f"run={run}", f"episode={episode}", f"branch={branch}", "part-*")
+    for path in sorted(glob.glob(pattern)):
+        data = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_feather(path)
+        branch_directory = os.path.dirname(path)
+        episode_directory = os.path.dirname(branch_directory)
+        data['run'] = os.path.basename(os.path.dirname(episode_directory)).split("=", 1)[1]
+        data['episode'] = int(os.path.basename(episode_directory).split("=", 1)[1])
+        data['branch'] = os.path.basename(branch_directory).split("=", 1)[1]
+        frames.append(data)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=list(COLUMNS) + ['run', 'episode', 'branch'])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,400 @@
+from typing import NoReturn
+import numpy as np
+from numpy import ndarray
+from codelib.stats import weighted_percentile
+from market_simulation_study.order_book import BatchBookSide, PersistentOrderBook
+from market_simulation_study.market_state import RingBuffer, MarketState
+from market_simulation_study.snapshot import SimulationSnapshot
+
+
+class VectorizedMarketEnvironment:
+    """
+    Batch of independent markets with the same agent populations, advanced in lockstep.
+
+    Agents are given as populations (see market_simulation_study.population) whose quotes are generated for all
+    markets at once. Orders are matched in latency order like the array engine of MarketEnvironment, with one
+    vectorized operation over the markets per queue position. Prices, volumes, positions and cash are kept as
+    arrays with markets on the first axis of per step values and on the second axis of the price history.
+
+    The sequential matching engine instead matches each market on its own with a heap per side of the book, which
+    only visits quoting agents and does not rescan the book for every order. This is the engine for few markets
+    with large populations, e.g. one market with 100k agents. With zero volume fills both engines produce the same
+    fills.
+    """
+
+    def __init__(self,
+                 state: dict,
+                 populations: list,
+                 n_markets: int,
+                 use_last_traded_price=True,
+                 history_capacity: int = None,
+                 zero_volume_fills: bool = True,
+                 matching_engine: str = None):
+        """
+        Constructor
+        :param state: initial market state, shared by all markets, whose market price history may also be given per
+        market with shape (time, markets)
+        :param populations: agent populations, each simulated in every market
+        :param n_markets: number of markets
+        :param use_last_traded_price: if True the market price is the last traded price, else the volume weighted median
+        :param history_capacity: number of market prices and traded volumes kept, None to keep the full history
+        :param zero_volume_fills: if True matching follows the original order book, where priced orders without
+        volume are matched and every crossing resting order is filled, with zero volume once the incoming volume is
+        exhausted. If False only orders with volume are matched and matching stops when the volume is exhausted,
+        which changes the last traded price but not the traded volumes.
+        :param matching_engine: "batch" to match all markets at once, one queue position at a time, or "sequential"
+        to match the markets one after the other on heaps. By default batch with zero volume fills and sequential
+        without, which the batch engine does not support.
+        """
+        if matching_engine is None:
+            matching_engine = "batch" if zero_volume_fills else "sequential"
+        if matching_engine not in ("batch", "sequential"):
+            raise ValueError(f"Unknown matching engine: {matching_engine}")
+        if matching_engine == "batch" and not zero_volume_fills:
+            raise ValueError("zero_volume_fills=False requires the sequential matching engine")
+        self.n_markets = n_markets
+        self.use_last_traded_price = use_last_traded_price
+        self.zero_volume_fills = zero_volume_fills
+        self.matching_engine = matching_engine
+        self.populations = populations
+        self.fee = state["fee"]
+        self.slippage = state["slippage"]
+
+        initial_prices = np.asarray(state["market_prices"], dtype=float)
+        if initial_prices.ndim == 1:
+            initial_prices = initial_prices[:, None]
+        self.market_prices = RingBuffer(np.broadcast_to(initial_prices, (len(initial_prices), n_markets)),
+                                        history_capacity, shape=(n_markets,))
+        self.volume_history = RingBuffer(capacity=history_capacity, shape=(n_markets,))
+
+        offsets = np.cumsum([0] + [population.n_agents for population in populations])
+        self.population_slices = [slice(start, stop) for start, stop in zip(offsets[:-1], offsets[1:])]
+        self.n_agents = offsets[-1]
+        self.agent_ids = np.arange(self.n_agents, dtype=float)
+        for population in populations:
+            population.reset(n_markets)
+        self.positions = np.tile(np.concatenate([population.initial_position for population in populations]),
+                                 (n_markets, 1))
+        self.cash = np.zeros((n_markets, self.n_agents))
+
+        self.buy_book = BatchBookSide(is_buy=True)
+        self.sell_book = BatchBookSide(is_buy=False)
+        self.markets = np.arange(n_markets)
+        self.fills = None
+        self.state = None
+        self.time = 0
+
+    def get_orders(self):
+        """
+        Updates all populations and collects their orders
+
+        :return: buy prices, buy volumes, sell prices, sell volumes and latencies of shape (markets, agents)
+        """
+        prices = self.market_prices.view()
+        quotes = [population.update(prices, self.positions[:, population_slice])
+                  for population, population_slice in zip(self.populations, self.population_slices)]
+        buy_prices, buy_volumes, sell_prices, sell_volumes = (np.concatenate(side, axis=1) for side in zip(*quotes))
+        latencies = np.concatenate([population.latency for population in self.populations], axis=1)
+        return buy_prices, buy_volumes, sell_prices, sell_volumes, latencies
+
+    def calc_order_metrics(self, buy_prices: ndarray, buy_volumes: ndarray, sell_prices: ndarray,
+                           sell_volumes: ndarray) -> NoReturn:
+        """
+        Calculates the volume weighted mean order prices and the total order volumes of every market
+        """
+        buy_quoted, sell_quoted = ~np.isnan(buy_prices), ~np.isnan(sell_prices)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.mean_buy_price = (np.sum(np.where(buy_quoted, buy_prices * buy_volumes, 0), axis=1)
+                                   / np.sum(np.where(buy_quoted, buy_volumes, 0), axis=1))
+            self.mean_sell_price = (np.sum(np.where(sell_quoted, sell_prices * sell_volumes, 0), axis=1)
+                                    / np.sum(np.where(sell_quoted, sell_volumes, 0), axis=1))
+        self.total_buy_volume = np.sum(buy_volumes, axis=1)
+        self.total_sell_volume = np.sum(sell_volumes, axis=1)
+
+    def match(self) -> NoReturn:
+        """
+        Matches the orders of every market in latency order, with match_batch or match_sequential
+        """
+        buy_prices, buy_volumes, sell_prices, sell_volumes, latencies = self.get_orders()
+        self.calc_order_metrics(buy_prices, buy_volumes, sell_prices, sell_volumes)
+        queue = np.lexsort((np.broadcast_to(self.agent_ids, latencies.shape), latencies), axis=-1)
+        if self.matching_engine == "batch":
+            self.fills = self.match_batch(buy_prices, buy_volumes, sell_prices, sell_volumes, latencies, queue)
+        else:
+            self.fills = self.match_sequential(buy_prices, buy_volumes, sell_prices, sell_volumes, latencies, queue)
+        self.settle_trades(*self.fills)
+        self.update_prices(*self.fills[:3])
+
+    def match_batch(self, buy_prices: ndarray, buy_volumes: ndarray, sell_prices: ndarray, sell_volumes: ndarray,
+                    latencies: ndarray, queue: ndarray) -> tuple:
+        """
+        Matches all markets at once, one queue position at a time
+
+        :param queue: agent indices of every market in matching order, shape (markets, agents)
+        :return: markets, prices, volumes, buyers and sellers of the fills
+        """
+        markets = self.markets
+
+        self.buy_book.reset(self.n_markets, self.n_agents)
+        self.sell_book.reset(self.n_markets, self.n_agents)
+        first = queue[:, 0]
+        for book, prices, volumes in ((self.buy_book, buy_prices, buy_volumes),
+                                      (self.sell_book, sell_prices, sell_volumes)):
+            prices = prices[markets, first]
+            book.add_orders(prices, volumes[markets, first], latencies[markets, first], first, ~np.isnan(prices))
+
+        # Orders without volume can only rest as the first order of a side, so after the first check of a side
+        # only markets with fills need to be pruned
+        fill_markets, fill_prices, fill_volumes, buyers, sellers = [], [], [], [], []
+        for position, agents in enumerate(queue[:, 1:].T):
+            latency = latencies[markets, agents]
+
+            # CHECK IF THE AGENTS CAN MAKE A BUY TRADE
+            price, volume = buy_prices[markets, agents], buy_volumes[markets, agents]
+            trade_markets, trade_prices, trade_volumes, counterparties = self.sell_book.match_orders(price, volume)
+            if len(trade_markets) > 0:
+                fill_markets.append(trade_markets)
+                fill_prices.append(trade_prices)
+                fill_volumes.append(trade_volumes)
+                buyers.append(agents[trade_markets])
+                sellers.append(counterparties)
+                volume = volume - np.bincount(trade_markets, weights=trade_volumes, minlength=self.n_markets)
+            self.sell_book.prune_orders(None if position == 0 else np.unique(trade_markets))
+            self.buy_book.add_orders(price, volume, latency, agents, ~np.isnan(price) & (volume > 0))
+
+            # CHECK IF THE AGENTS CAN MAKE A SELL TRADE
+            price, volume = sell_prices[markets, agents], sell_volumes[markets, agents]
+            trade_markets, trade_prices, trade_volumes, counterparties = self.buy_book.match_orders(price, volume)
+            if len(trade_markets) > 0:
+                fill_markets.append(trade_markets)
+                fill_prices.append(trade_prices)
+                fill_volumes.append(trade_volumes)
+                buyers.append(counterparties)
+                sellers.append(agents[trade_markets])
+                volume = volume - np.bincount(trade_markets, weights=trade_volumes, minlength=self.n_markets)
+            self.buy_book.prune_orders(None if position == 0 else np.unique(trade_markets))
+            self.sell_book.add_orders(price, volume, latency, agents, ~np.isnan(price) & (volume > 0))
+
+        if len(fill_markets) > 0:
+            columns = (fill_markets, fill_prices, fill_volumes, buyers, sellers)
+            return tuple(np.concatenate(column) for column in columns)
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, np.zeros(0), np.zeros(0), empty, empty
+
+    def match_sequential(self, buy_prices: ndarray, buy_volumes: ndarray, sell_prices: ndarray,
+                         sell_volumes: ndarray, latencies: ndarray, queue: ndarray) -> tuple:
+        """
+        Matches the markets one after the other on a heap order book, visiting only agents with an order that can
+        trade: a priced order with zero volume fills, an order with volume without. The orders of the first agent in
+        the queue seed the book without being matched, like in the array engine.
+
+        :param queue: agent indices of every market in matching order, shape (markets, agents)
+        :return: markets, prices, volumes, buyers and sellers of the fills
+        """
+        zero_volume_fills = self.zero_volume_fills
+        buy_live = ~np.isnan(buy_prices) & (zero_volume_fills | (buy_volumes > 0))
+        sell_live = ~np.isnan(sell_prices) & (zero_volume_fills | (sell_volumes > 0))
+        fill_markets, fill_prices, fill_volumes, buyers, sellers = [], [], [], [], []
+        for market in self.markets:
+            book = PersistentOrderBook()
+            first = queue[market, 0]
+            # Seed orders without volume only rest until the second agent in the queue has checked them, like
+            # in match_batch, which prunes both sides after the first queue position
+            seed_orders = []
+            if buy_live[market, first]:
+                seed_orders.append(book.add_order(True, buy_prices[market, first], buy_volumes[market, first],
+                                                  latencies[market, first], first))
+            if sell_live[market, first]:
+                seed_orders.append(book.add_order(False, sell_prices[market, first], sell_volumes[market, first],
+                                                  latencies[market, first], first))
+            agents = queue[market, 1:]
+            if len(agents) == 0 or not (buy_live[market, agents[0]] or sell_live[market, agents[0]]):
+                self.prune_seed_orders(book, seed_orders, True)
+                self.prune_seed_orders(book, seed_orders, False)
+                seed_orders = []
+            agents = agents[buy_live[market, agents] | sell_live[market, agents]]
+
+            orders = zip(agents.tolist(), latencies[market, agents].tolist(),
+                         np.where(buy_live[market, agents], buy_prices[market, agents], np.nan).tolist(),
+                         buy_volumes[market, agents].tolist(),
+                         np.where(sell_live[market, agents], sell_prices[market, agents], np.nan).tolist(),
+                         sell_volumes[market, agents].tolist())
+            for agent, latency, buy_price, buy_volume, sell_price, sell_volume in orders:
+                # CHECK IF THE AGENT CAN MAKE A BUY TRADE
+                if buy_price == buy_price:
+                    prices, volumes, counterparties = book.match_order(True, buy_price, buy_volume, 0,
+                                                                       zero_volume_fills=zero_volume_fills)
+                    if prices:
+                        fill_prices.extend(prices)
+                        fill_volumes.extend(volumes)
+                        buyers.extend([agent] * len(prices))
+                        sellers.extend(counterparties)
+                        fill_markets.extend([market] * len(prices))
+                        buy_volume -= sum(volumes)
+                if seed_orders:
+                    self.prune_seed_orders(book, seed_orders, False)
+                if buy_price == buy_price and buy_volume > 0:
+                    book.add_order(True, buy_price, buy_volume, latency, agent)
+
+                # CHECK IF THE AGENT CAN MAKE A SELL TRADE
+                if sell_price == sell_price:
+                    prices, volumes, counterparties = book.match_order(False, sell_price, sell_volume, 0,
+                                                                       zero_volume_fills=zero_volume_fills)
+                    if prices:
+                        fill_prices.extend(prices)
+                        fill_volumes.extend(volumes)
+                        buyers.extend(counterparties)
+                        sellers.extend([agent] * len(prices))
+                        fill_markets.extend([market] * len(prices))
+                        sell_volume -= sum(volumes)
+                if seed_orders:
+                    self.prune_seed_orders(book, seed_orders, True)
+                    seed_orders = []
+                if sell_price == sell_price and sell_volume > 0:
+                    book.add_order(False, sell_price, sell_volume, latency, agent)
+
+        return (np.array(fill_markets, dtype=np.int64), np.array(fill_prices, dtype=float),
+                np.array(fill_volumes, dtype=float), np.array(buyers, dtype=np.int64),
+                np.array(sellers, dtype=np.int64))
+
+    @staticmethod
+    def prune_seed_orders(book: PersistentOrderBook, seed_orders: list, is_buy: bool) -> NoReturn:
+        """
+        Cancels the seed orders of one side which are left without volume
+        """
+        for sequence in seed_orders:
+            order = book.orders.get(sequence)
+            if order is not None and order[0] == is_buy and not order[2] > 0:
+                book.cancel_order(sequence)
+
+    def settle_trades(self, markets: ndarray, prices: ndarray, volumes: ndarray, buyers: ndarray,
+                      sellers: ndarray) -> NoReturn:
+        """
+        Updates the cash and positions of the agents who took part in the fills
+
+        :param markets: market of each fill
+        :param prices: fill prices
+        :param volumes: fill volumes
+        :param buyers: agent indices of the buyers
+        :param sellers: agent indices of the sellers
+        :return: NoReturn
+        """
+        size = self.n_markets * self.n_agents
+        buyers, sellers = markets * self.n_agents + buyers, markets * self.n_agents + sellers
+        values = prices * volumes
+        self.cash += (np.bincount(sellers, weights=values, minlength=size)
+                      - np.bincount(buyers, weights=values, minlength=size)).reshape(self.cash.shape)
+        self.positions += (np.bincount(buyers, weights=volumes, minlength=size)
+                           - np.bincount(sellers, weights=volumes, minlength=size)).reshape(self.positions.shape)
+
+    def update_prices(self, markets: ndarray, prices: ndarray, volumes: ndarray) -> NoReturn:
+        """
+        Updates the market prices and traded volumes of every market from the fills of the current step
+
+        :param markets: market of each fill, fills in the order they were matched
+        :param prices: fill prices
+        :param volumes: fill volumes
+        :return: NoReturn
+        """
+        self.matched_volumes = np.bincount(markets, weights=volumes, minlength=self.n_markets)
+        self.n_trades = np.bincount(markets, weights=volumes > 0, minlength=self.n_markets).astype(int)
+        traded = self.matched_volumes > 0
+        market_prices = self.market_prices[-1].copy()
+
+        if self.use_last_traded_price:
+            last_fill = np.full(self.n_markets, -1)
+            np.maximum.at(last_fill, markets, np.arange(len(markets)))
+            market_prices[traded] = prices[last_fill[traded]]
+        elif traded.any():
+            order = np.argsort(markets, kind="stable")
+            starts = np.searchsorted(markets[order], self.markets)
+            for market_fills, market in zip(np.split(order, starts[1:]), self.markets):
+                if traded[market]:
+                    market_prices[market] = weighted_percentile(prices[market_fills], p=0.5,
+                                                                probs=volumes[market_fills])
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.vwap = np.where(traded, np.bincount(markets, weights=prices * volumes, minlength=self.n_markets)
+                                 / self.matched_volumes, np.nan)
+        self.market_prices.append(market_prices)
+        self.volume_history.append(self.matched_volumes)
+
+    def traded_prices(self) -> dict:
+        """
+        Splits the fill prices of the current step by market
+        """
+        markets, prices = self.fills[:2]
+        order = np.argsort(markets, kind="stable")
+        starts = np.searchsorted(markets[order], self.markets)
+        return {'all_traded_prices': np.split(prices[order], starts[1:])}
+
+    def update_market(self) -> NoReturn:
+        values = {'volume': self.matched_volumes,
+                  'market_prices': self.market_prices,
+                  'volume_history': self.volume_history,
+                  'fee': self.fee,
+                  'mean_buy_price': self.mean_buy_price,
+                  'mean_sell_price': self.mean_sell_price,
+                  'slippage': self.slippage,
+                  'total_buy_volume': self.total_buy_volume,
+                  'total_sell_volume': self.total_sell_volume,
+                  'n_trades': self.n_trades,
+                  'vwap': self.vwap}
+        self.state = MarketState(values, {'all_traded_prices': self.traded_prices})
+
+    def get_market_state(self, market: int) -> dict:
+        """
+        Extracts the state of one market in the format of MarketEnvironment
+
+        :param market: index of the market
+        :return: market state
+        """
+        state = {key: value[market] if isinstance(value, ndarray) else value for key, value in self.state.items()}
+        state['market_prices'] = self.market_prices.view()[:, market]
+        state['volume_history'] = self.volume_history.view()[:, market]
+        state['all_traded_prices'] = self.state['all_traded_prices'][market]
+        return state
+
+    def calculate_profit_and_loss(self) -> ndarray:
+        """
+        Marks all agents in all markets to the last market price, with the slippage adjustment for long and short
+        positions used by the agents' calculate_profit_and_loss
+
+        :return: profit and loss of shape (markets, agents)
+        """
+        slippage = np.where(self.positions < 0, 1 + self.slippage, 1 - self.slippage)
+        return self.cash + self.positions * self.market_prices[-1][:, None] * slippage
+
+    def aggregate_by_class(self, values: ndarray) -> dict:
+        """
+        Sums a quantity given for each agent, like the output of calculate_profit_and_loss, over the agent classes
+
+        :param values: values of shape (markets, agents)
+        :return: sum of the values of each agent class and market, keyed by class name
+        """
+        aggregates = {}
+        for population, population_slice in zip(self.populations, self.population_slices):
+            name = population.agent_class.__name__
+            aggregates[name] = aggregates.get(name, 0) + values[:, population_slice].sum(axis=1)
+        return aggregates
+
+    def snapshot(self, objects: tuple = (), shared: tuple = ()) -> SimulationSnapshot:
+        """
+        Takes a snapshot of all markets and populations, from which branches of the simulation can be forked
+
+        :param objects: other objects of the simulation to copy with the markets
+        :param shared: objects which all branches share instead of copying
+        :return: snapshot, whose fork returns the environment, the populations and the other objects of a branch
+        """
+        return SimulationSnapshot(self, self.populations, objects, shared)
+
+    def step(self) -> MarketState:
+        """
+        Updates the quotes of all agents and matches them in every market
+
+        :return: batch state, with one value per market for every per step quantity
+        """
+        self.match()
+        self.update_market()
+        self.time += 1
+        return self.state
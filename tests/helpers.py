@@ -0,0 +1,77 @@
+import numpy as np
+from market_simulation_study.agent import RandomAgent, InvestorAgent, TrendAgent, MarketMakerAgent
+
+
+def initial_state(seed: int = 0) -> dict:
+    """
+    Initial market state of the simulation studies, with a slightly noisy price history
+    """
+    generator = np.random.default_rng(seed)
+    return {"market_prices": list(100 + generator.normal(scale=0.01, size=100)),
+            "volume": 0,
+            "fee": 0,
+            "mean_buy_price": 99.5,
+            "mean_sell_price": 100.5,
+            "slippage": 0,
+            "all_traded_prices": 0}
+
+
+def build_agents(seed: int = 0, n_random: int = 10, n_trend: int = 3, n_market_makers: int = 10) -> list:
+    """
+    Population of the simulation studies: two investors, random agents, trend followers and market makers
+    """
+    generator = np.random.default_rng(seed)
+    agents = [InvestorAgent(agent_id=0, delta=1, intensity=0.05, buy_price_margin=0.0025, sell_price_margin=0.01,
+                            buy_volume=15, sell_volume=30, n_orders=10),
+              InvestorAgent(agent_id=1, delta=1, intensity=0.01, n_orders=6, buy_price_margin=0.005,
+                            sell_price_margin=0.02, buy_volume=25, sell_volume=50, can_short=True)]
+    agents += [RandomAgent(agent_id=len(agents) + j, delta=1, noise_range=(0.0001, 0.0003), mid_price_noise=0.0025)
+               for j in range(n_random)]
+    agents += [TrendAgent(agent_id=len(agents) + j, delta=1, moving_average_one=int(generator.integers(10, 30)),
+                          moving_average_two=int(generator.integers(50, 100)), price_margin=0.005)
+               for j in range(n_trend)]
+    agents += [MarketMakerAgent(agent_id=len(agents) + j, delta=1, gamma=0.00005, gamma2=int(generator.integers(1, 3)),
+                                spread_zero=0.1, n_volume=3)
+               for j in range(n_market_makers)]
+    return agents
+
+
+def run_steps(environment, agents: list, n_steps: int, state: dict = None) -> tuple:
+    """
+    Steps an environment and updates every agent after each step, like the loops of the notebooks
+
+    :return: agents and the last state
+    """
+    if state is not None:
+        for agent in agents:
+            agent.update(state)
+    for _ in range(n_steps):
+        agents, state = environment.step(agents)
+        for agent in agents:
+            agent.update(state)
+    return agents, state
+
+
+class StepDraws:
+    """
+    Source of random draws returning the same value for every variate of a step, which changes from step to step,
+    so agents and populations drawing in a different order can be compared
+    """
+
+    def __init__(self):
+        self.step = 0
+
+    def fraction(self) -> float:
+        return (0.37 * self.step + 0.1) % 1
+
+    def draw(self, value, size):
+        return value if size is None else np.broadcast_to(value, size).copy()
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        return self.draw(np.asarray(low) + (np.asarray(high) - np.asarray(low)) * self.fraction(), size)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        return self.draw(np.asarray(loc) + np.asarray(scale) * (self.fraction() - 0.5), size)
+
+    def binomial(self, n, p, size=None):
+        return self.draw(np.floor(np.asarray(n) * np.asarray(p) + self.fraction()).astype(int), size)
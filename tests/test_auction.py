@@ -0,0 +1,18 @@
+import numpy as np
+from market_simulation_study.auction import allocate
+
+
+def test_pro_rata_rounds_whole_volumes_to_whole_units():
+    priority = np.array([0.0, 1.0, 1.0, 1.0])
+    volumes = np.array([4.0, 5.0, 3.0, 2.0])
+    indices, allocated = allocate(priority, volumes, np.array([0.1, 0.3, 0.2, 0.4]), executed_volume=9)
+    assert allocated.sum() == 9 and np.all(allocated == np.round(allocated))
+    assert dict(zip(indices.tolist(), allocated.tolist())) == {0: 4.0, 1: 2.0, 2: 2.0, 3: 1.0}
+
+
+def test_pro_rata_shares_fractional_volumes_exactly():
+    priority = np.array([0.0, 1.0, 1.0])
+    volumes = np.array([0.25, 0.5, 0.25])
+    indices, allocated = allocate(priority, volumes, np.array([0.1, 0.2, 0.3]), executed_volume=0.55)
+    assert np.isclose(allocated.sum(), 0.55)
+    assert np.allclose(allocated[np.argsort(indices)], [0.25, 0.2, 0.1])
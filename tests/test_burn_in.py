@@ -0,0 +1,50 @@
+import importlib.util
+import numpy as np
+from helpers import initial_state
+from market_simulation_study import burn_in
+from market_simulation_study.agent import InvestorAgent, RandomAgent, MarketMakerAgent
+from market_simulation_study.burn_in import BurnInCache, configuration_key
+from market_simulation_study.runner import Scenario
+
+
+def load_agent_class(directory, source: str) -> type:
+    directory.mkdir()
+    path = directory / "custom_agents.py"
+    path.write_text(source)
+    spec = importlib.util.spec_from_file_location("custom_agents", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.CustomAgent
+
+
+def test_key_changes_with_the_code_of_an_agent_class(tmp_path, monkeypatch):
+    first = load_agent_class(tmp_path / "a", "class CustomAgent:\n    def act(self):\n        return 1\n")
+    same = load_agent_class(tmp_path / "b", "class CustomAgent:\n    def act(self):\n        return 1\n")
+    changed = load_agent_class(tmp_path / "c", "class CustomAgent:\n    def act(self):\n        return 2\n")
+    key = configuration_key([(first, 10, {})], 7)
+    assert configuration_key([(same, 10, {})], 7) == key
+    assert configuration_key([(changed, 10, {})], 7) != key
+    monkeypatch.setattr(burn_in, "CACHE_VERSION", burn_in.CACHE_VERSION + 1)
+    assert configuration_key([(first, 10, {})], 7) != key
+
+
+def test_burn_in_cache_on_disk_reproduces_the_simulated_warm_up(tmp_path):
+    groups = [(InvestorAgent, 2, dict(delta=1, intensity=0.05, n_orders=10)),
+              (RandomAgent, 10, dict(delta=1, noise_range=(0.0001, 0.0003), mid_price_noise=0.0025)),
+              (MarketMakerAgent, 10, dict(delta=1, gamma=0.00005, gamma2=2, spread_zero=0.1, n_volume=3))]
+
+    def run(burn_in_cache: BurnInCache = None) -> tuple:
+        scenario = Scenario(initial_state(), groups, time_periods=20, warm_up_periods=30,
+                            environment_parameters=dict(matching_engine="array"), burn_in_cache=burn_in_cache)
+        prices, volumes = np.zeros(20), np.zeros(20)
+        scenario.run_episode(5, prices, volumes, np.zeros((20, len(scenario.class_names))))
+        return prices, volumes
+
+    simulated = run()
+    first_session = BurnInCache(str(tmp_path))
+    assert np.array_equal(run(first_session)[0], simulated[0]) and first_session.n_misses == 1
+    later_session = BurnInCache(str(tmp_path))
+    for _ in range(2):
+        prices, volumes = run(later_session)
+        assert np.array_equal(prices, simulated[0]) and np.array_equal(volumes, simulated[1])
+    assert later_session.n_hits == 2 and later_session.n_misses == 0
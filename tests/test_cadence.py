@@ -0,0 +1,97 @@
+import time
+from typing import NoReturn
+import numpy as np
+from helpers import initial_state, build_agents
+from market_simulation_study.agent import InvestorAgent, RandomAgent, MarketMakerAgent
+from market_simulation_study.environment import MarketEnvironment
+from market_simulation_study.random_streams import RandomStreams
+from market_simulation_study.cadence import UpdateScheduler, BernoulliArrival
+from market_simulation_study.burn_in import BurnInCache
+from market_simulation_study.runner import Scenario
+
+
+def start_simulation(seed: int) -> tuple:
+    state = initial_state(seed)
+    agents = build_agents(seed)
+    environment = MarketEnvironment(state, matching_engine="array")
+    RandomStreams(seed).attach(agents, environment)
+    scheduler = UpdateScheduler(agents, {InvestorAgent: BernoulliArrival()})
+    scheduler.update(state)
+    return environment, agents, scheduler
+
+
+def continue_simulation(environment, agents: list, scheduler, n_steps: int) -> np.ndarray:
+    prices = []
+    for _ in range(n_steps):
+        agents, state = environment.step(agents)
+        scheduler.update(state)
+        prices.append(state["market_prices"][-1])
+    return np.array(prices)
+
+
+def test_bernoulli_arrival_continues_from_a_snapshot():
+    environment, agents, scheduler = start_simulation(seed=3)
+    continue_simulation(environment, agents, scheduler, 40)
+    snapshot = environment.snapshot(agents, (scheduler,))
+    uninterrupted = continue_simulation(environment, agents, scheduler, 60)
+
+    branch_environment, branch_agents, branch_scheduler = snapshot.fork()
+    assert np.array_equal(continue_simulation(branch_environment, branch_agents, branch_scheduler, 60), uninterrupted)
+
+
+def test_bernoulli_arrival_survives_the_burn_in_cache():
+    groups = [(InvestorAgent, 2, dict(delta=1, intensity=0.05, n_orders=10)),
+              (RandomAgent, 10, dict(delta=1, noise_range=(0.0001, 0.0003), mid_price_noise=0.0025)),
+              (MarketMakerAgent, 10, dict(delta=1, gamma=0.00005, gamma2=2, spread_zero=0.1, n_volume=3))]
+
+    def run(scenario: Scenario) -> np.ndarray:
+        prices = np.zeros(30)
+        scenario.run_episode(7, prices, np.zeros(30), np.zeros((30, len(scenario.class_names))))
+        return prices
+
+    cadences = {InvestorAgent: BernoulliArrival()}
+    uncached = run(Scenario(initial_state(), groups, 30, warm_up_periods=50, cadences=cadences,
+                            environment_parameters=dict(matching_engine="array")))
+    cached = Scenario(initial_state(), groups, 30, warm_up_periods=50, cadences=cadences,
+                      environment_parameters=dict(matching_engine="array"), burn_in_cache=BurnInCache())
+    assert np.array_equal(run(cached), uncached)  # simulates the burn-in
+    assert np.array_equal(run(cached), uncached)  # forks the cached burn-in
+
+
+class PreparedMarketMaker(MarketMakerAgent):
+    """
+    Market maker computing its volatility in prepare_update, like the policy forward passes of an ActorCriticAgent
+    """
+    concurrent_decision = True
+    prepared = None
+    n_prepared = 0
+
+    def prepare_update(self, state: dict) -> NoReturn:
+        time.sleep(0.001 * (self.agent_id % 3))  # preparations finish out of order
+        self.prepared = (state, super().calculate_volatility(state))
+
+    def calculate_volatility(self, state: dict, n_observations=10) -> float:
+        if self.prepared is not None and self.prepared[0] is state:
+            self.n_prepared += 1
+            return self.prepared[1]
+        return super().calculate_volatility(state, n_observations)
+
+
+def test_decision_threads_leave_the_simulation_unchanged():
+    groups = [(InvestorAgent, 2, dict(delta=1, intensity=0.05, n_orders=10)),
+              (RandomAgent, 10, dict(delta=1, noise_range=(0.0001, 0.0003), mid_price_noise=0.0025)),
+              (PreparedMarketMaker, 10, dict(delta=1, gamma=0.00005, gamma2=2, spread_zero=0.1, n_volume=3))]
+
+    def run(decision_threads: int) -> tuple:
+        scenario = Scenario(initial_state(), groups, 0, warm_up_periods=40, decision_threads=decision_threads,
+                            environment_parameters=dict(matching_engine="array"))
+        environment, agents, scheduler = scenario.simulate_burn_in(seed=11)
+        n_prepared = sum(agent.n_prepared for agent in agents if isinstance(agent, PreparedMarketMaker))
+        return environment.market_prices.view(), [agent.position for agent in agents], n_prepared
+
+    prices, positions, n_prepared = run(None)
+    threaded_prices, threaded_positions, threaded_n_prepared = run(4)
+    assert n_prepared == 0 and threaded_n_prepared > 0
+    assert np.any(positions)
+    assert np.array_equal(threaded_prices, prices)
+    assert threaded_positions == positions
@@ -0,0 +1,24 @@
+import numpy as np
+from helpers import initial_state, build_agents, run_steps
+from market_simulation_study.checkpoint import Checkpointer
+from market_simulation_study.environment import MarketEnvironment
+
+
+def continue_run(environment, agents: list, n_steps: int) -> list:
+    _, state = run_steps(environment, agents, n_steps)
+    return state["market_prices"][-n_steps:].tolist()
+
+
+def test_restored_checkpoint_continues_the_run(tmp_path):
+    np.random.seed(8)
+    environment = MarketEnvironment(initial_state(), matching_engine="persistent", history_capacity=50)
+    agents, _ = run_steps(environment, build_agents(), 25)
+    checkpointer = Checkpointer(str(tmp_path), interval=25)
+    assert checkpointer.maybe_save(25, environment, agents, counters={'episode': 3})
+    uninterrupted = continue_run(environment, agents, 40)
+    checkpointer.close()
+
+    np.random.seed(0)
+    checkpoint = Checkpointer(str(tmp_path)).restore()
+    assert checkpoint['step'] == 25 and checkpoint['counters'] == {'episode': 3}
+    assert continue_run(checkpoint['environment'], checkpoint['agents'], 40) == uninterrupted
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+from helpers import initial_state, build_agents, run_steps
+from market_simulation_study.agent import RandomAgent
+from market_simulation_study.environment import MarketEnvironment
+
+
+def simulate(n_steps: int = 30, seed: int = 4, **parameters) -> tuple:
+    np.random.seed(seed)
+    environment = MarketEnvironment(initial_state(seed), **parameters)
+    agents, state = run_steps(environment, build_agents(seed), n_steps)
+    return environment, agents, state
+
+
+def ledger_rows(environment) -> np.ndarray:
+    ledger = environment.ledger
+    return np.column_stack((ledger.step.view(), ledger.price.view(), ledger.volume.view(), ledger.buyer.view(),
+                            ledger.seller.view(), ledger.buyer_is_aggressor.view()))
+
+
+@pytest.mark.parametrize("seed", [0, 4])
+def test_array_engine_reproduces_the_dataframe_engine(seed):
+    dataframe_environment, dataframe_agents, dataframe_state = simulate(seed=seed, matching_engine="dataframe")
+    array_environment, array_agents, array_state = simulate(seed=seed, matching_engine="array")
+
+    assert np.array_equal(dataframe_state["market_prices"], array_state["market_prices"])
+    assert np.array_equal(ledger_rows(dataframe_environment), ledger_rows(array_environment))
+    for dataframe_agent, array_agent in zip(dataframe_agents, array_agents):
+        assert dataframe_agent.position == array_agent.position
+        assert np.array_equal(dataframe_agent.all_trades, array_agent.all_trades)
+
+
+@pytest.mark.parametrize("matching_engine", ["dataframe", "array", "auction", "persistent"])
+def test_ledger_profit_and_loss_matches_the_trade_history(matching_engine):
+    environment, agents, state = simulate(matching_engine=matching_engine)
+    price, slippage = state["market_prices"][-1], state["slippage"]
+    for agent in agents:
+        trades = agent.all_trades
+        assert agent.position == pytest.approx(-trades[:, 1].sum())
+        # Profit and loss as computed from the DataFrame engine's trade history before the ledger
+        realized_value = np.sum(trades[:, 0] * trades[:, 1])
+        unrealized_value = agent.position * price * (1 + slippage if agent.position < 0 else 1 - slippage)
+        agent.calculate_profit_and_loss(state)
+        assert agent.pnl == pytest.approx(realized_value + unrealized_value, abs=1e-8)
+
+
+@pytest.mark.parametrize("matching_engine", ["array", "persistent"])
+def test_vectorized_profit_and_loss_matches_the_agents(matching_engine):
+    environment, agents, state = simulate(matching_engine=matching_engine)
+    pnl = environment.calculate_profit_and_loss()
+    for agent, agent_pnl in zip(agents, pnl):
+        agent.calculate_profit_and_loss(state)
+        assert agent_pnl == pytest.approx(agent.pnl, abs=1e-8)
+    by_class = environment.aggregate_by_class(pnl)
+    for agent_class in {type(agent) for agent in agents}:
+        expected = sum(agent.pnl for agent in agents if type(agent) is agent_class)
+        assert by_class[agent_class.__name__] == pytest.approx(expected, abs=1e-8)
+
+
+class FullMatchEnvironment(MarketEnvironment):
+    """
+    Environment running its matching engine also in steps without crossing orders
+    """
+
+    def orders_cross(self) -> bool:
+        return True
+
+
+@pytest.mark.parametrize("matching_engine", ["dataframe", "array"])
+def test_steps_without_crossing_orders_skip_the_matching_engine(matching_engine):
+    runs = []
+    for environment_class in (MarketEnvironment, FullMatchEnvironment):
+        np.random.seed(4)
+        environment = environment_class(initial_state(4), matching_engine=matching_engine)
+        # Without random agents the quotes often do not cross. Agents quote before the first step, as the DataFrame
+        # engine cannot match the orders of agents which never quoted.
+        runs.append((environment,) + run_steps(environment, build_agents(4, n_random=0), 60, initial_state(4)))
+    (environment, agents, state), (full_environment, full_agents, full_state) = runs
+    assert environment.n_short_circuited_steps > 0 and full_environment.n_short_circuited_steps == 0
+    assert np.array_equal(state["market_prices"], full_state["market_prices"])
+    assert np.array_equal(environment.volume_history.view(), full_environment.volume_history.view())
+    assert np.array_equal(ledger_rows(environment), ledger_rows(full_environment))
+    assert [agent.position for agent in agents] == [agent.position for agent in full_agents]
+
+
+@pytest.mark.parametrize("matching_engine", ["dataframe", "array"])
+def test_step_without_crossing_orders_publishes_the_matched_state(matching_engine):
+    states, environments = [], []
+    for environment_class in (MarketEnvironment, FullMatchEnvironment):
+        environment = environment_class(initial_state(), matching_engine=matching_engine)
+        agents = [RandomAgent(agent_id=j, delta=1) for j in range(4)]
+        for agent, buy_price, sell_price in zip(agents, [99.0, 99.5, np.nan, 98.0], [101.0, np.nan, 100.5, 102.0]):
+            agent.buy_price, agent.sell_price, agent.buy_volume, agent.sell_volume = buy_price, sell_price, 2, 3
+            agent.latency = 1 + agent.agent_id / 10
+            agent.submit_orders()
+        agents, state = environment.step(agents)
+        states.append(state)
+        environments.append(environment)
+    assert [environment.n_short_circuited_steps for environment in environments] == [1, 0]
+
+    short_circuited, matched = states
+    for key in ("volume", "mean_buy_price", "mean_sell_price", "total_buy_volume", "total_sell_volume",
+                "n_buy_quotes", "n_sell_quotes", "order_imbalance", "n_trades", "vwap"):
+        np.testing.assert_equal(short_circuited[key], matched[key])
+    assert np.array_equal(short_circuited["market_prices"], matched["market_prices"])
+    assert len(short_circuited["all_traded_prices"]) == len(matched["all_traded_prices"]) == 0
+
+
+def test_order_metrics_match_the_dataframe_computation():
+    buy_prices = np.array([99.0, np.nan, 99.5, 98.0, 97.0, np.nan])
+    buy_volumes = np.array([2.0, 5.0, 0.0, 3.0, 1.0, 0.0])
+    sell_prices = np.array([101.0, 100.5, np.nan, 102.0, np.nan, 100.8])
+    sell_volumes = np.array([1.0, 4.0, 2.0, 0.0, 0.0, 3.0])
+    environment = MarketEnvironment(initial_state())
+    latencies, agent_ids = np.ones(6), np.arange(6.0)
+    environment.buy_orders = np.column_stack((buy_prices, buy_volumes, latencies, agent_ids))
+    environment.sell_orders = np.column_stack((sell_prices, sell_volumes, latencies, agent_ids))
+    environment.calc_order_metrics()
+
+    # Metrics as computed from the agents' orders before the order arrays
+    mean_buy_price = np.ma.average(np.ma.MaskedArray(buy_prices, mask=np.isnan(buy_prices)), weights=buy_volumes)
+    mean_sell_price = np.ma.average(np.ma.MaskedArray(sell_prices, mask=np.isnan(sell_prices)), weights=sell_volumes)
+    assert environment.mean_buy_price == pytest.approx(mean_buy_price)
+    assert environment.mean_sell_price == pytest.approx(mean_sell_price)
+    assert environment.total_buy_volume == sum(buy_volumes) == 11
+    assert environment.total_sell_volume == sum(sell_volumes) == 10
+    assert (environment.n_buy_quotes, environment.n_sell_quotes) == (3, 3)
+    assert environment.order_imbalance == pytest.approx((6 - 8) / 14)
+
+    # A side without priced volume has a nan mean price instead of a masked constant
+    environment.buy_orders[:, 0] = np.nan
+    environment.calc_order_metrics()
+    assert np.isnan(environment.mean_buy_price) and environment.n_buy_quotes == 0
+    assert environment.order_imbalance == -1
@@ -0,0 +1,69 @@
+import asyncio
+import numpy as np
+from helpers import initial_state, build_agents
+from market_simulation_study.agent import InvestorAgent, MarketMakerAgent
+from market_simulation_study.environment import MarketEnvironment
+from market_simulation_study.event_simulator import EventDrivenSimulator, WAKE_UP, REQUOTE
+
+
+def start_simulator(seed: int = 0, **parameters) -> EventDrivenSimulator:
+    np.random.seed(seed)
+    environment = MarketEnvironment(initial_state(seed), matching_engine="persistent", **parameters)
+    return EventDrivenSimulator(environment, build_agents(seed))
+
+
+def test_idle_investor_sleeps_until_its_arrival():
+    investor = InvestorAgent(agent_id=0, delta=1, intensity=0.0, n_orders=3)
+    investor.update(initial_state())
+    assert investor.next_wake_up(5.0) is None
+
+    investor.intensity = 0.2
+    arrival = investor.next_wake_up(5.0)
+    assert arrival >= 6.0 and float(arrival).is_integer()
+    investor.wake_up(initial_state())
+    assert investor.is_busy() and investor.next_arrival is None
+    assert investor.next_wake_up(arrival) == arrival + 1
+
+
+def test_market_makers_requote_after_their_fills():
+    simulator = start_simulator()
+    kinds = []
+    while simulator.events[0][0] <= 50:
+        kinds.append(simulator.process_next_event())
+    n_skipped_wake_ups = len(simulator.agents) * 51 - kinds.count(WAKE_UP)
+    assert kinds.count(REQUOTE) > 0 and not simulator.requote_pending.any()
+    assert n_skipped_wake_ups > 50  # idle investors skip most wake-ups
+
+
+def test_scheduler_draws_the_latencies_of_updating_agents():
+    simulator = start_simulator(draw_latencies=True)
+    assert all(agent.latency_scheduled for agent in simulator.agents)
+    latencies = []
+    for until in (10, 20):
+        simulator.run(until)
+        latencies.append([agent.latency for agent in simulator.agents])
+    market_makers = [index for index, agent in enumerate(simulator.agents) if isinstance(agent, MarketMakerAgent)]
+    for index in market_makers:
+        assert latencies[0][index] != latencies[1][index]
+        assert 0.5 <= latencies[1][index] < 1
+
+
+def test_strategies_advance_with_simulated_time():
+    simulator = start_simulator()
+    seen = []
+
+    async def strategy(name: str, interval: float):
+        for _ in range(5):
+            state = await simulator.sleep_until(simulator.time + interval)
+            await asyncio.sleep(0)
+            seen.append((name, simulator.time, state["market_prices"][-1]))
+
+    async def run():
+        simulator.add_strategy(strategy("fast", 1.5))
+        simulator.add_strategy(strategy("slow", 4.0))
+        return await simulator.run_async(30)
+
+    asyncio.run(run())
+    assert [time for name, time, _ in seen if name == "fast"] == [1.5, 3.0, 4.5, 6.0, 7.5]
+    assert [time for name, time, _ in seen if name == "slow"] == [4.0, 8.0, 12.0, 16.0, 20.0]
+    assert simulator.time == 30
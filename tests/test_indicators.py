@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+import pytest
+from market_simulation_study.indicators import IndicatorEngine
+from market_simulation_study.market_state import RingBuffer
+
+
+@pytest.mark.parametrize("capacity, refresh_interval", [(None, 1000), (60, 1000), (60, 7)])
+def test_rolling_statistics_match_pandas(capacity, refresh_interval):
+    generator = np.random.default_rng(3)
+    prices = list(100 + np.cumsum(generator.normal(size=30)))
+    engine = IndicatorEngine(RingBuffer(prices, capacity), refresh_interval)
+    windows = [1, 5, 20]
+    for step in range(400):
+        if step == 50:
+            windows += [10, 45, 200]  # windows registered later, one longer than a bounded history
+        history = pd.Series(engine.prices.tolist())
+        for window in windows:
+            expected = history.iloc[-window:]
+            assert engine.mean(window) == pytest.approx(expected.mean(), rel=1e-10)
+            assert engine.std(window) == pytest.approx(expected.std(ddof=0), rel=1e-6, abs=1e-9)
+        price = prices[-1] * np.exp(generator.normal(scale=0.01))
+        prices.append(price)
+        engine.append(price)
+
+    rolling = pd.Series(prices).rolling(20)
+    assert engine.mean(20) == pytest.approx(rolling.mean().iloc[-1], rel=1e-10)
+    assert engine.std(20) == pytest.approx(rolling.std(ddof=0).iloc[-1], rel=1e-6)
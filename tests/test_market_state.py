@@ -0,0 +1,38 @@
+import copy
+
+import numpy as np
+
+from market_simulation_study.market_state import RingBuffer
+
+
+def test_slices_are_not_changed_by_later_appends():
+    for capacity in (3, None):
+        history = RingBuffer([1, 2, 3], capacity=capacity)
+        window = history[:]
+        row = history[-1:]
+        for value in range(9, 30):
+            history.append(value)
+        assert window.tolist() == [1, 2, 3]
+        assert row.tolist() == [3]
+        assert history[-3:].tolist() == [27, 28, 29]
+
+
+def test_bounded_buffer_keeps_the_last_values():
+    history = RingBuffer(range(10), capacity=4, shape=())
+    assert history.tolist() == [6, 7, 8, 9]
+    for value in range(10, 25):
+        history.append(value)
+        assert history.tolist() == list(range(value - 3, value + 1))
+    single = RingBuffer([1.0], capacity=1)
+    single.append(2.0)
+    assert single.tolist() == [2.0]
+
+
+def test_deep_copies_append_independently():
+    history = RingBuffer(np.arange(6.0).reshape(3, 2), capacity=5, shape=(2,))
+    branch = copy.deepcopy(history)
+    history.append([10.0, 11.0])
+    branch.append([20.0, 21.0])
+    assert history[-1].tolist() == [10.0, 11.0]
+    assert branch[-1].tolist() == [20.0, 21.0]
+    assert history[:-1].tolist() == branch[:-1].tolist()
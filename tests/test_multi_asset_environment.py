@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from helpers import StepDraws, initial_state
+from market_simulation_study.multi_asset_environment import MultiAssetMarketEnvironment
+from market_simulation_study.population import (RandomPopulation, MarketMakerPopulation,
+                                                CrossAssetMarketMakerPopulation)
+
+HEDGE_RATIOS = np.array([[1.0, 0.5, 0.0], [0.5, 1.0, 0.25], [0.0, 0.25, 1.0]])
+
+
+def build_environment(seed: int = 0, requote_threshold: float = None) -> MultiAssetMarketEnvironment:
+    np.random.seed(seed)
+    state = initial_state(seed)
+    state["market_prices"] = np.column_stack([state["market_prices"], 50 + np.arange(100) * 0.001,
+                                              np.full(100, 20.0)])
+    populations = [RandomPopulation(20, noise_range=(0.0001, 0.0003), mid_price_noise=0.0025),
+                   CrossAssetMarketMakerPopulation(8, HEDGE_RATIOS, gamma=0.00005, spread_zero=0.05,
+                                                   requote_threshold=requote_threshold)]
+    return MultiAssetMarketEnvironment(state, populations, asset_names=["A", "B", "C"])
+
+
+@pytest.mark.parametrize("requote_threshold", [None, 0.01])
+def test_agents_have_one_latency_for_all_instruments(requote_threshold):
+    environment = build_environment(requote_threshold=requote_threshold)
+    for _ in range(20):
+        environment.step()
+        for population in environment.populations:
+            assert np.all(population.latency == population.latency[0])
+            assert len(np.unique(population.latency[0])) == population.n_agents
+    assert environment.positions.any()
+
+
+def test_trades_conserve_positions_and_cash():
+    environment = build_environment(seed=1)
+    for _ in range(30):
+        environment.step()
+    assert environment.positions.any()
+    np.testing.assert_allclose(environment.positions.sum(axis=1), 0, atol=1e-9)
+    np.testing.assert_allclose(environment.cash.sum(axis=1), 0, atol=1e-6)
+    np.testing.assert_allclose(environment.portfolio_profit_and_loss(),
+                               environment.calculate_profit_and_loss().sum(axis=0))
+    np.testing.assert_allclose(environment.exposures(), environment.positions * environment.market_prices[-1][:, None])
+
+    asset_state = environment.get_asset_state("B")
+    assert asset_state["volume"] == environment.get_market_state(1)["volume"]
+    np.testing.assert_array_equal(asset_state["market_prices"], environment.market_prices.view()[:, 1])
+    assert environment.state["asset_names"] == ["A", "B", "C"]
+
+
+def test_cross_asset_market_maker_quotes_against_the_hedged_inventory():
+    prices = 100 * np.exp(np.cumsum(np.random.default_rng(3).normal(scale=0.002, size=(30, 3)), axis=0))
+    positions = np.array([[4.0, -2.0], [0.0, 6.0], [-3.0, 1.0]])
+    cross_asset = CrossAssetMarketMakerPopulation(2, HEDGE_RATIOS, gamma=0.001, spread_zero=0.05)
+    per_asset = MarketMakerPopulation(2, gamma=0.001, spread_zero=0.05)
+    for population in (cross_asset, per_asset):
+        population.random = StepDraws()
+        population.reset(3)
+
+    cross_asset_quotes = cross_asset.update(prices, positions)
+    per_asset_quotes = per_asset.update(prices, HEDGE_RATIOS @ positions)
+    for cross_asset_side, per_asset_side in zip(cross_asset_quotes, per_asset_quotes):
+        np.testing.assert_allclose(cross_asset_side, per_asset_side)
+    # The first agent is long in B through its hedge with A, so it quotes B lower than without positions
+    flat = CrossAssetMarketMakerPopulation(2, HEDGE_RATIOS, gamma=0.001, spread_zero=0.05)
+    flat.random = StepDraws()
+    flat.reset(3)
+    flat_buy_prices = flat.update(prices, np.zeros((3, 2)))[0]
+    assert cross_asset_quotes[0][1, 0] < flat_buy_prices[1, 0]
+    np.testing.assert_allclose(cross_asset_quotes[0][2] - flat_buy_prices[2],
+                               -prices[-1, 2] * 0.001 * (HEDGE_RATIOS @ positions)[2])
+
+
+def test_instrument_shapes_are_checked():
+    state = initial_state()
+    state["market_prices"] = np.ones((10, 2))
+    with pytest.raises(ValueError):
+        MultiAssetMarketEnvironment(state, [RandomPopulation(2)], asset_names=["A", "B", "C"])
+    with pytest.raises(ValueError):
+        MultiAssetMarketEnvironment(initial_state(), [CrossAssetMarketMakerPopulation(2, np.eye(2))],
+                                    asset_names=["A", "B", "C"])
@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+from helpers import initial_state, build_agents, run_steps
+from market_simulation_study.agent import MarketMakerAgent
+from market_simulation_study.environment import MarketEnvironment
+from market_simulation_study.order_book import PersistentOrderBook, PriceLadder
+
+
+def test_persistent_book_compacts_cancelled_orders():
+    book = PersistentOrderBook()
+    generator = np.random.default_rng(0)
+    resting = {slot: book.add_order(True, 100 - slot * 0.01, 1, 0, slot) for slot in range(20)}
+    for _ in range(2000):
+        slot = int(generator.integers(20))
+        book.cancel_order(resting[slot])
+        resting[slot] = book.add_order(True, 100 - generator.uniform(0, 1), 1, 0, slot)
+        assert len(book.buy_heap) <= book.compaction_factor * len(book) + book.compaction_minimum + 1
+
+    best_price = max(book.orders[sequence][1] for sequence in resting.values())
+    prices, volumes, slots = book.match_order(False, 0, 1, time=0)
+    assert prices == [best_price] and volumes == [1]
+
+
+class ReferenceBook:
+    """
+    Order book keeping a plain list of orders, matched by sorting the crossing orders
+    """
+
+    def __init__(self):
+        self.orders = {}  # sequence -> [is_buy, price, volume, latency, slot, expiry]
+
+    def match_order(self, is_buy: bool, price: float, volume: float, time: int) -> tuple:
+        crossing = [(-order[1] if order[0] else order[1], order[3], sequence)
+                    for sequence, order in self.orders.items()
+                    if order[0] != is_buy and order[5] > time and (order[1] <= price if is_buy else order[1] >= price)]
+        prices, volumes, slots = [], [], []
+        for _, _, sequence in sorted(crossing):
+            if volume <= 0:
+                break
+            order = self.orders[sequence]
+            trade_volume = min(volume, order[2])
+            volume -= trade_volume
+            order[2] -= trade_volume
+            prices.append(order[1])
+            volumes.append(trade_volume)
+            slots.append(order[4])
+            if order[2] <= 0:
+                del self.orders[sequence]
+        return prices, volumes, slots
+
+
+def test_persistent_book_matches_a_reference_book():
+    book, reference = PersistentOrderBook(), ReferenceBook()
+    generator = np.random.default_rng(2)
+    resting = []
+    for time in range(300):
+        for _ in range(int(generator.integers(1, 6))):
+            is_buy = bool(generator.integers(2))
+            price = round(100 + generator.normal(scale=0.5), 2)
+            volume = float(generator.integers(1, 10))
+            latency = generator.uniform()
+            prices, volumes, slots = book.match_order(is_buy, price, volume, time)
+            assert (prices, volumes, slots) == reference.match_order(is_buy, price, volume, time)
+            volume -= sum(volumes)
+            if volume > 0:
+                slot, expiry = int(generator.integers(50)), time + int(generator.integers(1, 20))
+                sequence = book.add_order(is_buy, price, volume, latency, slot, expiry)
+                reference.orders[sequence] = [is_buy, price, volume, latency, slot, expiry]
+                resting.append(sequence)
+        if resting and generator.uniform() < 0.5:
+            sequence = resting.pop(int(generator.integers(len(resting))))
+            book.cancel_order(sequence)
+            reference.orders.pop(sequence, None)
+
+    live = {sequence: order for sequence, order in reference.orders.items() if order[5] > 300}
+    buy_prices, buy_volumes, sell_prices, sell_volumes = book.resting_orders(300)
+    assert sorted(buy_prices) == sorted(order[1] for order in live.values() if order[0])
+    assert sum(sell_volumes) == sum(order[2] for order in live.values() if not order[0])
+
+
+def test_persistent_engine_heaps_stay_bounded():
+    np.random.seed(0)
+    state = initial_state()
+    environment = MarketEnvironment(state, matching_engine="persistent")
+    run_steps(environment, build_agents(n_random=20, n_market_makers=20), 250, state)
+    book = environment.persistent_book
+    for heap in (book.buy_heap, book.sell_heap):
+        assert len(heap) <= book.compaction_factor * len(book) + book.compaction_minimum
+
+
+def test_market_maker_keeps_its_orders_and_latency_between_requotes():
+    np.random.seed(1)
+    state = initial_state()
+    agents = build_agents(n_market_makers=0)
+    agents += [MarketMakerAgent(agent_id=len(agents) + j, delta=1, gamma=0.00005, gamma2=2, spread_zero=0.1,
+                                n_volume=3, requote_threshold=0.05) for j in range(10)]
+    market_makers = agents[-10:]
+    environment = MarketEnvironment(state, matching_engine="persistent")
+    agents, state = run_steps(environment, agents, 1, state)
+
+    n_kept = 0
+    for _ in range(100):
+        quotes = [(agent.buy_price, agent.latency, agent.position) for agent in market_makers]
+        agents, state = run_steps(environment, agents, 1)
+        for agent, (buy_price, latency, position) in zip(market_makers, quotes):
+            assert agent.buy_record.latency == agent.latency
+            assert agent.quoted_position == agent.position
+            if agent.buy_price == buy_price:
+                n_kept += 1
+                assert agent.latency == latency and agent.position == position
+    assert n_kept > 0
+
+
+def test_price_ladder_keeps_the_levels_near_the_best_prices():
+    ladder = PriceLadder(tick_size=0.01, n_levels=3)
+    generator = np.random.default_rng(1)
+    buy_ticks = np.concatenate((generator.integers(9900, 9990, 200), [1]))  # with a stale quote far away
+    sell_ticks = np.concatenate((generator.integers(10010, 10100, 200), [10 ** 7]))
+    buy_volumes, sell_volumes = generator.uniform(1, 5, 201), generator.uniform(1, 5, 201)
+    ladder.update(buy_ticks * 0.01, buy_volumes, sell_ticks * 0.01, sell_volumes)
+
+    assert len(ladder.bid_levels) < 100 and len(ladder.ask_levels) < 100
+    bid_prices, bid_volumes, ask_prices, ask_volumes = ladder.depth()
+    best_bids = np.unique(buy_ticks)[::-1][:3]
+    best_asks = np.unique(sell_ticks)[:3]
+    assert np.allclose(bid_prices, best_bids * 0.01) and np.allclose(ask_prices, best_asks * 0.01)
+    assert np.allclose(bid_volumes, [buy_volumes[buy_ticks == tick].sum() for tick in best_bids])
+    assert np.allclose(ask_volumes, [sell_volumes[sell_ticks == tick].sum() for tick in best_asks])
+    assert ladder.best_bid == pytest.approx(buy_ticks.max() * 0.01)
+    assert ladder.cumulative_ask_depth(best_asks[1] * 0.01) == pytest.approx(ask_volumes[:2].sum())
+
+
+def test_tick_size_is_rejected_only_by_the_dataframe_engine():
+    with pytest.raises(ValueError, match="other than dataframe"):
+        MarketEnvironment(initial_state(), matching_engine="dataframe", tick_size=0.01)
+    MarketEnvironment(initial_state(), matching_engine="persistent", tick_size=0.01)
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from helpers import StepDraws
+from market_simulation_study.agent import RandomAgent, InvestorAgent, TrendAgent, MarketMakerAgent
+from market_simulation_study.population import (RandomPopulation, InvestorPopulation, TrendPopulation,
+                                                MarketMakerPopulation)
+
+
+def price_path(n_steps: int, seed: int = 0) -> np.ndarray:
+    generator = np.random.default_rng(seed)
+    return 100 * np.exp(np.cumsum(generator.normal(scale=0.002, size=n_steps)))
+
+
+def compare_with_agents(population, agents: list, prices: np.ndarray, positions: np.ndarray, n_history: int):
+    """
+    Steps a population in one market and the equivalent agents through a price path and asserts that they quote
+    the same, positions given per step and agent
+    """
+    draws = StepDraws()
+    population.random = draws
+    population.reset(1)
+    for agent in agents:
+        agent.random = draws
+    for step in range(n_history, len(prices)):
+        draws.step = step
+        history = prices[:step + 1]
+        buy_prices, buy_volumes, sell_prices, sell_volumes = population.update(history[:, None], positions[step][None])
+        for index, agent in enumerate(agents):
+            agent.position = positions[step][index]
+            agent.update({"market_prices": history})
+            assert population.latency[0, index] == agent.latency
+            np.testing.assert_equal([buy_prices[0, index], sell_prices[0, index]], [agent.buy_price, agent.sell_price])
+            np.testing.assert_equal([buy_volumes[0, index], sell_volumes[0, index]],
+                                    [agent.buy_volume, agent.sell_volume])
+
+
+def test_market_maker_population_follows_the_agents():
+    gamma2, thresholds = np.array([1.0, 2.0, 1.0, 2.0]), [None, 0.05, 0.05, 0.3]
+    prices = price_path(80)
+    positions = np.zeros((80, 4))
+    positions[40:, 1:3] = 3  # fills change the position of two agents
+    for threshold in thresholds:
+        population = MarketMakerPopulation(4, delta=1, gamma=0.0005, gamma2=gamma2, spread_zero=0.1,
+                                           requote_threshold=threshold)
+        agents = [MarketMakerAgent(agent_id=j, delta=1, gamma=0.0005, gamma2=gamma2[j], spread_zero=0.1,
+                                   requote_threshold=threshold) for j in range(4)]
+        compare_with_agents(population, agents, prices, positions, n_history=10)
+
+
+def test_random_population_follows_the_agents():
+    noise_low, coin_bias = np.array([0.001, 0.002, 0.003]), np.array([0.3, 0.5, 0.9])
+    population = RandomPopulation(3, delta=1, noise_range=(noise_low, 0.005), mid_price_noise=0.002, n_coin_flips=4,
+                                  coin_bias_buy=coin_bias, coin_bias_sell=0.5)
+    agents = [RandomAgent(agent_id=j, delta=1, noise_range=(noise_low[j], 0.005), mid_price_noise=0.002,
+                          n_coin_flips=4, coin_bias_buy=coin_bias[j], coin_bias_sell=0.5) for j in range(3)]
+    compare_with_agents(population, agents, price_path(40), np.zeros((40, 3)), n_history=1)
+
+
+def test_investor_population_follows_the_agents():
+    intensity, can_short = np.array([0.3, 0.6, 0.9]), np.array([False, True, True])
+    population = InvestorPopulation(3, delta=1, intensity=intensity, n_orders=4, can_short=can_short)
+    agents = [InvestorAgent(agent_id=j, delta=1, intensity=intensity[j], n_orders=4, can_short=bool(can_short[j]))
+              for j in range(3)]
+    positions = np.zeros((60, 3))
+    positions[30:, 0] = 50  # enough to start selling without shorting
+    compare_with_agents(population, agents, price_path(60), positions, n_history=1)
+
+
+def test_trend_population_follows_the_agents():
+    window_one, window_two = np.array([5, 10, 5, 20]), np.array([20, 30, 40, 30])
+    population = TrendPopulation(4, delta=1, price_margin=0.005, moving_average_one=window_one,
+                                 moving_average_two=window_two)
+    assert population.windows.tolist() == [5, 10, 20, 30, 40]
+    agents = [TrendAgent(agent_id=j, delta=1, price_margin=0.005, moving_average_one=int(window_one[j]),
+                         moving_average_two=int(window_two[j])) for j in range(4)]
+    prices = np.concatenate((price_path(60, seed=1), price_path(60, seed=2)[::-1]))
+    positions = np.zeros((120, 4))
+    positions[50:, :2] = [6, -6]  # beyond the target position on either side
+    compare_with_agents(population, agents, prices, positions, n_history=40)
+
+
+def test_correlated_mid_price_noise():
+    correlation = np.array([[1.0, 0.8, 0.0], [0.8, 1.0, -0.5], [0.0, -0.5, 1.0]])
+    population = RandomPopulation(20000, mid_price_noise=0.01, mid_price_correlation=correlation)
+    population.random = np.random.default_rng(5)
+    population.reset(3)
+    noises = population.mid_price_noises()
+    assert noises.shape == (3, 20000)
+    assert np.allclose(np.corrcoef(noises), correlation, atol=0.02)
+    assert np.allclose(noises.std(axis=1), 0.01, rtol=0.02)
+
+    population.reset(2)
+    with pytest.raises(ValueError):
+        population.mid_price_noises()
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from market_simulation_study.agent import RandomAgent
+from market_simulation_study.population import RandomPopulation
+from market_simulation_study.random_streams import RandomStream, RandomStreams
+
+
+def generator(seed: int = 0) -> np.random.Generator:
+    return np.random.Generator(np.random.PCG64(seed))
+
+
+def test_scalar_draws_are_served_from_blocks():
+    stream = RandomStream(generator(), block_size=4)
+    uniforms = [stream.uniform() for _ in range(10)]
+    normals = [stream.normal() for _ in range(6)]
+    reference = generator()
+    expected_uniforms = np.concatenate([reference.random(4) for _ in range(3)])
+    expected_normals = np.concatenate([reference.standard_normal(4) for _ in range(2)])
+    np.testing.assert_array_equal(uniforms, expected_uniforms[:10])
+    np.testing.assert_array_equal(normals, expected_normals[:6])
+    # Scalar draws continue the current block, draws with a size go to the generator
+    assert stream.uniform(2, 4) == 2 + 2 * expected_uniforms[10]
+    np.testing.assert_allclose(stream.normal(1, 3, size=3), reference.normal(1, 3, size=3))
+
+
+@pytest.mark.parametrize("n, p", [(1, 0.5), (10, 0.3), (64, 0.05), (20, 0.9)])
+def test_scalar_binomial_has_the_moments_of_the_generator(n, p):
+    stream = RandomStream(generator(1))
+    draws = np.array([stream.binomial(n, p) for _ in range(40000)])
+    reference = generator(2).binomial(n, p, size=40000)
+    assert draws.min() >= 0 and draws.max() <= n
+    assert draws.mean() == pytest.approx(reference.mean(), abs=4 * np.sqrt(n * p * (1 - p) / 20000))
+    assert draws.var() == pytest.approx(reference.var(), rel=0.05)
+    np.testing.assert_allclose(np.bincount(draws, minlength=n + 1) / len(draws),
+                               np.bincount(reference, minlength=n + 1) / len(reference), atol=0.01)
+
+
+def test_scalar_binomial_edge_cases():
+    stream = RandomStream(generator())
+    assert stream.binomial(5, 0) == 0
+    assert stream.binomial(5, 1) == 5
+    assert 0 <= stream.binomial(100, 0.5) <= 100  # more trials than the inversion handles
+    assert stream.binomial(3, 0.5, size=4).shape == (4,)
+
+
+def test_randint():
+    stream = RandomStream(generator(3))
+    draws = np.array([stream.randint(2, 7) for _ in range(20000)])
+    assert set(draws.tolist()) == {2, 3, 4, 5, 6}
+    np.testing.assert_allclose(np.bincount(draws)[2:] / len(draws), 0.2, atol=0.015)
+    assert all(0 <= stream.randint(3) < 3 for _ in range(100))
+    sized = stream.randint(0, 4, size=(2, 3))
+    assert sized.shape == (2, 3) and sized.min() >= 0 and sized.max() < 4
+
+
+def test_streams_do_not_depend_on_the_population():
+    def draws(agent_ids: list, populations: int) -> dict:
+        agents = [RandomAgent(agent_id=agent_id, delta=1) for agent_id in agent_ids]
+        population_list = [RandomPopulation(3) for _ in range(populations)]
+        RandomStreams(9).attach(agents, populations=population_list)
+        agent_draws = {agent.agent_id: [agent.random.uniform() for _ in range(300)] for agent in agents}
+        population_draws = [population.random.normal(size=5).tolist() for population in population_list]
+        return agent_draws, population_draws
+
+    agent_draws, population_draws = draws([0, 1, 2], populations=1)
+    more_agent_draws, more_population_draws = draws([7, 2, 0, 1], populations=2)
+    for agent_id in (0, 1, 2):
+        assert more_agent_draws[agent_id] == agent_draws[agent_id]
+    assert more_population_draws[0] == population_draws[0]
+    assert more_agent_draws[7] != agent_draws[0]
+    assert more_population_draws[1] != population_draws[0]
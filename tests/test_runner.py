@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from helpers import initial_state
+from market_simulation_study.agent import InvestorAgent, RandomAgent, TrendAgent, MarketMakerAgent
+from market_simulation_study.runner import Scenario, MonteCarloRunner
+
+
+def scenario() -> Scenario:
+    groups = [(InvestorAgent, 1, dict(delta=1, intensity=0.05, n_orders=10)),
+              (RandomAgent, 8, dict(delta=1, noise_range=(0.0001, 0.0003), mid_price_noise=0.0025)),
+              (TrendAgent, 2, dict(delta=1, moving_average_one=lambda: np.random.randint(10, 30),
+                                   moving_average_two=lambda: np.random.randint(50, 100), price_margin=0.005)),
+              (MarketMakerAgent, 8, dict(delta=1, gamma=0.00005, gamma2=2, spread_zero=0.1, n_volume=3))]
+    return Scenario(initial_state(), groups, time_periods=15, warm_up_periods=5,
+                    environment_parameters=dict(matching_engine="array"))
+
+
+def test_results_do_not_depend_on_the_number_of_workers():
+    seeds = [3, 1, 4, 1, 5]
+    serial = MonteCarloRunner(scenario(), n_workers=1).run(seeds)
+    parallel = MonteCarloRunner(scenario(), n_workers=3).run(seeds)
+    for key in ("market_prices", "volumes", "class_pnl"):
+        assert np.array_equal(serial[key], parallel[key]), key
+    assert np.array_equal(serial["market_prices"][1], serial["market_prices"][3])
+
+
+def test_spawned_workers_need_a_picklable_scenario():
+    runner = MonteCarloRunner(scenario(), n_workers=2, start_method="spawn")
+    with pytest.raises(ValueError, match="pickled"):
+        runner.run([1, 2])
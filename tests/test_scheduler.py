@@ -0,0 +1,51 @@
+import numpy as np
+from market_simulation_study.agent import RandomAgent, MarketMakerAgent
+from market_simulation_study.scheduler import LatencyScheduler
+
+
+def agents_with_latencies(latencies: list, agent_ids: list = None) -> list:
+    agent_ids = range(len(latencies)) if agent_ids is None else agent_ids
+    agents = []
+    for agent_id, latency in zip(agent_ids, latencies):
+        agent = RandomAgent(agent_id=agent_id, delta=1)
+        agent.latency = latency
+        agents.append(agent)
+    return agents
+
+
+def test_agents_are_scheduled_by_latency_then_agent_id():
+    agents = agents_with_latencies([1.5, 1.2, 1.5, 1.1], agent_ids=[3, 1, 2, 0])
+    scheduler = LatencyScheduler()
+    assert scheduler.schedule(agents).tolist() == [3, 1, 2, 0]
+    agents[0].latency = 1.0
+    assert scheduler.schedule(agents).tolist() == [0, 3, 1, 2]
+
+
+def test_agents_replaced_in_the_list_are_noticed():
+    agents = agents_with_latencies([1.5, 1.2, 1.5])
+    scheduler = LatencyScheduler()
+    assert scheduler.schedule(agents).tolist() == [1, 0, 2]
+
+    replacement = MarketMakerAgent(agent_id=5, delta=1)
+    replacement.latency = 1.5
+    agents[0] = replacement
+    assert scheduler.schedule(agents).tolist() == [1, 2, 0]
+    assert scheduler.agent_ids.tolist() == [5, 1, 2]
+    assert {agent_class: indices.tolist() for agent_class, indices in scheduler.classes} == {
+        MarketMakerAgent: [0], RandomAgent: [1, 2]}
+
+
+def test_drawn_latencies_reach_replaced_agents():
+    agents = agents_with_latencies([1.0, 1.0, 1.0])
+    scheduler = LatencyScheduler(draw_latencies=True)
+    scheduler.random = np.random.default_rng(0)
+    scheduler.schedule(agents)
+    assert all(agent.latency_scheduled for agent in agents)
+
+    replacement = RandomAgent(agent_id=3, delta=1)
+    agents[1] = replacement
+    scheduler.schedule(agents)
+    assert replacement.latency_scheduled
+    assert [agent.latency for agent in agents] == scheduler.latencies.tolist()
+    assert all(RandomAgent.latency_bounds[0] + 1 <= agent.latency <= RandomAgent.latency_bounds[1] + 1
+               for agent in agents)
@@ -0,0 +1,31 @@
+import numpy as np
+from helpers import initial_state, build_agents, run_steps
+from market_simulation_study.environment import MarketEnvironment
+
+
+def prices_after(environment, agents: list, n_steps: int) -> list:
+    _, state = run_steps(environment, agents, n_steps)
+    return list(state["market_prices"][-n_steps:])
+
+
+def test_fork_leaves_the_global_random_state_alone():
+    np.random.seed(5)
+    environment = MarketEnvironment(initial_state(), matching_engine="array")
+    agents, _ = run_steps(environment, build_agents(), 20)
+    snapshot = environment.snapshot(agents)
+    np.random.seed(11)
+    expected = np.random.random(3)
+    np.random.seed(11)
+    snapshot.fork()
+    assert np.array_equal(np.random.random(3), expected)
+
+
+def test_fork_restoring_the_random_state_continues_the_simulation():
+    np.random.seed(5)
+    environment = MarketEnvironment(initial_state(), matching_engine="array")
+    agents, _ = run_steps(environment, build_agents(), 20)
+    snapshot = environment.snapshot(agents)
+    uninterrupted = prices_after(environment, agents, 30)
+
+    branch_environment, branch_agents = snapshot.fork(restore_random_state=True)
+    assert prices_after(branch_environment, branch_agents, 30) == uninterrupted
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from helpers import initial_state, build_agents, run_steps
+from market_simulation_study.environment import MarketEnvironment
+from market_simulation_study.trade_tape import TradeTape, read_tape
+
+pytest.importorskip("pyarrow")
+
+
+def ledger_fills(environment) -> dict:
+    ledger = environment.ledger
+    traded = ledger.volume.view() != 0
+    return {'sequence': np.arange(len(ledger))[traded],
+            'step': ledger.step.view()[traded],
+            'price': ledger.price.view()[traded],
+            'volume': ledger.volume.view()[traded]}
+
+
+def assert_same_fills(fills, expected: dict):
+    for name, values in expected.items():
+        assert np.array_equal(fills[name].to_numpy(), values), name
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "feather"])
+def test_tape_reads_back_the_traded_fills_of_the_ledger(tmp_path, file_format):
+    np.random.seed(1)
+    tape = TradeTape(str(tmp_path), run="test", chunk_size=64, file_format=file_format, compression="uncompressed")
+    environment = MarketEnvironment(initial_state(), matching_engine="array", trade_tape=tape)
+    run_steps(environment, build_agents(), 40)
+    tape.close()
+
+    fills = read_tape(str(tmp_path))
+    assert tape.n_chunks > 1
+    assert (fills['volume'] > 0).all()
+    assert set(fills['run']) == {"test"} and set(fills['branch']) == {"0"}
+    assert_same_fills(fills, ledger_fills(environment))
+
+
+def test_forked_tapes_write_their_own_branches(tmp_path):
+    np.random.seed(1)
+    tape = TradeTape(str(tmp_path), chunk_size=16)
+    environment = MarketEnvironment(initial_state(), matching_engine="array", trade_tape=tape)
+    agents, _ = run_steps(environment, build_agents(), 10)
+    snapshot = environment.snapshot(agents)
+    n_forked = len(environment.ledger)
+    run_steps(environment, agents, 20)
+    environment.trade_tape.close()
+    branch_environment, branch_agents = snapshot.fork(seed=2)
+    run_steps(branch_environment, branch_agents, 20)
+    branch_environment.trade_tape.close()
+
+    assert branch_environment.trade_tape.branch == "0.1.1"
+    assert_same_fills(read_tape(str(tmp_path), branch="0"), ledger_fills(environment))
+    branch_fills = read_tape(str(tmp_path), branch="0.1.1")
+    expected = ledger_fills(branch_environment)
+    after_fork = expected['sequence'] >= n_forked
+    assert (branch_fills['sequence'] >= n_forked).all()
+    assert_same_fills(branch_fills, {name: values[after_fork] for name, values in expected.items()})
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+from helpers import initial_state
+from market_simulation_study.agent import RandomAgent
+from market_simulation_study.environment import MarketEnvironment
+from market_simulation_study.population import Population, RandomPopulation, TrendPopulation, MarketMakerPopulation
+from market_simulation_study.vectorized_environment import VectorizedMarketEnvironment
+
+
+class QuotePopulation(Population):
+    """
+    Population submitting given quotes, one array of buy prices, buy volumes, sell prices, sell volumes and latencies
+    of shape (markets, agents) per step
+    """
+    agent_class = RandomAgent
+
+    def __init__(self, quotes: np.ndarray):
+        super().__init__(quotes.shape[-1])
+        self.quotes = quotes
+        self.step = 0
+
+    def update(self, prices: np.ndarray, positions: np.ndarray) -> tuple:
+        buy_prices, buy_volumes, sell_prices, sell_volumes, self.latency = self.quotes[self.step]
+        self.step += 1
+        return buy_prices, buy_volumes, sell_prices, sell_volumes
+
+
+def random_quotes(n_steps: int, n_markets: int, n_agents: int, seed: int = 0) -> np.ndarray:
+    """
+    Crossing quotes around a price of 100 with missing prices, orders without volume and tied latencies
+    """
+    generator = np.random.default_rng(seed)
+    shape = (n_steps, n_markets, n_agents)
+    buy_prices = 100 * (1 + generator.normal(-0.001, 0.002, size=shape))
+    sell_prices = 100 * (1 + generator.normal(0.001, 0.002, size=shape))
+    buy_prices[generator.random(shape) < 0.2] = np.nan
+    sell_prices[generator.random(shape) < 0.2] = np.nan
+    buy_volumes = generator.integers(0, 5, size=shape).astype(float)
+    sell_volumes = generator.integers(0, 5, size=shape).astype(float)
+    latencies = 1 + generator.integers(0, 3, size=shape).astype(float)
+    return np.stack((buy_prices, buy_volumes, sell_prices, sell_volumes, latencies), axis=1)
+
+
+def sorted_fills(environment: VectorizedMarketEnvironment) -> tuple:
+    markets = environment.fills[0]
+    order = np.argsort(markets, kind="stable")
+    return tuple(column[order] for column in environment.fills)
+
+
+def build_populations(seed: int) -> list:
+    np.random.seed(seed)
+    return [RandomPopulation(20, noise_range=(0.0001, 0.0003), mid_price_noise=0.0025),
+            TrendPopulation(5, moving_average_one=lambda size: np.random.randint(10, 30, size),
+                            moving_average_two=lambda size: np.random.randint(50, 100, size), price_margin=0.005),
+            MarketMakerPopulation(10, gamma=0.00005, gamma2=lambda size: np.random.randint(1, 3, size),
+                                  spread_zero=0.1, n_volume=3)]
+
+
+@pytest.mark.parametrize("populations", ["quotes", "simulated"])
+def test_batch_and_sequential_engines_agree(populations):
+    environments = []
+    for matching_engine in ("batch", "sequential"):
+        if populations == "quotes":
+            population_list = [QuotePopulation(random_quotes(20, 4, 30))]
+        else:
+            population_list = build_populations(seed=2)
+        environment = VectorizedMarketEnvironment(initial_state(2), population_list, n_markets=4,
+                                                  matching_engine=matching_engine)
+        fills = []
+        for _ in range(20):
+            environment.step()
+            fills.append(sorted_fills(environment))
+        environments.append((environment, fills))
+        assert environment.positions.any(axis=1).all()
+
+    (batch, batch_fills), (sequential, sequential_fills) = environments
+    for batch_step, sequential_step in zip(batch_fills, sequential_fills):
+        for batch_column, sequential_column in zip(batch_step, sequential_step):
+            np.testing.assert_array_equal(batch_column, sequential_column)
+    np.testing.assert_array_equal(batch.market_prices.view(), sequential.market_prices.view())
+    np.testing.assert_array_equal(batch.positions, sequential.positions)
+    np.testing.assert_allclose(batch.cash, sequential.cash)
+
+
+@pytest.mark.parametrize("matching_engine", ["batch", "sequential"])
+def test_single_market_reproduces_the_array_engine(matching_engine):
+    n_steps, n_agents = 30, 25
+    quotes = random_quotes(n_steps, 1, n_agents, seed=3)
+    vectorized = VectorizedMarketEnvironment(initial_state(3), [QuotePopulation(quotes)], n_markets=1,
+                                             matching_engine=matching_engine)
+    environment = MarketEnvironment(initial_state(3), matching_engine="array")
+    agents = [RandomAgent(agent_id=j, delta=1) for j in range(n_agents)]
+
+    for step in range(n_steps):
+        for agent, (buy_price, buy_volume, sell_price, sell_volume, latency) in zip(agents, quotes[step, :, 0].T):
+            agent.buy_price, agent.buy_volume, agent.sell_price, agent.sell_volume = (buy_price, buy_volume,
+                                                                                      sell_price, sell_volume)
+            agent.latency = latency
+            agent.submit_orders()
+        agents, state = environment.step(agents)
+        vectorized_state = vectorized.step()
+
+        ledger = environment.ledger
+        in_step = ledger.step.view() == step
+        markets, prices, volumes, buyers, sellers = vectorized.fills
+        np.testing.assert_array_equal(prices, ledger.price.view()[in_step])
+        np.testing.assert_array_equal(volumes, ledger.volume.view()[in_step])
+        np.testing.assert_array_equal(buyers, ledger.buyer.view()[in_step])
+        np.testing.assert_array_equal(sellers, ledger.seller.view()[in_step])
+        assert vectorized_state["n_trades"][0] == state["n_trades"]
+        np.testing.assert_equal(vectorized_state["mean_buy_price"][0], state["mean_buy_price"])
+
+    assert len(environment.ledger.price.view()) > 0
+    np.testing.assert_array_equal(vectorized.market_prices.view()[:, 0], state["market_prices"])
+    np.testing.assert_array_equal(vectorized.positions[0], [agent.position for agent in agents])
+    np.testing.assert_allclose(vectorized.calculate_profit_and_loss()[0], environment.calculate_profit_and_loss())